@@ -1 +1,6 @@
 config.visitKeys = ['expId']  # noqa: F821
+
+# Statistic combining the inputs: "MEANCLIP" or "MEDIAN".  The inputs
+# are read in blocks of combination.rows rows, which DATA/SConscript
+# sets from the CI_CPP_COMBINE_MEMORY budget.
+config.combination.combine = "MEANCLIP"  # noqa: F821
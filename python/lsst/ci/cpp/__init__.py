@@ -19,4 +19,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from .version import *  # Generated by sconsUtils
+try:
+    from .version import *  # Generated by sconsUtils
+except ImportError:
+    # DATA/SConscript imports the build helpers in this package before
+    # sconsUtils has generated version.py.
+    pass
@@ -0,0 +1,243 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Per-amplifier image statistics computed for all amplifiers at once.
+"""
+
+__all__ = ["calculateAmpStatistics", "makeAmpCube", "makeAmpStack"]
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .resources import getProcessCores
+
+
+# Conversion from interquartile range to standard deviation for a
+# Gaussian, matching lsst.afw.math.
+IQ_TO_STDEV = 0.741301109252802
+
+
+def makeAmpStack(array, bboxes, xy0=(0, 0)):
+    """Stack the pixels of each amplifier into one array.
+
+    Parameters
+    ----------
+    array : `numpy.ndarray`, (Ny, Nx)
+        Image-like array to extract amplifiers from.
+    bboxes : `list` [`lsst.geom.Box2I`]
+        Bounding box of each amplifier, in the coordinate system of
+        ``array``'s parent image.
+    xy0 : `tuple` [`int`, `int`], optional
+        Origin of ``array`` in that coordinate system.
+
+    Returns
+    -------
+    stack : `numpy.ndarray`, (nAmp, nPix)
+        Flattened pixels of each amplifier.  Amplifiers smaller than
+        the largest are padded with zeros.
+    padding : `numpy.ndarray`, (nAmp, nPix)
+        `True` for padding pixels that are not part of an amplifier.
+    """
+    x0, y0 = xy0
+    sizes = [bbox.getArea() for bbox in bboxes]
+    nPix = max(sizes)
+
+    stack = np.zeros((len(bboxes), nPix), dtype=array.dtype)
+    padding = np.zeros((len(bboxes), nPix), dtype=bool)
+    for index, (bbox, size) in enumerate(zip(bboxes, sizes)):
+        stack[index, :size] = array[bbox.getMinY() - y0:bbox.getMaxY() + 1 - y0,
+                                    bbox.getMinX() - x0:bbox.getMaxX() + 1 - x0].ravel()
+        padding[index, size:] = True
+    return stack, padding
+
+
+def makeAmpCube(array, bboxes, xy0=(0, 0)):
+    """Stack equally sized amplifiers into a three-dimensional array.
+
+    Parameters
+    ----------
+    array : `numpy.ndarray`, (Ny, Nx)
+        Image-like array to extract amplifiers from.
+    bboxes : `list` [`lsst.geom.Box2I`]
+        Bounding box of each amplifier, in the coordinate system of
+        ``array``'s parent image.
+    xy0 : `tuple` [`int`, `int`], optional
+        Origin of ``array`` in that coordinate system.
+
+    Returns
+    -------
+    cube : `numpy.ndarray`, (nAmp, ny, nx)
+        Pixels of each amplifier, keeping their layout.
+
+    Raises
+    ------
+    ValueError
+        Raised if the amplifiers differ in size.
+    """
+    shapes = {(bbox.getHeight(), bbox.getWidth()) for bbox in bboxes}
+    if len(shapes) != 1:
+        raise ValueError(f"Amplifiers must all have the same size, not {sorted(shapes)}.")
+    x0, y0 = xy0
+    return np.stack([array[bbox.getMinY() - y0:bbox.getMaxY() + 1 - y0,
+                           bbox.getMinX() - x0:bbox.getMaxX() + 1 - x0] for bbox in bboxes])
+
+
+def _percentiles(sortedValues, nGood, fractions):
+    """Interpolate percentiles from rows of sorted values.
+
+    Parameters
+    ----------
+    sortedValues : `numpy.ndarray`, (nAmp, nPix)
+        Values sorted along each row, with the ``nGood`` valid entries
+        first.
+    nGood : `numpy.ndarray`, (nAmp,)
+        Number of valid entries in each row.
+    fractions : `list` [`float`]
+        Percentiles to compute, as fractions in [0, 1].
+
+    Returns
+    -------
+    percentiles : `numpy.ndarray`, (len(fractions), nAmp)
+        Linearly interpolated percentiles; NaN for empty rows.
+    """
+    results = np.full((len(fractions), len(nGood)), np.nan)
+    rows = np.flatnonzero(nGood > 0)
+    for index, fraction in enumerate(fractions):
+        position = fraction*(nGood[rows] - 1)
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower + 1, nGood[rows] - 1)
+        weight = position - lower
+        results[index, rows] = ((1.0 - weight)*sortedValues[rows, lower]
+                                + weight*sortedValues[rows, upper])
+    return results
+
+
+def _rowStatistics(values, good, nSigmaClip, nIter):
+    """Compute the statistics of rows of values.
+
+    Parameters
+    ----------
+    values : `numpy.ndarray`, (nAmp, nPix)
+        Values of each amplifier, NaN where not ``good``.
+    good : `numpy.ndarray`, (nAmp, nPix)
+        Pixels to use.
+    nSigmaClip, nIter
+        See `calculateAmpStatistics`.
+
+    Returns
+    -------
+    statistics : `numpy.ndarray`, (4, nAmp)
+        Mean, median, standard deviation and clipped standard deviation.
+    """
+    nGood = good.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sums = np.where(good, values, 0.0).sum(axis=1)
+        mean = sums/nGood
+        stdev = np.sqrt(np.where(good, (values - mean[:, np.newaxis])**2, 0.0).sum(axis=1)
+                        / (nGood - 1))
+
+        # NaN sorts to the end of each row, leaving the good values first.
+        sortedValues = np.sort(values, axis=1)
+        lowerQuartile, median, upperQuartile = _percentiles(sortedValues, nGood, [0.25, 0.5, 0.75])
+
+        center = median
+        halfWidth = nSigmaClip*IQ_TO_STDEV*(upperQuartile - lowerQuartile)
+        stdevClip = np.full(len(values), np.nan)
+        for _ in range(nIter):
+            clipped = good & (np.abs(values - center[:, np.newaxis]) < halfWidth[:, np.newaxis])
+            nClipped = clipped.sum(axis=1)
+            center = np.where(clipped, values, 0.0).sum(axis=1)/nClipped
+            stdevClip = np.sqrt(np.where(clipped, (values - center[:, np.newaxis])**2, 0.0).sum(axis=1)
+                                / (nClipped - 1))
+            halfWidth = nSigmaClip*stdevClip
+    return np.array([mean, median, stdev, stdevClip])
+
+
+def calculateAmpStatistics(exposure, detector=None, badMaskPlanes=("SAT", "BAD", "NO_DATA"),
+                           nSigmaClip=5.0, nIter=5, badPixels=None, nThreads=None):
+    """Calculate MEAN, MEDIAN, STDEV and STDEVCLIP for every amplifier.
+
+    The statistics follow the definitions used by `lsst.afw.math`:
+    the standard deviations are sample standard deviations, and the
+    clipped value starts from the median and interquartile range
+    before iterating on the clipped mean and standard deviation.
+
+    Parameters
+    ----------
+    exposure : `lsst.afw.image.Exposure`
+        Assembled exposure to measure.
+    detector : `lsst.afw.cameraGeom.Detector`, optional
+        Detector describing the amplifier layout.  Defaults to the
+        detector attached to ``exposure``.
+    badMaskPlanes : `list` [`str`], optional
+        Mask planes of pixels to exclude from all statistics.
+    nSigmaClip : `float`, optional
+        Number of standard deviations to clip at.
+    nIter : `int`, optional
+        Number of clipping iterations.
+    badPixels : `numpy.ndarray` [`bool`], optional
+        Further pixels to exclude, with the shape of the image, such as
+        the mask from `lsst.ci.cpp.cosmicRays.findCosmicRayMask`.
+    nThreads : `int`, optional
+        Number of threads the amplifiers are split between.  Defaults
+        to the number of amplifiers or the cores of this process,
+        whichever is smaller; see
+        `lsst.ci.cpp.resources.getProcessCores`.
+
+    Returns
+    -------
+    statistics : `dict` [`str`, `dict` [`str`, `float`]]
+        Statistics keyed by amplifier name and then by statistic name.
+    """
+    if detector is None:
+        detector = exposure.getDetector()
+    amps = list(detector)
+    bboxes = [amp.getBBox() for amp in amps]
+    xy0 = (exposure.getX0(), exposure.getY0())
+
+    values, padding = makeAmpStack(exposure.getImage().getArray(), bboxes, xy0)
+    maskBits, _ = makeAmpStack(exposure.getMask().getArray(), bboxes, xy0)
+    bad = padding | ((maskBits & exposure.getMask().getPlaneBitMask(list(badMaskPlanes))) != 0)
+    if badPixels is not None:
+        bad |= makeAmpStack(badPixels, bboxes, xy0)[0]
+    values = values.astype(np.float64)
+    bad |= ~np.isfinite(values)
+    good = ~bad
+    values[bad] = np.nan
+
+    # The sorts and reductions release the GIL, so groups of amplifiers
+    # are evaluated in parallel threads.
+    if nThreads is None:
+        nThreads = min(len(amps), getProcessCores())
+    groups = [rows for rows in np.array_split(np.arange(len(amps)), max(nThreads, 1)) if len(rows)]
+    if len(groups) > 1:
+        with ThreadPoolExecutor(len(groups)) as pool:
+            parts = list(pool.map(lambda rows: _rowStatistics(values[rows], good[rows], nSigmaClip, nIter),
+                                  groups))
+        mean, median, stdev, stdevClip = np.concatenate(parts, axis=1)
+    else:
+        mean, median, stdev, stdevClip = _rowStatistics(values, good, nSigmaClip, nIter)
+
+    return {amp.getName(): {"MEAN": mean[index],
+                            "MEDIAN": median[index],
+                            "STDEV": stdev[index],
+                            "STDEVCLIP": stdevClip[index]}
+            for index, amp in enumerate(amps)}
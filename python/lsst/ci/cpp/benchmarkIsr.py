@@ -0,0 +1,197 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Timing benchmark of the ISR configurations used by this package.
+"""
+
+__all__ = ["benchmarkIsr", "compareToBaseline", "getBenchmarkCases", "main"]
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import lsst.daf.persistence as dafPersist
+import lsst.ip.isr as ipIsr
+from lsst.utils import getPackageDir
+
+from .detectors import loadManifest
+from .isrConfigs import makeIsrConfig, makePipelineIsrConfigs
+
+
+def getBenchmarkCases(manifest):
+    """Return the ISR configurations to benchmark.
+
+    Parameters
+    ----------
+    manifest : `dict`
+        Test data manifest.
+
+    Returns
+    -------
+    cases : `dict` [`str`, `tuple`]
+        The `~lsst.ip.isr.IsrTaskConfig` and the exposure id to process
+        for each configuration.  The test configurations use the same
+        exposures as the tests; the pipeline configurations use the
+        first exposure they process in DATA/SConscript.
+    """
+    pipelineConfigs = makePipelineIsrConfigs()
+    firstPtcExposure = int(str(manifest["ptcExposurePairs"][0]).split(",")[0])
+    return {
+        "bias": (makeIsrConfig(), 2020012800007),
+        "dark": (makeIsrConfig(doDark=True), 2020012800014),
+        "flatDefect": (makeIsrConfig(doDark=True, doFlat=True, doDefect=True), 2020012800028),
+        "crosstalkIsr": (pipelineConfigs["crosstalkIsr"], manifest["scienceVisits"][0]),
+        "defectIsr": (pipelineConfigs["defectIsr"], manifest["flatExposures"][0]),
+        "ptcIsr": (pipelineConfigs["ptcIsr"], firstPtcExposure),
+    }
+
+
+def benchmarkIsr(butler, cases, detector=0, warmup=1, repeat=5):
+    """Time ISR for each configuration.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.persistence.Butler`
+        Butler for the data repository.
+    cases : `dict` [`str`, `tuple`]
+        Configurations to time, as returned by `getBenchmarkCases`.
+    detector : `int`, optional
+        Detector to process.
+    warmup : `int`, optional
+        Untimed runs before timing, to populate filesystem and import
+        caches.
+    repeat : `int`, optional
+        Number of timed runs.
+
+    Returns
+    -------
+    results : `dict` [`str`, `dict`]
+        Minimum, median and mean time and all run times, in seconds,
+        for each configuration.
+    """
+    results = {}
+    for name, (config, expId) in cases.items():
+        isrTask = ipIsr.IsrTask(config=config)
+        dataRef = butler.dataRef('raw', dataId={'detector': detector, 'expId': expId})
+        for _ in range(warmup):
+            isrTask.runDataRef(dataRef)
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            isrTask.runDataRef(dataRef)
+            times.append(time.perf_counter() - start)
+        results[name] = {"min": min(times), "median": statistics.median(times),
+                         "mean": statistics.mean(times), "times": times}
+    return results
+
+
+def compareToBaseline(results, baseline, threshold):
+    """Find configurations that are slower than the baseline.
+
+    Parameters
+    ----------
+    results : `dict` [`str`, `dict`]
+        Results from `benchmarkIsr`.
+    baseline : `dict` [`str`, `dict`]
+        Earlier results to compare against.
+    threshold : `float`
+        Largest allowed fractional increase of the median time.
+
+    Returns
+    -------
+    regressions : `dict` [`str`, `float`]
+        Fractional slowdown of each configuration exceeding the
+        threshold.
+    """
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result["median"]/baseline[name]["median"] - 1.0
+        if change > threshold:
+            regressions[name] = change
+    return regressions
+
+
+def main():
+    dataDir = os.path.join(getPackageDir("ci_cpp_gen2"), "DATA")
+    parser = argparse.ArgumentParser(description="Benchmark the ISR configurations used by ci_cpp_gen2.")
+    parser.add_argument("--repo", default=dataDir, help="Data repository.")
+    parser.add_argument("--calib", default=os.path.join(dataDir, "calibs"),
+                        help="Calibration repository.")
+    parser.add_argument("--detector", type=int, default=0, help="Detector to process.")
+    parser.add_argument("--configs", nargs="+", help="Configurations to run (default: all).")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per configuration.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per configuration.")
+    parser.add_argument("--history", default=os.path.join(dataDir, "benchmarks", "isrHistory.jsonl"),
+                        help="File the results are appended to.")
+    parser.add_argument("--baseline", default=os.path.join(dataDir, "benchmarks", "isrBaseline.json"),
+                        help="Results to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Fractional slowdown of the median time that counts as a regression.")
+    parser.add_argument("--write-baseline", action="store_true",
+                        help="Store these results as the new baseline.")
+    args = parser.parse_args()
+
+    cases = getBenchmarkCases(loadManifest())
+    if args.configs:
+        unknown = set(args.configs) - set(cases)
+        if unknown:
+            parser.error(f"Unknown configurations: {sorted(unknown)}; choose from {sorted(cases)}.")
+        cases = {name: cases[name] for name in args.configs}
+
+    butler = dafPersist.Butler(args.repo, calibRoot=args.calib)
+    results = benchmarkIsr(butler, cases, args.detector, args.warmup, args.repeat)
+    record = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "host": platform.node(),
+              "ip_isr": os.environ.get("SETUP_IP_ISR", "unknown"),
+              "detector": args.detector,
+              "results": results}
+
+    os.makedirs(os.path.dirname(args.history), exist_ok=True)
+    with open(args.history, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    regressions = compareToBaseline(results, baseline, args.threshold)
+
+    print(f"{'configuration':<14} {'min[s]':>8} {'median[s]':>10} {'baseline[s]':>12} {'change':>8}")
+    for name, result in results.items():
+        if name in baseline:
+            base = f"{baseline[name]['median']:>12.2f}"
+            change = f"{result['median']/baseline[name]['median'] - 1.0:>+8.1%}"
+        else:
+            base, change = f"{'-':>12}", f"{'-':>8}"
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:<14} {result['min']:>8.2f} {result['median']:>10.2f} {base} {change}{flag}")
+
+    if args.write_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(record, f, indent=2)
+    sys.exit(1 if regressions else 0)
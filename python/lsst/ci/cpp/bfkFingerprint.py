@@ -0,0 +1,278 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Compact fingerprints of the brighter-fatter kernels built by bfkGen.
+
+A fingerprint holds each kernel array and a few summary moments of it,
+in one compressed ``.npz`` file.  Comparing the kernels of a build
+against a stored fingerprint only reads the kernels themselves, not the
+pair products they were measured from.
+"""
+
+__all__ = ["compareFingerprints", "computeMoments", "getGoldenPath", "getKernelArrays",
+           "loadBuiltKernels", "main", "readFingerprint", "writeFingerprint"]
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+
+# Summary moments stored with each kernel, in the order of
+# `computeMoments`.
+MOMENT_NAMES = ("sum", "peak", "xCentroid", "yCentroid", "xxMoment", "yyMoment", "xyMoment")
+
+
+def getGoldenPath(tier=None):
+    """Return the stored fingerprint of the reference kernels.
+
+    The tiers build the kernels from different exposures, so each has
+    its own fingerprint.
+
+    Parameters
+    ----------
+    tier : `str`, optional
+        Tier the kernels were built with.  Defaults to
+        `lsst.ci.cpp.tiers.getTier`.
+
+    Returns
+    -------
+    path : `str`
+        ``tests/data/bfkFingerprint-<tier>.npz`` in this package.
+    """
+    from lsst.utils import getPackageDir
+
+    from .tiers import getTier
+
+    return os.path.join(getPackageDir("ci_cpp_gen2"), "tests", "data",
+                        f"bfkFingerprint-{tier or getTier()}.npz")
+
+
+def getKernelArrays(kernel):
+    """Extract the kernel arrays of a brighter-fatter kernel dataset.
+
+    Parameters
+    ----------
+    kernel : `object`
+        A kernel array, or a ``BrighterFatterKernel`` holding per
+        amplifier or per detector kernels.
+
+    Returns
+    -------
+    arrays : `dict` [`str`, `numpy.ndarray`]
+        Kernel arrays, keyed by amplifier or detector name.
+    """
+    if isinstance(kernel, np.ndarray):
+        return {"detector": kernel}
+    for attribute in ("ampKernels", "detKernels", "kernel"):
+        kernels = getattr(kernel, attribute, None)
+        if kernels is None:
+            continue
+        if isinstance(kernels, np.ndarray):
+            return {"detector": kernels}
+        if len(kernels):
+            return {str(name): np.asarray(array) for name, array in kernels.items()}
+    raise TypeError(f"Cannot find kernel arrays in {type(kernel).__name__}.")
+
+
+def computeMoments(array):
+    """Compute the summary moments of a kernel.
+
+    Parameters
+    ----------
+    array : `numpy.ndarray`, (ny, nx)
+        Kernel.
+
+    Returns
+    -------
+    moments : `numpy.ndarray`
+        Sum, peak absolute value, centroid and second moments about the
+        centroid, weighted by the absolute kernel values, in the order of
+        `MOMENT_NAMES`.
+    """
+    array = np.asarray(array, dtype=np.float64)
+    weights = np.abs(array)
+    total = weights.sum()
+    y, x = np.indices(array.shape, dtype=np.float64)
+    if total == 0:
+        return np.array([0.0, 0.0, np.nan, np.nan, np.nan, np.nan, np.nan])
+    xCentroid = (weights*x).sum()/total
+    yCentroid = (weights*y).sum()/total
+    dx, dy = x - xCentroid, y - yCentroid
+    return np.array([array.sum(), weights.max(), xCentroid, yCentroid,
+                     (weights*dx*dx).sum()/total, (weights*dy*dy).sum()/total,
+                     (weights*dx*dy).sum()/total])
+
+
+def writeFingerprint(path, kernels):
+    """Write the fingerprint of some kernels.
+
+    Parameters
+    ----------
+    path : `str`
+        File to write.
+    kernels : `dict` [`str`, `dict` [`str`, `numpy.ndarray`]]
+        Kernel arrays, keyed by detector and then by kernel name.
+    """
+    contents = {}
+    for detector, arrays in kernels.items():
+        for name, array in arrays.items():
+            contents[f"{detector}/{name}/kernel"] = np.asarray(array, dtype=np.float64)
+            contents[f"{detector}/{name}/moments"] = computeMoments(array)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **contents)
+
+
+def readFingerprint(path):
+    """Read a fingerprint written by `writeFingerprint`.
+
+    Parameters
+    ----------
+    path : `str`
+        File to read.
+
+    Returns
+    -------
+    fingerprint : `dict` [`str`, `dict` [`str`, `tuple`]]
+        The kernel array and moments, keyed by detector and kernel name.
+    """
+    fingerprint = {}
+    with np.load(path) as contents:
+        for key in contents.files:
+            detector, name, part = key.rsplit("/", 2)
+            if part != "kernel":
+                continue
+            fingerprint.setdefault(detector, {})[name] = (contents[key],
+                                                          contents[f"{detector}/{name}/moments"])
+    return fingerprint
+
+
+def compareFingerprints(reference, kernels, rtol=1e-3, atol=1e-3):
+    """Compare kernels with a stored fingerprint.
+
+    Parameters
+    ----------
+    reference : `dict` [`str`, `dict` [`str`, `tuple`]]
+        Fingerprint from `readFingerprint`.
+    kernels : `dict` [`str`, `dict` [`str`, `numpy.ndarray`]]
+        Kernel arrays, keyed by detector and then by kernel name.
+    rtol : `float`, optional
+        Relative tolerance of the moments and of the kernel values.
+    atol : `float`, optional
+        Absolute tolerance.  For the kernel values, sum and peak it is a
+        fraction of the reference kernel's peak; for the centroid and
+        second moments it is in pixels.
+
+    Returns
+    -------
+    differences : `list` [`str`]
+        Description of each difference; empty if the kernels match.
+    """
+    differences = []
+    for detector in sorted(set(reference) | set(kernels), key=str):
+        names = set(reference.get(detector, {})) | set(kernels.get(detector, {}))
+        for name in sorted(names):
+            label = f"detector {detector} kernel {name}"
+            if name not in kernels.get(detector, {}):
+                differences.append(f"{label} is missing.")
+                continue
+            if name not in reference.get(detector, {}):
+                differences.append(f"{label} is not in the fingerprint.")
+                continue
+            refArray, refMoments = reference[detector][name]
+            array = np.asarray(kernels[detector][name], dtype=np.float64)
+            if array.shape != refArray.shape:
+                differences.append(f"{label} has shape {array.shape}, not {refArray.shape}.")
+                continue
+
+            scale = refMoments[MOMENT_NAMES.index("peak")]
+            moments = computeMoments(array)
+            for momentName, value, refValue in zip(MOMENT_NAMES, moments, refMoments):
+                momentAtol = atol*scale if momentName in ("sum", "peak") else atol
+                if not np.isclose(value, refValue, rtol=rtol, atol=momentAtol, equal_nan=True):
+                    differences.append(f"{label} {momentName} is {value:.6g}, not {refValue:.6g}.")
+            mismatch = ~np.isclose(array, refArray, rtol=rtol, atol=atol*scale, equal_nan=True)
+            if mismatch.any():
+                worst = np.nanmax(np.abs(array - refArray))
+                differences.append(f"{label} differs in {mismatch.sum()} of {mismatch.size} pixels, "
+                                   f"by up to {worst:.6g}.")
+    return differences
+
+
+def loadBuiltKernels(repoDir, calibDir, detectors):
+    """Read the kernels built by the bfkGen stage.
+
+    Parameters
+    ----------
+    repoDir : `str`
+        Root of the bfkGen rerun.
+    calibDir : `str`
+        Root of the calibration repository.
+    detectors : `list` [`int`]
+        Detectors to read.
+
+    Returns
+    -------
+    kernels : `dict` [`str`, `dict` [`str`, `numpy.ndarray`]]
+        Kernel arrays, keyed by detector and then by kernel name.
+    """
+    from .sharedButler import getSharedButler
+
+    butler = getSharedButler(repoDir, calibDir)
+    return {str(detector): getKernelArrays(butler.get('brighterFatterKernel',
+                                                      dataId={'detector': detector}))
+            for detector in detectors}
+
+
+def main():
+    from lsst.utils import getPackageDir
+
+    from .detectors import getDetectorList, loadManifest
+
+    dataDir = os.path.join(getPackageDir("ci_cpp_gen2"), "DATA")
+    parser = argparse.ArgumentParser(description="Compare the bfkGen kernels with a stored fingerprint.")
+    parser.add_argument("--repo", default=os.path.join(dataDir, "bfkGen"), help="bfkGen rerun.")
+    parser.add_argument("--calib", default=os.path.join(dataDir, "calibs"),
+                        help="Calibration repository.")
+    parser.add_argument("--fingerprint", default=getGoldenPath(), help="Stored fingerprint.")
+    parser.add_argument("--rtol", type=float, default=1e-3, help="Relative tolerance.")
+    parser.add_argument("--atol", type=float, default=1e-3,
+                        help="Absolute tolerance, as a fraction of the kernel peak.")
+    parser.add_argument("--write", action="store_true",
+                        help="Store the fingerprint of these kernels instead of comparing.")
+    args = parser.parse_args()
+
+    kernels = loadBuiltKernels(args.repo, args.calib, getDetectorList(loadManifest()))
+    if args.write:
+        writeFingerprint(args.fingerprint, kernels)
+        print(f"Wrote {args.fingerprint}.")
+        return
+    if not os.path.exists(args.fingerprint):
+        parser.error(f"No fingerprint at {args.fingerprint}; create it with --write.")
+    differences = compareFingerprints(readFingerprint(args.fingerprint), kernels, args.rtol, args.atol)
+    for difference in differences:
+        print(difference)
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == "__main__":
+    main()
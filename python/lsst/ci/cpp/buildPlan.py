@@ -0,0 +1,284 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Plan of the DATA/SConscript stages, estimated from earlier builds.
+
+The wall time, CPU time and peak memory of each stage are taken from the
+build reports of `lsst.ci.cpp.stageMonitor`.  From these, `formatPlan`
+predicts the duration of each stage for a core allocation, the critical
+path through the stage graph, and the makespan of a build run with a
+number of SCons jobs.
+
+This module is imported while SCons reads the build scripts, so it must
+only depend on the standard library.
+"""
+
+__all__ = ["criticalPath", "estimateStageCosts", "formatPlan", "predictStage", "simulateBuild"]
+
+import heapq
+import re
+import statistics
+
+
+_JOBS_PATTERN = re.compile(r"(?:^|\s)-j\s*(\d+)(?=\s|$)")
+
+
+def _commandCores(command):
+    """Return the number of processes a command was given with ``-j``.
+    """
+    match = _JOBS_PATTERN.search(command)
+    return int(match.group(1)) if match else 1
+
+
+def estimateStageCosts(reports):
+    """Estimate the cost of each stage from earlier builds.
+
+    Parameters
+    ----------
+    reports : `list` [`list` [`dict`]]
+        Stage records of each build, as returned by
+        `lsst.ci.cpp.stageMonitor.loadBuildReports`.
+
+    Returns
+    -------
+    costs : `dict` [`str`, `dict` [`str`, `float`]]
+        For each stage, the median over the builds it ran successfully
+        in of its ``wallTime`` and ``cpuTime`` (summed over its
+        commands, in seconds) and of its ``peakRss`` (the largest of its
+        commands, in bytes), the largest number of ``cores`` its commands
+        were given, and the number of ``builds`` used.
+    """
+    perBuild = {}
+    for records in reports:
+        totals = {}
+        failed = set()
+        for record in records:
+            stage = record["stage"]
+            if record["exitCode"] != 0:
+                failed.add(stage)
+                continue
+            total = totals.setdefault(stage, {"wallTime": 0.0, "cpuTime": 0.0, "peakRss": 0,
+                                              "cores": 1})
+            total["wallTime"] += record["wallTime"]
+            total["cpuTime"] += record["cpuTime"]
+            total["peakRss"] = max(total["peakRss"], record["peakRss"] or record["maxProcessRss"] or 0)
+            total["cores"] = max(total["cores"], _commandCores(record["command"]))
+        for stage, total in totals.items():
+            if stage not in failed:
+                perBuild.setdefault(stage, []).append(total)
+
+    costs = {}
+    for stage, totals in perBuild.items():
+        costs[stage] = {key: statistics.median(total[key] for total in totals)
+                        for key in ("wallTime", "cpuTime", "peakRss")}
+        costs[stage]["cores"] = max(total["cores"] for total in totals)
+        costs[stage]["builds"] = len(totals)
+    return costs
+
+
+def predictStage(cost, cores):
+    """Predict the wall time and memory of a stage for a core allocation.
+
+    The stage is assumed to use as many cores as its recorded CPU time
+    per wall time, at most the number it was given.  With fewer cores,
+    its CPU time is spread over them; with more, it is not assumed to
+    get any faster.
+
+    Parameters
+    ----------
+    cost : `dict` [`str`, `float`]
+        Cost of the stage, from `estimateStageCosts`.
+    cores : `int`
+        Number of cores the stage is given.
+
+    Returns
+    -------
+    wallTime : `float`
+        Predicted wall time, in seconds.
+    peakRss : `float`
+        Predicted peak memory, in bytes, scaled with the number of
+        processes the stage runs.
+    """
+    wallTime = cost["wallTime"]
+    if wallTime <= 0:
+        return 0.0, float(cost["peakRss"])
+    parallelism = min(max(1.0, cost["cpuTime"]/wallTime), cost["cores"])
+    used = min(max(1, cores), parallelism)
+    return wallTime*parallelism/used, cost["peakRss"]*max(1.0, used)/parallelism
+
+
+def criticalPath(graph, durations):
+    """Find the longest chain of dependent stages.
+
+    Parameters
+    ----------
+    graph : `dict` [`str`, `list` [`str`]]
+        Upstream stages of each stage, in an order where every stage
+        follows its upstream stages.
+    durations : `dict` [`str`, `float`]
+        Wall time of each stage.
+
+    Returns
+    -------
+    path : `list` [`str`]
+        Stages of the critical path, in build order.
+    length : `float`
+        Sum of their wall times: the shortest possible build with
+        unlimited cores.
+    """
+    finish = {}
+    previous = {}
+    for stage, upstream in graph.items():
+        start = 0.0
+        previous[stage] = None
+        for name in upstream:
+            if finish[name] > start or previous[stage] is None:
+                start = max(start, finish[name])
+                previous[stage] = name
+        finish[stage] = start + durations[stage]
+    if not finish:
+        return [], 0.0
+
+    stage = max(finish, key=finish.get)
+    length = finish[stage]
+    path = []
+    while stage is not None:
+        path.append(stage)
+        stage = previous[stage]
+    return path[::-1], length
+
+
+def simulateBuild(graph, durations, memory, jobs):
+    """Simulate a build running a number of stages at once.
+
+    Like ``scons -j``, at most ``jobs`` stages run at the same time, and
+    a stage starts once its upstream stages are done.  Of the stages
+    that are ready, those with the longest chain of stages after them
+    start first.
+
+    Parameters
+    ----------
+    graph : `dict` [`str`, `list` [`str`]]
+        Upstream stages of each stage; see `criticalPath`.
+    durations : `dict` [`str`, `float`]
+        Wall time of each stage.
+    memory : `dict` [`str`, `float`]
+        Peak memory of each stage.
+    jobs : `int`
+        Number of stages that may run at once.
+
+    Returns
+    -------
+    schedule : `dict` [`str`, `tuple` [`float`, `float`]]
+        Start and end time of each stage.
+    makespan : `float`
+        Wall time of the build.
+    peakMemory : `float`
+        Largest sum of the peak memory of the stages running at once.
+    """
+    downstream = {stage: [] for stage in graph}
+    for stage, upstream in graph.items():
+        for name in upstream:
+            downstream[name].append(stage)
+    # Length of the longest chain starting at each stage.
+    tail = {}
+    for stage in reversed(list(graph)):
+        tail[stage] = durations[stage] + max((tail[name] for name in downstream[stage]), default=0.0)
+
+    waiting = {stage: len(upstream) for stage, upstream in graph.items()}
+    order = {stage: index for index, stage in enumerate(graph)}
+    ready = [(-tail[stage], order[stage], stage) for stage, count in waiting.items() if count == 0]
+    heapq.heapify(ready)
+    running = []
+    schedule = {}
+    now = 0.0
+    peakMemory = 0.0
+    while ready or running:
+        while ready and len(running) < max(1, jobs):
+            _, _, stage = heapq.heappop(ready)
+            schedule[stage] = (now, now + durations[stage])
+            heapq.heappush(running, (now + durations[stage], order[stage], stage))
+        peakMemory = max(peakMemory, sum(memory[stage] for _, _, stage in running))
+        now, _, stage = heapq.heappop(running)
+        for name in downstream[stage]:
+            waiting[name] -= 1
+            if waiting[name] == 0:
+                heapq.heappush(ready, (-tail[name], order[name], name))
+    return schedule, now, peakMemory
+
+
+def formatPlan(stages, costs, jobs):
+    """Format the predicted plan of a build.
+
+    Parameters
+    ----------
+    stages : `dict` [`str`, `dict`]
+        The stages in build order.  For each, ``upstream``: the stages
+        that must run first; ``parts``: the stages in ``costs`` whose
+        commands it runs, usually only itself; and ``cores``: the number
+        of cores its commands are given.
+    costs : `dict` [`str`, `dict` [`str`, `float`]]
+        Costs from `estimateStageCosts`.
+    jobs : `int`
+        The ``-j`` of the build.
+
+    Returns
+    -------
+    plan : `str`
+        Table of the stages with their upstream stages, cores, predicted
+        wall time and memory, and number of builds the prediction is
+        from; the critical path is marked with ``*``.  It is followed by
+        the critical path and the predicted makespan and peak memory.
+        Stages that never ran are predicted to take no time.
+    """
+    graph = {stage: list(spec["upstream"]) for stage, spec in stages.items()}
+    durations = {}
+    memory = {}
+    builds = {}
+    for stage, spec in stages.items():
+        durations[stage] = memory[stage] = 0.0
+        counts = []
+        for part in spec["parts"]:
+            if part in costs:
+                wallTime, peakRss = predictStage(costs[part], spec["cores"])
+                durations[stage] += wallTime
+                memory[stage] = max(memory[stage], peakRss)
+                counts.append(costs[part]["builds"])
+        builds[stage] = min(counts) if len(counts) == len(spec["parts"]) else 0
+
+    path, length = criticalPath(graph, durations)
+    schedule, makespan, peakMemory = simulateBuild(graph, durations, memory, jobs)
+
+    lines = [f"  {'stage':<14} {'after':<24} {'cores':>5} {'wall[s]':>8} {'rss[MB]':>8} "
+             f"{'start[s]':>8} {'builds':>6}"]
+    for stage in graph:
+        known = builds[stage] > 0
+        lines.append(f"{'*' if stage in path else ' '} {stage:<14} {','.join(graph[stage])[:24]:<24} "
+                     f"{stages[stage]['cores']:>5} "
+                     f"{f'{durations[stage]:.1f}' if known else '?':>8} "
+                     f"{f'{memory[stage]/2**20:.0f}' if known else '?':>8} "
+                     f"{schedule[stage][0]:>8.1f} {builds[stage]:>6}")
+    lines.append(f"Critical path: {' -> '.join(path)} ({length:.1f} s)")
+    lines.append(f"Predicted makespan with -j {jobs}: {makespan:.1f} s, "
+                 f"peak memory {peakMemory/2**20:.0f} MB")
+    unknown = [stage for stage in graph if builds[stage] == 0]
+    if unknown:
+        lines.append(f"No successful earlier run of: {', '.join(unknown)}")
+    return "\n".join(lines)
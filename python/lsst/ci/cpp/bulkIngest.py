@@ -0,0 +1,399 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Bulk ingest of raws and calibration products into Gen2 registries.
+
+This replaces ``ingestImages.py`` and ``ingestCalibs.py`` in
+DATA/SConscript.  The same obs_lsst-configured parse and register tasks
+are used, but the files are found in one pass, their headers are read in
+a process pool, and all registry rows are written in one transaction.
+"""
+
+__all__ = ["findFiles", "getParseConfigKey", "ingestCalibs", "ingestRaws", "makeIngestTask",
+           "normalizeDetectorName", "readHeaders", "writeRows"]
+
+import argparse
+import fnmatch
+import functools
+import glob
+import hashlib
+import io
+import multiprocessing
+import os
+
+import lsst.daf.persistence as dafPersist
+from lsst.log import Log
+from lsst.pipe.tasks.ingest import IngestTask
+from lsst.pipe.tasks.ingestCalibs import CalibsRegisterTask, IngestCalibsTask
+from lsst.utils import getPackageDir
+
+from .fingerprint import getPackageVersion
+from .headerCache import HeaderCache, getHeaderCachePath
+
+
+# Detector names written by the LATISS raw translator, and the names used
+# by the curated calibrations.
+# TODO: DM-25903 Remove once the detectorName is consistent upstream.
+DETECTOR_NAMES = {"S00": "RXX_S00"}
+
+# Task classes and the obs_lsst configuration file names of each kind
+# of ingest.
+INGEST_TASKS = {
+    "raw": (IngestTask, "ingest"),
+    "calib": (IngestCalibsTask, "ingestCalibs"),
+}
+
+# Ingest task of each pool worker, created by `_initWorker`.
+_workerTask = None
+
+
+def makeIngestTask(kind):
+    """Construct an ingest task configured for LATISS.
+
+    The obs_lsst overrides are applied as the command-line task would.
+
+    Parameters
+    ----------
+    kind : `str`
+        ``raw`` or ``calib``.
+
+    Returns
+    -------
+    task : `lsst.pipe.tasks.ingest.IngestTask`
+        The configured task.
+    """
+    TaskClass, taskName = INGEST_TASKS[kind]
+    config = TaskClass.ConfigClass()
+    obsConfigDir = os.path.join(getPackageDir("obs_lsst"), "config")
+    for path in (os.path.join(obsConfigDir, f"{taskName}.py"),
+                 os.path.join(obsConfigDir, "latiss", f"{taskName}.py")):
+        if os.path.exists(path):
+            config.load(path)
+    return TaskClass(config=config)
+
+
+def getParseConfigKey(task):
+    """Identify the code and configuration that parse headers.
+
+    Parameters
+    ----------
+    task : `lsst.pipe.tasks.ingest.IngestTask`
+        Ingest task whose parse subtask reads the headers.
+
+    Returns
+    -------
+    key : `str`
+        Hash of the parse configuration and of the versions of the
+        packages translating the headers.
+    """
+    stream = io.StringIO()
+    task.parse.config.saveToStream(stream)
+    for package in ("obs_base", "obs_lsst", "pipe_tasks", "astro_metadata_translator"):
+        stream.write(f"{package}={getPackageVersion(package)}\n")
+    return hashlib.sha256(stream.getvalue().encode()).hexdigest()
+
+
+def normalizeDetectorName(info):
+    """Replace a detector name with the one used by the calibrations.
+
+    Parameters
+    ----------
+    info : `dict`
+        Registry row; modified in place.
+
+    Returns
+    -------
+    info : `dict`
+        The same row.
+    """
+    if info.get("detectorName") in DETECTOR_NAMES:
+        info["detectorName"] = DETECTOR_NAMES[info["detectorName"]]
+    return info
+
+
+def findFiles(paths, pattern="*.fits"):
+    """Find the files to ingest.
+
+    Parameters
+    ----------
+    paths : `list` [`str`]
+        Files, glob patterns, or directories to search recursively.
+    pattern : `str`, optional
+        Pattern the names of files found in directories must match.
+
+    Returns
+    -------
+    files : `list` [`str`]
+        The files, sorted and without duplicates.
+    """
+    files = set()
+    for path in paths:
+        for match in glob.glob(path):
+            if os.path.isdir(match):
+                for dirPath, dirNames, fileNames in os.walk(match):
+                    files.update(os.path.join(dirPath, name)
+                                 for name in fnmatch.filter(fileNames, pattern))
+            else:
+                files.add(match)
+    return sorted(files)
+
+
+def _initWorker(kind):
+    global _workerTask
+    _workerTask = makeIngestTask(kind)
+
+
+def _readHeader(filename, withCalibType=False):
+    """Parse the headers of one file in a pool worker.
+    """
+    fileInfo, hduInfoList = _workerTask.parse.getInfo(filename)
+    calibType = _workerTask.parse.getCalibType(filename) if withCalibType else None
+    return fileInfo, hduInfoList, calibType
+
+
+def readHeaders(kind, files, processes=None, cache=None):
+    """Parse the headers of files in a process pool.
+
+    Parameters
+    ----------
+    kind : `str`
+        ``raw`` or ``calib``.
+    files : `list` [`str`]
+        Files to parse.
+    processes : `int`, optional
+        Number of worker processes.  Defaults to the number of CPUs.
+    cache : `lsst.ci.cpp.headerCache.HeaderCache`, optional
+        Cache of earlier results.  Only files that are not in the cache,
+        or that changed since, are parsed, and their results are added.
+
+    Returns
+    -------
+    headers : `dict` [`str`, `tuple`]
+        The file information, the per-HDU registry information and, for
+        calibrations, the calibration type of each file.
+    """
+    headers = cache.lookup(files) if cache is not None else {}
+    toRead = [filename for filename in files if filename not in headers]
+    if cache is not None:
+        Log.getLogger("ci.cpp.bulkIngest").info("%d of %d headers found in %s",
+                                                len(headers), len(files), cache.path)
+    if not toRead:
+        return headers
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(toRead)))
+    readHeader = functools.partial(_readHeader, withCalibType=(kind == "calib"))
+    if processes == 1:
+        _initWorker(kind)
+        newHeaders = {filename: readHeader(filename) for filename in toRead}
+    else:
+        with multiprocessing.Pool(processes, initializer=_initWorker, initargs=(kind,)) as pool:
+            # Headers are small, so larger chunks only reduce overhead.
+            chunkSize = max(1, len(toRead)//(4*processes))
+            newHeaders = dict(zip(toRead, pool.map(readHeader, toRead, chunkSize)))
+
+    if cache is not None:
+        cache.store(newHeaders)
+    headers.update(newHeaders)
+    return headers
+
+
+def _clearTable(conn, table):
+    """Delete all rows of a registry table, if it exists.
+    """
+    if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+                    (table,)).fetchone():
+        conn.execute(f"DELETE FROM {table}")
+
+
+def writeRows(registerTask, conn, table, rows):
+    """Insert rows into a registry table with one prepared statement.
+
+    The statement is the one ``RegisterTask.addRow`` executes for each
+    row, so the ``ignore`` and ``unique`` options are honoured.  As in
+    ``CalibsRegisterTask.addRow``, the validity range of calibration
+    rows is left empty, to be filled by ``updateValidityRanges``.
+
+    Parameters
+    ----------
+    registerTask : `lsst.pipe.tasks.ingest.RegisterTask`
+        Task whose configuration defines the table columns.
+    conn : `sqlite3.Connection`
+        Open registry.
+    table : `str`
+        Table to insert into.
+    rows : `list` [`dict`]
+        Rows to insert; calibration rows are modified in place.
+    """
+    config = registerTask.config
+    if isinstance(registerTask, CalibsRegisterTask):
+        for info in rows:
+            info[config.validStart] = None
+            info[config.validEnd] = None
+    columns = list(config.columns)
+    ignoreClause = " OR IGNORE" if config.ignore else ""
+    sql = (f"INSERT{ignoreClause} INTO {table} ({','.join(columns)}) SELECT "
+           + ",".join([registerTask.placeHolder]*len(columns)))
+    if config.unique:
+        sql += (f" WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE "
+                + " AND ".join(f"{col}={registerTask.placeHolder}" for col in config.unique) + ")")
+
+    def makeValues(info):
+        values = [registerTask.typemap[colType](info[col]) for col, colType in config.columns.items()]
+        return values + [info[col] for col in config.unique or []]
+
+    conn.executemany(sql, [makeValues(row) for row in rows])
+
+
+def ingestRaws(repoDir, paths, mode="link", processes=None, cachePath=None):
+    """Ingest raws into a data repository.
+
+    Parameters
+    ----------
+    repoDir : `str`
+        Data repository, with its ``_mapper`` file already written.
+    paths : `list` [`str`]
+        Files, glob patterns or directories holding the raws.
+    mode : `str`, optional
+        How to place files in the repository: ``link``, ``copy``,
+        ``move`` or ``skip``.
+    processes : `int`, optional
+        Number of processes reading headers.
+    cachePath : `str`, optional
+        Header cache database.  Defaults to `getHeaderCachePath`; an
+        empty string disables the cache.
+
+    Returns
+    -------
+    nRows : `int`
+        Number of registry rows written.
+    """
+    log = Log.getLogger("ci.cpp.bulkIngest")
+    task = makeIngestTask("raw")
+    files = findFiles(paths)
+    if cachePath is None:
+        cachePath = getHeaderCachePath()
+    cache = HeaderCache(cachePath, getParseConfigKey(task)) if cachePath else None
+    headers = readHeaders("raw", files, processes, cache)
+    butler = dafPersist.Butler(repoDir) if mode != "skip" else None
+
+    rows = []
+    for filename in files:
+        fileInfo, hduInfoList, _ = headers[filename]
+        if not hduInfoList:
+            log.warn("No registry information found for %s; skipping", filename)
+            continue
+        if mode != "skip":
+            outfile = task.parse.getDestination(butler, fileInfo, filename)
+            if not task.ingest(filename, outfile, mode=mode):
+                continue
+        for info in hduInfoList:
+            info["filename"] = filename
+            rows.append(normalizeDetectorName(info))
+
+    with task.register.openRegistry(repoDir) as conn:
+        writeRows(task.register, conn, task.register.config.table, rows)
+        task.register.addVisits(conn)
+    log.info("Ingested %d raws from %d files", len(rows), len(files))
+    return len(rows)
+
+
+def ingestCalibs(repoDir, calibDir, paths, validity, mode="link", processes=None, replace=True):
+    """Ingest calibration products into a calibration repository.
+
+    Parameters
+    ----------
+    repoDir : `str`
+        Data repository the calibration repository belongs to.
+    calibDir : `str`
+        Calibration repository.
+    paths : `list` [`str`]
+        Files, glob patterns or directories holding the products.
+    validity : `int`
+        Calibration validity period, in days.
+    mode : `str`, optional
+        How to place files in the repository: ``link``, ``copy``,
+        ``move`` or ``skip``.
+    processes : `int`, optional
+        Number of processes reading headers.
+    replace : `bool`, optional
+        Remove earlier rows of the ingested calibration types.
+
+    Returns
+    -------
+    nRows : `dict` [`str`, `int`]
+        Number of registry rows written for each calibration type.
+    """
+    log = Log.getLogger("ci.cpp.bulkIngest")
+    task = makeIngestTask("calib")
+    files = findFiles(paths)
+    headers = readHeaders("calib", files, processes)
+    butler = dafPersist.Butler(repoDir, calibRoot=calibDir) if mode != "skip" else None
+
+    rows = {}
+    for filename in files:
+        fileInfo, hduInfoList, calibType = headers[filename]
+        if calibType not in task.register.config.tables:
+            log.warn("Skipping %s: %s is not a known calibration type", filename, calibType)
+            continue
+        if mode != "skip":
+            outfile = task.parse.getDestination(butler, fileInfo, filename)
+            if not task.ingest(filename, outfile, mode=mode):
+                continue
+        rows.setdefault(calibType, []).extend(normalizeDetectorName(info) for info in hduInfoList)
+
+    with task.register.openRegistry(calibDir) as conn:
+        for calibType, calibRows in rows.items():
+            if replace:
+                _clearTable(conn, calibType)
+            writeRows(task.register, conn, calibType, calibRows)
+        task.register.updateValidityRanges(conn, validity, tables=list(rows))
+    for calibType, calibRows in rows.items():
+        log.info("Ingested %d %s rows", len(calibRows), calibType)
+    return {calibType: len(calibRows) for calibType, calibRows in rows.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest raws or calibration products in bulk.")
+    parser.add_argument("kind", choices=sorted(INGEST_TASKS), help="What to ingest.")
+    parser.add_argument("repo", help="Data repository.")
+    parser.add_argument("paths", nargs="+", help="Files, glob patterns or directories to ingest.")
+    parser.add_argument("--calib", help="Calibration repository (calib only).")
+    parser.add_argument("--validity", type=int, default=9999,
+                        help="Calibration validity period in days (calib only).")
+    parser.add_argument("--mode", choices=["link", "copy", "move", "skip"], default="link",
+                        help="How to place files in the repository.")
+    parser.add_argument("-j", "--processes", type=int, help="Number of processes reading headers.")
+    parser.add_argument("--header-cache",
+                        help="Header cache database for raws (default: $CI_CPP_HEADER_CACHE or "
+                        "DATA/headerCache.sqlite3); an empty value disables the cache.")
+    args = parser.parse_args()
+
+    if args.kind == "raw":
+        ingestRaws(args.repo, args.paths, args.mode, args.processes, args.header_cache)
+    else:
+        if args.calib is None:
+            parser.error("--calib is required to ingest calibrations.")
+        ingestCalibs(args.repo, args.calib, args.paths, args.validity, args.mode, args.processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Cosmic-ray masks of ISR-processed exposures, cached with the ISR
+output.
+"""
+
+__all__ = ["findCosmicRayMask"]
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.meas.algorithms as measAlg
+from lsst.pipe.tasks.repair import RepairTask
+
+from .isrCache import getIsrCacheDir
+
+
+def _makeKey(exposure, repairConfig, psfSize, psfSigma):
+    """Hash the pixels and the detection settings of a CR search.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(np.ascontiguousarray(exposure.getImage().getArray()).tobytes())
+    digest.update(np.ascontiguousarray(exposure.getMask().getArray()).tobytes())
+    digest.update(repr((exposure.getXY0(), psfSize, psfSigma)).encode())
+    digest.update(repr(sorted(repairConfig.cosmicray.toDict().items())).encode())
+    return digest.hexdigest()
+
+
+def findCosmicRayMask(exposure, psfSize=21, psfSigma=3.0, cacheDir=None):
+    """Find the cosmic rays of an exposure.
+
+    The search runs `lsst.pipe.tasks.repair.RepairTask.cosmicRay` with
+    ``keepCRs=True`` on an exposure that shares the image and variance
+    of ``exposure`` and has a copy of its mask, so neither the pixels
+    nor the mask of ``exposure`` are modified or cloned.  The result is
+    cached in the ISR cache directory, keyed by the pixels, mask and
+    detection settings.
+
+    Parameters
+    ----------
+    exposure : `lsst.afw.image.Exposure`
+        ISR-processed exposure.
+    psfSize : `int`, optional
+        Size of the single Gaussian PSF used for the detection.
+    psfSigma : `float`, optional
+        Width of that PSF, in pixels.
+    cacheDir : `str`, optional
+        ISR cache directory; see `lsst.ci.cpp.isrCache.getIsrCacheDir`.
+
+    Returns
+    -------
+    crMask : `numpy.ndarray` [`bool`]
+        `True` for pixels of cosmic rays, with the shape of the image.
+    """
+    repairTask = RepairTask()
+    key = _makeKey(exposure, repairTask.config, psfSize, psfSigma)
+    cacheDir = cacheDir if cacheDir is not None else getIsrCacheDir()
+    path = os.path.join(cacheDir, key[:2], f"{key}.cr.npz")
+    shape = exposure.getImage().getArray().shape
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            crMask = np.zeros(shape, dtype=bool)
+            crMask.ravel()[cached["pixels"]] = True
+            return crMask
+
+    mask = exposure.getMask().clone()
+    search = afwImage.makeExposure(afwImage.makeMaskedImage(exposure.getImage(), mask,
+                                                            exposure.getVariance()))
+    search.setPsf(measAlg.SingleGaussianPsf(psfSize, psfSize, psfSigma))
+    repairTask.cosmicRay(search, keepCRs=True)
+    crMask = (mask.getArray() & mask.getPlaneBitMask("CR")) != 0
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, pixels=np.flatnonzero(crMask))
+        os.replace(tmpPath, path)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+    return crMask
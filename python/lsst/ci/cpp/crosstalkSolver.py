@@ -0,0 +1,226 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Least-squares crosstalk coefficients for all amplifier pairs at once.
+
+Each amplifier's pixels, in readout order, are modelled as its own
+signal plus a linear combination of the pixels read out at the same
+time by every other amplifier.  Fitting every victim against all other
+amplifiers only needs the Gram matrix of the readout-aligned pixels,
+which is accumulated over exposures in constant memory.  All the
+regressions follow from a single inverse of that matrix: for victim
+``j``, the coefficient of source ``i`` is ``-P[i, j]/P[j, j]``, with
+``P`` the inverse Gram matrix.
+
+With a source threshold, as ``cp_pipe`` measures crosstalk, each pair
+is instead fitted on its own, from the samples in which the source is
+bright and the victim is faint enough to hold only crosstalk.  Only the
+sums of a straight-line fit are kept for each pair, so memory grows as
+the square of the number of amplifiers in either mode.
+"""
+
+__all__ = ["CrosstalkAccumulator", "makeReadoutMatrix"]
+
+import numpy as np
+
+from lsst.afw.cameraGeom import ReadoutCorner
+
+from .ampStatistics import makeAmpCube
+
+
+def makeReadoutMatrix(exposure, detector=None, badMaskPlanes=("BAD", "NO_DATA")):
+    """Arrange the pixels of all amplifiers in readout order.
+
+    Parameters
+    ----------
+    exposure : `lsst.afw.image.Exposure`
+        Assembled, ISR-processed exposure.
+    detector : `lsst.afw.cameraGeom.Detector`, optional
+        Detector describing the amplifier layout.  Defaults to the
+        detector attached to ``exposure``.
+    badMaskPlanes : `list` [`str`], optional
+        Mask planes of pixels to exclude.  A readout sample is excluded
+        if any amplifier's pixel is.
+
+    Returns
+    -------
+    matrix : `numpy.ndarray`, (nSample, nAmp)
+        Pixel values, one column per amplifier, with rows read out
+        simultaneously.  Each column has its median subtracted, so that
+        sky and bias offsets do not enter the fit.
+    """
+    if detector is None:
+        detector = exposure.getDetector()
+    amps = list(detector)
+    bboxes = [amp.getBBox() for amp in amps]
+    xy0 = (exposure.getX0(), exposure.getY0())
+
+    values = makeAmpCube(exposure.getImage().getArray(), bboxes, xy0).astype(np.float64)
+    maskBits = makeAmpCube(exposure.getMask().getArray(), bboxes, xy0)
+    bad = (maskBits & exposure.getMask().getPlaneBitMask(list(badMaskPlanes))) != 0
+
+    # Flip every amplifier so that its readout corner is at the origin.
+    for index, amp in enumerate(amps):
+        corner = amp.getReadoutCorner()
+        if corner in (ReadoutCorner.LR, ReadoutCorner.UR):
+            values[index] = values[index, :, ::-1]
+            bad[index] = bad[index, :, ::-1]
+        if corner in (ReadoutCorner.UL, ReadoutCorner.UR):
+            values[index] = values[index, ::-1, :]
+            bad[index] = bad[index, ::-1, :]
+
+    matrix = values.reshape(len(amps), -1).T
+    good = ~(bad.reshape(len(amps), -1).any(axis=0)) & np.isfinite(matrix).all(axis=1)
+    matrix = matrix[good]
+    return matrix - np.median(matrix, axis=0)
+
+
+class CrosstalkAccumulator:
+    """Accumulate readout-aligned pixels and solve for crosstalk.
+
+    Parameters
+    ----------
+    nAmp : `int`
+        Number of amplifiers.  For crosstalk between detectors, the
+        amplifiers of all detectors are given together as columns.
+    threshold : `float`, optional
+        If given, fit each victim and source pair from the readout
+        samples in which the source is above this level, after median
+        subtraction.  Otherwise every victim is fitted against all
+        sources at once, from all samples.
+    maxCrosstalk : `float`, optional
+        With a ``threshold``, also exclude the samples in which the
+        victim is above this fraction of the source, which hold a
+        source of the victim itself.
+    """
+
+    def __init__(self, nAmp, threshold=None, maxCrosstalk=0.01):
+        self.nAmp = nAmp
+        self.threshold = threshold
+        self.maxCrosstalk = maxCrosstalk
+        if threshold is None:
+            # Gram matrix of the pixels, augmented with a constant column
+            # so that each regression has an intercept.
+            self._gram = np.zeros((nAmp + 1, nAmp + 1))
+        else:
+            # Sums over the selected samples of each source (row) and
+            # victim (column): count, x, x**2, y, x*y and y**2.
+            self._pairSums = np.zeros((6, nAmp, nAmp))
+        self.nSamples = 0
+
+    def addMatrix(self, matrix):
+        """Add readout-aligned pixels.
+
+        Parameters
+        ----------
+        matrix : `numpy.ndarray`, (nSample, nAmp)
+            Pixel values, one column per amplifier.
+        """
+        if matrix.shape[1] != self.nAmp:
+            raise ValueError(f"Expected {self.nAmp} amplifiers, not {matrix.shape[1]}.")
+        self.nSamples += matrix.shape[0]
+        if self.threshold is None:
+            augmented = np.empty((matrix.shape[0], self.nAmp + 1))
+            augmented[:, :self.nAmp] = matrix
+            augmented[:, self.nAmp] = 1.0
+            self._gram += augmented.T @ augmented
+            return
+
+        matrix = matrix[(matrix > self.threshold).any(axis=1)]
+        for source in range(self.nAmp):
+            samples = matrix[matrix[:, source] > self.threshold]
+            if not len(samples):
+                continue
+            x = samples[:, source]
+            selected = samples <= self.maxCrosstalk*x[:, np.newaxis]
+            y = np.where(selected, samples, 0.0)
+            self._pairSums[:, source] += [selected.sum(axis=0), x @ selected, (x*x) @ selected,
+                                          y.sum(axis=0), x @ y, (y*y).sum(axis=0)]
+
+    def addExposure(self, exposure, detector=None, badMaskPlanes=("BAD", "NO_DATA")):
+        """Add the pixels of an exposure.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Assembled, ISR-processed exposure.
+        detector, badMaskPlanes
+            See `makeReadoutMatrix`.
+        """
+        self.addMatrix(makeReadoutMatrix(exposure, detector, badMaskPlanes))
+
+    def solve(self):
+        """Fit every victim amplifier.
+
+        Returns
+        -------
+        coeffs : `numpy.ndarray`, (nAmp, nAmp)
+            Crosstalk coefficients, with ``coeffs[victim, source]`` the
+            fraction of the source signal added to the victim, as used
+            by `lsst.ip.isr.CrosstalkCalib`.  The diagonal is zero, and
+            with a threshold, pairs with fewer than three samples are
+            NaN.
+        coeffErr : `numpy.ndarray`, (nAmp, nAmp)
+            Standard errors of the coefficients.
+        """
+        if self.threshold is None:
+            coeffs, coeffErr = self._solveJoint()
+        else:
+            coeffs, coeffErr = self._solvePairs()
+        np.fill_diagonal(coeffs, 0.0)
+        np.fill_diagonal(coeffErr, 0.0)
+        return coeffs, coeffErr
+
+    def _solveJoint(self):
+        """Regress every victim on all sources with one inverse of the
+        Gram matrix.
+        """
+        precision = np.linalg.inv(self._gram)
+        diagonal = np.diag(precision)
+
+        # Column j holds the regression of victim j on every source i.
+        sourceByVictim = -precision/diagonal[np.newaxis, :]
+        # The residual sum of squares of regression j is 1/P[j, j], and
+        # the inverse Gram matrix of its sources is P[i, i] -
+        # P[i, j]**2/P[j, j].
+        dof = max(self.nSamples - self.nAmp - 1, 1)
+        variance = (diagonal[:, np.newaxis] - precision**2/diagonal[np.newaxis, :])
+        variance /= diagonal[np.newaxis, :]*dof
+        sourceByVictimErr = np.sqrt(np.clip(variance, 0.0, None))
+
+        return (sourceByVictim[:self.nAmp, :self.nAmp].T.copy(),
+                sourceByVictimErr[:self.nAmp, :self.nAmp].T.copy())
+
+    def _solvePairs(self):
+        """Fit a straight line to every victim against every source.
+        """
+        n, sx, sxx, sy, sxy, syy = self._pairSums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            varX = sxx - sx**2/n
+            covXY = sxy - sx*sy/n
+            varY = syy - sy**2/n
+            slope = covXY/varX
+            residual = np.clip(varY - slope*covXY, 0.0, None)
+            slopeErr = np.sqrt(residual/(n - 2)/varX)
+        tooFew = n < 3
+        slope[tooFew] = np.nan
+        slopeErr[tooFew] = np.nan
+        # The sums are indexed by source, then victim.
+        return slope.T.copy(), slopeErr.T.copy()
@@ -0,0 +1,234 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Comparison of defect lists through an index of their bounding boxes.
+
+Boxes are sorted by their minimum x, so the boxes that can overlap a
+query are found with two binary searches, and only those are tested for
+overlap in y.  The few boxes much wider than the rest, such as masked
+edges, are kept apart and tested against every query, so they do not
+widen the search window of all other boxes.  Matching ``n`` defects
+against ``m`` therefore costs ``O((n + m) log m)`` instead of ``O(nm)``
+for sensors with mostly small defects.
+"""
+
+__all__ = ["DefectIndex", "compareDefects", "getDefectBoxes", "loadDefectFiles"]
+
+import glob
+import os
+
+import numpy as np
+
+
+def getDefectBoxes(defects):
+    """Return the bounding boxes of some defects.
+
+    Parameters
+    ----------
+    defects : `lsst.ip.isr.Defects`
+        Defect list.
+
+    Returns
+    -------
+    boxes : `numpy.ndarray`, (nDefect, 4)
+        Minimum x, minimum y, maximum x and maximum y of each defect,
+        inclusive.
+    """
+    boxes = [(bbox.getMinX(), bbox.getMinY(), bbox.getMaxX(), bbox.getMaxY())
+             for bbox in (defect.getBBox() for defect in defects)]
+    return np.array(boxes, dtype=np.int64).reshape(-1, 4)
+
+
+def loadDefectFiles(rootDir):
+    """Read the defect lists written below a directory.
+
+    Parameters
+    ----------
+    rootDir : `str`
+        Directory containing defect FITS files, such as the ``defects``
+        directory of the defectGen rerun.
+
+    Returns
+    -------
+    defects : `dict` [`int`, `lsst.ip.isr.Defects`]
+        Defects, keyed by the detector in their metadata.  If there are
+        several lists for a detector, the last in path order is used.
+    """
+    from lsst.ip.isr import Defects
+
+    defects = {}
+    for path in sorted(glob.glob(os.path.join(rootDir, "**", "*.fits"), recursive=True)):
+        defectList = Defects.readFits(path)
+        defects[int(defectList.getMetadata()["DETECTOR"])] = defectList
+    return defects
+
+
+class DefectIndex:
+    """Index of defect bounding boxes for overlap queries.
+
+    Parameters
+    ----------
+    boxes : `numpy.ndarray`, (nDefect, 4)
+        Boxes from `getDefectBoxes`.
+    wideWidth : `int`, optional
+        Boxes wider than this, in pixels, are tested against every
+        query instead of being indexed.
+    """
+
+    def __init__(self, boxes, wideWidth=64):
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        widths = boxes[:, 2] - boxes[:, 0] + 1
+        wide = widths > wideWidth
+
+        self._wideIds = np.flatnonzero(wide)
+        narrowIds = np.flatnonzero(~wide)
+        order = np.argsort(boxes[narrowIds, 0], kind="stable")
+        self._ids = narrowIds[order]
+        self._sorted = boxes[self._ids]
+        self._maxWidth = int(widths[self._ids].max()) if len(self._ids) else 0
+        self._boxes = boxes
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def query(self, box):
+        """Find the indexed boxes that overlap a box.
+
+        Parameters
+        ----------
+        box : sequence [`int`]
+            Minimum x, minimum y, maximum x and maximum y, inclusive.
+
+        Returns
+        -------
+        ids : `numpy.ndarray` [`int`]
+            Indices, in the boxes given to the constructor, of the
+            overlapping boxes.
+        """
+        minX, minY, maxX, maxY = box
+        # Indexed boxes starting in [minX - maxWidth + 1, maxX] are the
+        # only ones that can reach into the box in x.
+        start = np.searchsorted(self._sorted[:, 0], minX - self._maxWidth + 1, side="left")
+        stop = np.searchsorted(self._sorted[:, 0], maxX, side="right")
+        window = self._sorted[start:stop]
+        overlaps = (window[:, 2] >= minX) & (window[:, 1] <= maxY) & (window[:, 3] >= minY)
+        ids = self._ids[start:stop][overlaps]
+
+        if len(self._wideIds):
+            wide = self._boxes[self._wideIds]
+            wideOverlaps = ((wide[:, 0] <= maxX) & (wide[:, 2] >= minX)
+                            & (wide[:, 1] <= maxY) & (wide[:, 3] >= minY))
+            ids = np.concatenate([ids, self._wideIds[wideOverlaps]])
+        return ids
+
+
+def _paintBoxes(boxes, bbox):
+    """Rasterize the parts of some boxes inside an amplifier.
+    """
+    minX, minY, maxX, maxY = bbox
+    image = np.zeros((maxY - minY + 1, maxX - minX + 1), dtype=bool)
+    for x0, y0, x1, y1 in boxes:
+        x0, y0 = max(x0, minX), max(y0, minY)
+        x1, y1 = min(x1, maxX), min(y1, maxY)
+        if x0 <= x1 and y0 <= y1:
+            image[y0 - minY:y1 - minY + 1, x0 - minX:x1 - minX + 1] = True
+    return image
+
+
+def compareDefects(reference, measured, detector=None):
+    """Match measured defects against reference defects.
+
+    A defect is matched if its bounding box overlaps any box of the
+    other list.
+
+    Parameters
+    ----------
+    reference : `lsst.ip.isr.Defects` or `numpy.ndarray`
+        Reference defects, such as the curated defects, or their boxes.
+    measured : `lsst.ip.isr.Defects` or `numpy.ndarray`
+        Measured defects, such as the defectGen output, or their boxes.
+    detector : `lsst.afw.cameraGeom.Detector`, optional
+        If given, the statistics are also computed per amplifier.
+
+    Returns
+    -------
+    comparison : `dict` [`str`, `object`]
+        ``matched`` and ``missing``: indices of the reference defects
+        with and without an overlapping measured defect; ``new``:
+        indices of the measured defects without an overlapping reference
+        defect; and, with a detector, ``amps``: for each amplifier, the
+        number of ``matched``, ``missing`` and ``new`` defects whose
+        centre is on it, the ``referencePixels`` and ``measuredPixels``
+        covered by each list, their ``overlapPixels``, and the
+        ``overlapFraction`` of the pixels covered by either list that
+        are covered by both.
+    """
+    referenceBoxes = reference if isinstance(reference, np.ndarray) else getDefectBoxes(reference)
+    measuredBoxes = measured if isinstance(measured, np.ndarray) else getDefectBoxes(measured)
+
+    index = DefectIndex(measuredBoxes)
+    hasMatch = np.zeros(len(referenceBoxes), dtype=bool)
+    measuredMatched = np.zeros(len(measuredBoxes), dtype=bool)
+    for referenceId, box in enumerate(referenceBoxes):
+        overlapping = index.query(box)
+        if len(overlapping):
+            hasMatch[referenceId] = True
+            measuredMatched[overlapping] = True
+
+    comparison = {"matched": np.flatnonzero(hasMatch),
+                  "missing": np.flatnonzero(~hasMatch),
+                  "new": np.flatnonzero(~measuredMatched)}
+    if detector is None:
+        return comparison
+
+    def centres(boxes):
+        return (boxes[:, 0] + boxes[:, 2])/2.0, (boxes[:, 1] + boxes[:, 3])/2.0
+
+    referenceX, referenceY = centres(referenceBoxes)
+    measuredX, measuredY = centres(measuredBoxes)
+    # Only the boxes that reach into an amplifier are painted for it.
+    allIndex = DefectIndex(np.concatenate([referenceBoxes, measuredBoxes]))
+    comparison["amps"] = {}
+    for amp in detector:
+        ampBBox = amp.getBBox()
+        bbox = (ampBBox.getMinX(), ampBBox.getMinY(), ampBBox.getMaxX(), ampBBox.getMaxY())
+
+        def onAmp(x, y):
+            return (x >= bbox[0]) & (x <= bbox[2]) & (y >= bbox[1]) & (y <= bbox[3])
+
+        referenceOnAmp = onAmp(referenceX, referenceY)
+        measuredOnAmp = onAmp(measuredX, measuredY)
+        nearby = allIndex.query(bbox)
+        referencePixels = _paintBoxes(referenceBoxes[nearby[nearby < len(referenceBoxes)]], bbox)
+        measuredPixels = _paintBoxes(measuredBoxes[nearby[nearby >= len(referenceBoxes)]
+                                                   - len(referenceBoxes)], bbox)
+        overlap = int((referencePixels & measuredPixels).sum())
+        union = int((referencePixels | measuredPixels).sum())
+
+        comparison["amps"][amp.getName()] = {
+            "matched": int((hasMatch & referenceOnAmp).sum()),
+            "missing": int((~hasMatch & referenceOnAmp).sum()),
+            "new": int((~measuredMatched & measuredOnAmp).sum()),
+            "referencePixels": int(referencePixels.sum()),
+            "measuredPixels": int(measuredPixels.sum()),
+            "overlapPixels": overlap,
+            "overlapFraction": overlap/union if union else 1.0,
+        }
+    return comparison
@@ -0,0 +1,174 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Selection of, and fan-out over, the detectors to process.
+
+This module is imported while SCons reads the build scripts, so it must
+not import the science pipelines at module level.
+"""
+
+__all__ = ["formatDetectorIds", "getDetectorList", "getTestdataRoot", "loadManifest", "mapDetectors",
+           "parseDetectorList"]
+
+import multiprocessing
+import os
+
+import yaml
+
+from .resources import getProcessCores
+from .tiers import applyTier
+
+
+def getTestdataRoot():
+    """Return the root of the test data.
+
+    Returns
+    -------
+    testdataRoot : `str`
+        The ``CI_CPP_TESTDATA_ROOT`` environment variable if it is set,
+        such as the output of `lsst.ci.cpp.syntheticRaws`, else the
+        location of the ``testdata_latiss_cpp`` package.
+    """
+    testdataRoot = os.environ.get("CI_CPP_TESTDATA_ROOT")
+    if testdataRoot:
+        return testdataRoot
+    from lsst.utils import getPackageDir
+    return getPackageDir("testdata_latiss_cpp")
+
+
+def loadManifest(testdataRoot=None, tier=None):
+    """Load the exposure manifest of the test data.
+
+    Parameters
+    ----------
+    testdataRoot : `str`, optional
+        Root of the test data.  Defaults to `getTestdataRoot`.
+    tier : `str`, optional
+        Tier whose exposures to select; see `lsst.ci.cpp.tiers`.
+        Defaults to the tier of the build, and ``"full"`` selects every
+        exposure.
+
+    Returns
+    -------
+    manifest : `dict`
+        Exposure lists keyed by their role.
+    """
+    if testdataRoot is None:
+        testdataRoot = getTestdataRoot()
+    with open(os.path.join(testdataRoot, "raw", "manifest.yaml")) as f:
+        return applyTier(yaml.safe_load(f), tier)
+
+
+def parseDetectorList(value):
+    """Parse a detector list specification.
+
+    Parameters
+    ----------
+    value : `str`
+        Detector ids separated by ``,`` or ``^``.  Ranges may be given
+        as ``first..last``, as for the ``--id`` command-line option.
+
+    Returns
+    -------
+    detectors : `list` [`int`]
+        The detector ids, in the order given.
+    """
+    detectors = []
+    for item in value.replace("^", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if ".." in item:
+            first, last = item.split("..")
+            detectors.extend(range(int(first), int(last) + 1))
+        else:
+            detectors.append(int(item))
+    return detectors
+
+
+def getDetectorList(manifest=None):
+    """Return the detectors to process.
+
+    Parameters
+    ----------
+    manifest : `dict`, optional
+        Test data manifest, which may list the detectors under the
+        ``detectors`` key.
+
+    Returns
+    -------
+    detectors : `list` [`int`]
+        The detectors given by the ``CI_CPP_DETECTORS`` environment
+        variable if it is set, else those listed in the manifest, else
+        detector 0.
+    """
+    value = os.environ.get("CI_CPP_DETECTORS")
+    if value:
+        return parseDetectorList(value)
+    if manifest is not None and manifest.get("detectors"):
+        detectors = manifest["detectors"]
+        if isinstance(detectors, str):
+            return parseDetectorList(detectors)
+        return [int(detector) for detector in detectors]
+    return [0]
+
+
+def formatDetectorIds(detectors):
+    """Format detectors for the ``--id`` command-line option.
+
+    Parameters
+    ----------
+    detectors : `list` [`int`]
+        Detectors to select.
+
+    Returns
+    -------
+    dataId : `str`
+        Data id selecting the detectors, e.g. ``detector=0^1^2``.
+    """
+    return "detector=" + "^".join(str(detector) for detector in detectors)
+
+
+def mapDetectors(function, detectors, processes=None):
+    """Apply a function to each detector in a process pool.
+
+    Parameters
+    ----------
+    function : `callable`
+        Picklable function taking a detector id.
+    detectors : `list` [`int`]
+        Detectors to process.
+    processes : `int`, optional
+        Number of worker processes.  Defaults to one per detector, up to
+        the cores of this process, which pytest-xdist workers share; see
+        `lsst.ci.cpp.resources.getProcessCores`.  With a single process
+        the detectors are processed serially in this process.
+
+    Returns
+    -------
+    results : `dict` [`int`, `object`]
+        Result of ``function`` for each detector.
+    """
+    if processes is None:
+        processes = min(len(detectors), getProcessCores())
+    if processes <= 1:
+        return {detector: function(detector) for detector in detectors}
+    with multiprocessing.Pool(processes) as pool:
+        return dict(zip(detectors, pool.map(function, detectors)))
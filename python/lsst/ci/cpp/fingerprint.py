@@ -0,0 +1,103 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Content fingerprints of the inputs to each DATA/SConscript stage.
+
+This module is imported while SCons reads the build scripts, so it must
+only depend on the standard library.
+"""
+
+__all__ = ["fileChecksum", "getPackageVersion", "makeFingerprint"]
+
+import hashlib
+import json
+import os
+
+
+def fileChecksum(path):
+    """Return the SHA-256 checksum of a file's contents.
+
+    Parameters
+    ----------
+    path : `str`
+        File to checksum.
+
+    Returns
+    -------
+    checksum : `str`
+        Hexadecimal digest, or ``"MISSING"`` if the file does not
+        exist.
+    """
+    if not os.path.exists(path):
+        return "MISSING"
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def getPackageVersion(package):
+    """Return the version of a package as set up by EUPS.
+
+    Parameters
+    ----------
+    package : `str`
+        Name of the package.
+
+    Returns
+    -------
+    version : `str`
+        The EUPS setup string of the package, which includes its
+        version and location, or ``"unknown"`` if it is not set up.
+    """
+    return os.environ.get(f"SETUP_{package.upper()}", "unknown")
+
+
+def makeFingerprint(visits=(), configFiles=(), upstream=(), packages=(), extra=None):
+    """Fingerprint the inputs of a build stage.
+
+    Parameters
+    ----------
+    visits : `list` [`int`], optional
+        Exposures processed by the stage.
+    configFiles : `list` [`str`], optional
+        Configuration files read by the stage; their contents are
+        included.
+    upstream : `list` [`str`], optional
+        Fingerprints of the stages whose products this stage reads.
+    packages : `list` [`str`], optional
+        Packages whose versions affect the stage's output.
+    extra : `dict`, optional
+        Any other JSON-serializable inputs.
+
+    Returns
+    -------
+    fingerprint : `str`
+        Hexadecimal digest that changes whenever any input changes.
+    """
+    components = {
+        "visits": [str(visit) for visit in visits],
+        "configFiles": {path: fileChecksum(path) for path in configFiles},
+        "upstream": list(upstream),
+        "packages": {package: getPackageVersion(package) for package in packages},
+        "extra": extra or {},
+    }
+    return hashlib.sha256(json.dumps(components, sort_keys=True).encode()).hexdigest()
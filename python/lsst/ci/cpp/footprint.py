@@ -0,0 +1,277 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Disk footprint and provenance of the DATA/SConscript stage outputs.
+
+When a stage finishes, `writeProvenance` records the bytes and files it
+left on disk, its fingerprint and the inputs it was built from in
+``.provenance.json`` in its output directory.  Intermediate outputs,
+such as the ISR reruns, may be evicted by `evictStage` once every stage
+that reads them is done: their files are removed, but the fingerprint
+and provenance are kept, so SCons still considers the stage built and
+the stage can be rebuilt from the provenance on demand.
+
+This module is imported while SCons reads the build scripts, so it must
+only depend on the standard library.
+"""
+
+__all__ = ["PROVENANCE_FILE", "evictStage", "formatFootprint", "getRerunState", "measureFootprint",
+           "readProvenance", "selectEvictions", "writeProvenance"]
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+PROVENANCE_FILE = ".provenance.json"
+# Files kept when a stage is evicted.
+_KEPT_FILES = (".fingerprint", PROVENANCE_FILE)
+
+
+def measureFootprint(path):
+    """Measure the disk space used below a directory.
+
+    Symbolic links are counted, but not followed, so files linked from
+    other stages are not counted twice.
+
+    Parameters
+    ----------
+    path : `str`
+        Directory to measure.
+
+    Returns
+    -------
+    nBytes : `int`
+        Bytes allocated to the files, or their size where the allocation
+        is not reported.
+    nFiles : `int`
+        Number of files.
+    """
+    nBytes = 0
+    nFiles = 0
+    for dirPath, dirNames, fileNames in os.walk(path):
+        for name in fileNames + [name for name in dirNames if os.path.islink(os.path.join(dirPath, name))]:
+            try:
+                stat = os.lstat(os.path.join(dirPath, name))
+            except OSError:
+                continue
+            nBytes += getattr(stat, "st_blocks", stat.st_size/512)*512
+            nFiles += 1
+    return int(nBytes), nFiles
+
+
+def readProvenance(outputDir):
+    """Read the provenance of a stage.
+
+    Parameters
+    ----------
+    outputDir : `str`
+        Output directory of the stage.
+
+    Returns
+    -------
+    provenance : `dict` or `None`
+        The record written by `writeProvenance`, or `None` if the stage
+        has not recorded one.
+    """
+    try:
+        with open(os.path.join(outputDir, PROVENANCE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(outputDir, provenance):
+    """Replace the provenance of a stage atomically.
+    """
+    fd, tmpPath = tempfile.mkstemp(dir=outputDir, suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(provenance, f, indent=2)
+        os.replace(tmpPath, os.path.join(outputDir, PROVENANCE_FILE))
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+
+def getRerunState(rerunDir, datasetDir="postISRCCD"):
+    """Tell why the exposures of a rerun are or are not available.
+
+    Parameters
+    ----------
+    rerunDir : `str`
+        Rerun written by an ISR stage.
+    datasetDir : `str`, optional
+        Subdirectory of the rerun holding the exposures.
+
+    Returns
+    -------
+    state : `str`
+        ``"available"``; ``"evicted"`` if `evictStage` removed them;
+        ``"released"`` if they were written to a scratch directory that
+        has since been removed, as fused stages do; or ``"missing"`` if
+        the stage was not built.
+    """
+    path = os.path.join(rerunDir, datasetDir)
+    if os.path.exists(path):
+        return "available"
+    if os.path.islink(path):
+        return "released"
+    provenance = readProvenance(rerunDir)
+    if provenance is not None and provenance.get("evicted"):
+        return "evicted"
+    return "missing"
+
+
+def writeProvenance(outputDir, stage, fingerprint, inputs):
+    """Record the footprint and provenance of a stage that just finished.
+
+    Parameters
+    ----------
+    outputDir : `str`
+        Output directory of the stage.
+    stage : `str`
+        Alias of the stage.
+    fingerprint : `str`
+        Fingerprint the stage was built from.
+    inputs : `dict`
+        Anything else needed to rebuild the stage, such as its upstream
+        stages, exposures, configuration files and commands.
+
+    Returns
+    -------
+    provenance : `dict`
+        The record: ``stage``, ``outputDir``, ``fingerprint``,
+        ``inputs``, the time it was ``built``, its ``bytes`` and
+        ``files``, and whether it was ``evicted``.
+    """
+    nBytes, nFiles = measureFootprint(outputDir)
+    provenance = {"stage": stage, "outputDir": os.path.abspath(outputDir), "fingerprint": fingerprint,
+                  "inputs": inputs, "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "bytes": nBytes, "files": nFiles, "evicted": False}
+    _write(outputDir, provenance)
+    return provenance
+
+
+def selectEvictions(footprints, candidates, budget):
+    """Choose the stages to evict to fit a disk budget.
+
+    Parameters
+    ----------
+    footprints : `dict` [`str`, `int`]
+        Bytes currently used by each stage.
+    candidates : `list` [`str`]
+        Stages that may be evicted, because every stage reading them is
+        done.
+    budget : `int`
+        Bytes that all stages together may use.
+
+    Returns
+    -------
+    evict : `list` [`str`]
+        Candidates to evict, largest first, until the total fits the
+        budget or there are no candidates left.
+    """
+    excess = sum(footprints.values()) - budget
+    evict = []
+    for stage in sorted(candidates, key=lambda stage: (-footprints.get(stage, 0), stage)):
+        if excess <= 0:
+            break
+        if footprints.get(stage, 0) > 0:
+            evict.append(stage)
+            excess -= footprints[stage]
+    return evict
+
+
+def evictStage(outputDir, reason=""):
+    """Remove the files of a stage, keeping its fingerprint and provenance.
+
+    Parameters
+    ----------
+    outputDir : `str`
+        Output directory of the stage.
+    reason : `str`, optional
+        Why the stage was evicted, for the provenance.
+
+    Returns
+    -------
+    freed : `int`
+        Bytes freed.
+    """
+    provenance = readProvenance(outputDir) or {"outputDir": os.path.abspath(outputDir)}
+    before, _ = measureFootprint(outputDir)
+    for entry in os.listdir(outputDir):
+        path = os.path.join(outputDir, entry)
+        if entry in _KEPT_FILES:
+            continue
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    after, _ = measureFootprint(outputDir)
+    provenance.update(evicted=True, evictedAt=time.strftime("%Y-%m-%dT%H:%M:%S"), evictionReason=reason,
+                      bytesFreed=before - after)
+    _write(outputDir, provenance)
+    return before - after
+
+
+def formatFootprint(rootDir):
+    """Format the footprint of the stages below a directory as a table.
+
+    Parameters
+    ----------
+    rootDir : `str`
+        Directory to search for stage provenance, such as ``DATA``.
+
+    Returns
+    -------
+    table : `str`
+        One line per stage with its size when built, whether it was
+        evicted, and when it was built.
+    """
+    records = []
+    for path in glob.glob(os.path.join(rootDir, "**", PROVENANCE_FILE), recursive=True):
+        provenance = readProvenance(os.path.dirname(path))
+        if provenance is not None:
+            records.append(provenance)
+    lines = [f"{'stage':<14} {'size[MB]':>9} {'files':>7} {'evicted':>7}  built"]
+    total = 0
+    for record in sorted(records, key=lambda record: record["built"]):
+        if not record["evicted"]:
+            total += record["bytes"]
+        lines.append(f"{record['stage']:<14} {record['bytes']/2**20:>9.0f} {record['files']:>7} "
+                     f"{'yes' if record['evicted'] else 'no':>7}  {record['built']}")
+    lines.append(f"On disk: {total/2**20:.0f} MB")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the disk footprint of the build stages.")
+    parser.add_argument("root", help="Directory holding the stage outputs, such as DATA.")
+    args = parser.parse_args()
+    print(formatFootprint(args.root))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Persistent cache of the metadata extracted from FITS headers.
+"""
+
+__all__ = ["HeaderCache", "getHeaderCachePath"]
+
+import os
+import pickle
+import sqlite3
+
+
+def getHeaderCachePath():
+    """Return the default header cache location.
+
+    Returns
+    -------
+    path : `str`
+        The value of the ``CI_CPP_HEADER_CACHE`` environment variable if
+        set, otherwise ``DATA/headerCache.sqlite3`` in this package.
+    """
+    path = os.environ.get("CI_CPP_HEADER_CACHE")
+    if path is None:
+        from lsst.utils import getPackageDir
+        path = os.path.join(getPackageDir("ci_cpp_gen2"), "DATA", "headerCache.sqlite3")
+    return path
+
+
+class HeaderCache:
+    """Metadata extracted from files, keyed by the file path, size and
+    modification time.
+
+    Entries are only valid for the configuration that extracted them, so
+    each cache instance is bound to a key describing that configuration.
+
+    Parameters
+    ----------
+    path : `str`
+        SQLite database holding the cache; created if needed.
+    configKey : `str`
+        Identifies the code and configuration extracting the metadata.
+    """
+
+    def __init__(self, path, configKey):
+        self.path = path
+        self.configKey = configKey
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS headers "
+                         "(path TEXT, configKey TEXT, size INTEGER, mtimeNs INTEGER, info BLOB, "
+                         "PRIMARY KEY (path, configKey))")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    @staticmethod
+    def _stat(filename):
+        stat = os.stat(filename)
+        return stat.st_size, stat.st_mtime_ns
+
+    def lookup(self, files):
+        """Return the cached metadata of files that have not changed.
+
+        Parameters
+        ----------
+        files : `list` [`str`]
+            Files to look up.
+
+        Returns
+        -------
+        found : `dict` [`str`, `object`]
+            Metadata of each file with a valid cache entry.
+        """
+        wanted = {os.path.abspath(filename): filename for filename in files}
+        with self._connect() as conn:
+            rows = conn.execute("SELECT path, size, mtimeNs, info FROM headers WHERE configKey = ?",
+                                (self.configKey,)).fetchall()
+        found = {}
+        for path, size, mtimeNs, info in rows:
+            filename = wanted.get(path)
+            if filename is not None and self._stat(filename) == (size, mtimeNs):
+                found[filename] = pickle.loads(info)
+        return found
+
+    def store(self, entries):
+        """Add metadata to the cache.
+
+        Parameters
+        ----------
+        entries : `dict` [`str`, `object`]
+            Picklable metadata of each file.
+        """
+        rows = []
+        for filename, info in entries.items():
+            size, mtimeNs = self._stat(filename)
+            rows.append((os.path.abspath(filename), self.configKey, size, mtimeNs,
+                         pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL)))
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?)", rows)
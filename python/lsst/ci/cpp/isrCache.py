@@ -0,0 +1,397 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Persistent cache of ISR-processed exposures used by the tests.
+"""
+
+__all__ = ["CachedExposures", "IsrCache", "getIsrCacheDir", "getIsrCacheSize", "runIsrForDetectors"]
+
+import collections.abc
+import functools
+import glob
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+import lsst.afw.image as afwImage
+import lsst.ip.isr as ipIsr
+from lsst.utils import getPackageDir
+
+from .detectors import mapDetectors
+from .fingerprint import getPackageVersion
+from .sharedButler import getSharedButler
+
+
+# Packages whose versions are part of every cache key.
+ISR_PACKAGES = ["afw", "daf_persistence", "ip_isr", "meas_algorithms", "obs_base", "obs_lsst",
+                "obs_lsst_data"]
+
+# Seconds after its last use during which an entry is not removed, as
+# other test processes may still be reading it.
+PRUNE_MIN_AGE = 3600.0
+
+
+# Calibration datasets read by IsrTask, keyed by the config option that
+# enables them.
+CALIBRATION_PRODUCTS = {
+    "doBias": "bias",
+    "doDark": "dark",
+    "doFlat": "flat",
+    "doDefect": "defects",
+    "doLinearize": "linearizer",
+    "doCrosstalk": "crosstalk",
+    "doBrighterFatter": "bfKernel",
+    "doFringe": "fringe",
+}
+
+
+def getIsrCacheDir():
+    """Return the default ISR cache directory.
+
+    Returns
+    -------
+    cacheDir : `str`
+        The value of the ``CI_CPP_ISR_CACHE`` environment variable if
+        set, otherwise ``DATA/isrCache`` in this package.
+    """
+    cacheDir = os.environ.get("CI_CPP_ISR_CACHE")
+    if cacheDir is None:
+        cacheDir = os.path.join(getPackageDir("ci_cpp_gen2"), "DATA", "isrCache")
+    return cacheDir
+
+
+def getIsrCacheSize():
+    """Return the size limit of the ISR cache.
+
+    Returns
+    -------
+    maxBytes : `int` or `None`
+        ``CI_CPP_ISR_CACHE_GB``, in GB, if set, otherwise 20 GB; `None`
+        if it is set to 0, for no limit.
+    """
+    size = float(os.environ.get("CI_CPP_ISR_CACHE_GB") or 20)
+    return int(size*2**30) if size > 0 else None
+
+
+def _touch(path):
+    """Mark a cache entry as used.
+
+    Returns
+    -------
+    found : `bool`
+        Whether the entry exists; it may have been removed by another
+        process.
+    """
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _describeFiles(dataRef, datasetType):
+    """Describe the files backing a dataset for use in a cache key.
+
+    Parameters
+    ----------
+    dataRef : `lsst.daf.persistence.ButlerDataRef`
+        Data reference to look the dataset up with.
+    datasetType : `str`
+        Dataset to describe.
+
+    Returns
+    -------
+    description : `list` [`str`]
+        Path, size and modification time of each file, or a marker if
+        the dataset could not be found.
+    """
+    try:
+        filenames = dataRef.get(f"{datasetType}_filename")
+    except (RuntimeError, KeyError):
+        return [f"{datasetType}:MISSING"]
+
+    description = []
+    for filename in filenames:
+        filename = filename.split("[")[0]
+        if os.path.exists(filename):
+            stat = os.stat(filename)
+            description.append(f"{datasetType}:{os.path.realpath(filename)}:"
+                               f"{stat.st_size}:{stat.st_mtime_ns}")
+        else:
+            description.append(f"{datasetType}:{filename}:MISSING")
+    return description
+
+
+class IsrCache:
+    """On-disk cache of ISR-processed exposures.
+
+    Exposures are keyed by a hash of the `~lsst.ip.isr.IsrTaskConfig`,
+    the dataId, the versions of the `ISR_PACKAGES`, and the raw and
+    calibration files used.  Files are identified by path, size and
+    modification time, so rebuilding a calibration invalidates every
+    entry that used it.  Once the cache exceeds its size limit, the
+    least recently used entries are removed.
+
+    Parameters
+    ----------
+    cacheDir : `str`, optional
+        Directory holding the cached exposures.  Defaults to the value
+        returned by `getIsrCacheDir`.
+    maxBytes : `int`, optional
+        Size limit of the cache.  Defaults to the value returned by
+        `getIsrCacheSize`.
+    """
+
+    def __init__(self, cacheDir=None, maxBytes=None):
+        self.cacheDir = cacheDir if cacheDir is not None else getIsrCacheDir()
+        self.maxBytes = maxBytes if maxBytes is not None else getIsrCacheSize()
+
+    def makeKey(self, config, dataRef):
+        """Construct the cache key for an ISR invocation.
+
+        Parameters
+        ----------
+        config : `lsst.ip.isr.IsrTaskConfig`
+            Configuration the ISR will be run with.
+        dataRef : `lsst.daf.persistence.ButlerDataRef`
+            Data reference for the raw exposure.
+
+        Returns
+        -------
+        key : `str`
+            Hexadecimal digest identifying the ISR output.
+        """
+        stream = io.StringIO()
+        config.saveToStream(stream)
+
+        components = [stream.getvalue(),
+                      repr(sorted(dataRef.dataId.items())),
+                      getattr(ipIsr, "__version__", "unknown")]
+        components.extend(f"{package}={getPackageVersion(package)}" for package in ISR_PACKAGES)
+        components.extend(_describeFiles(dataRef, "raw"))
+        for option, datasetType in CALIBRATION_PRODUCTS.items():
+            if getattr(config, option, False):
+                components.extend(_describeFiles(dataRef, datasetType))
+
+        return hashlib.sha256("\n".join(components).encode()).hexdigest()
+
+    def getPath(self, key):
+        """Return the location of a cache entry.
+
+        Parameters
+        ----------
+        key : `str`
+            Cache key from `makeKey`.
+
+        Returns
+        -------
+        path : `str`
+            Path to the cached exposure.
+        """
+        return os.path.join(self.cacheDir, key[:2], f"{key}.fits")
+
+    def runDataRef(self, isrTask, dataRef):
+        """Return the ISR-processed exposure, running ISR only if needed.
+
+        Parameters
+        ----------
+        isrTask : `lsst.ip.isr.IsrTask`
+            Task to process the exposure with on a cache miss.
+        dataRef : `lsst.daf.persistence.ButlerDataRef`
+            Data reference for the raw exposure.
+
+        Returns
+        -------
+        exposure : `lsst.afw.image.Exposure`
+            The ISR-processed exposure.
+        """
+        path = self.getPath(self.makeKey(isrTask.config, dataRef))
+        if _touch(path):
+            return afwImage.ExposureF(path)
+
+        exposure = isrTask.runDataRef(dataRef).outputExposure
+        self._write(exposure, path)
+        self.prune()
+        return exposure
+
+    def ensurePath(self, isrTask, dataRef):
+        """Return the cached file of an ISR-processed exposure, running
+        ISR first if needed.
+
+        Parameters
+        ----------
+        isrTask : `lsst.ip.isr.IsrTask`
+            Task to process the exposure with on a cache miss.
+        dataRef : `lsst.daf.persistence.ButlerDataRef`
+            Data reference for the raw exposure.
+
+        Returns
+        -------
+        path : `str`
+            Path to the cached exposure.
+        """
+        path = self.getPath(self.makeKey(isrTask.config, dataRef))
+        if not _touch(path):
+            self._write(isrTask.runDataRef(dataRef).outputExposure, path)
+            self.prune()
+        return path
+
+    def prune(self, minAge=PRUNE_MIN_AGE):
+        """Remove the least recently used entries until the cache is
+        within its size limit.
+
+        Parameters
+        ----------
+        minAge : `float`, optional
+            Entries used less than this many seconds ago are kept, even
+            if the cache stays over its limit.
+
+        Returns
+        -------
+        freed : `int`
+            Bytes removed.
+        """
+        if self.maxBytes is None:
+            return 0
+        entries = []
+        for path in glob.glob(os.path.join(self.cacheDir, "??", "*")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        excess = sum(size for _, size, _ in entries) - self.maxBytes
+        now = time.time()
+        freed = 0
+        for mtime, size, path in sorted(entries):
+            if freed >= excess or now - mtime < minAge:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Removed by another process meanwhile.
+                pass
+            freed += size
+        return freed
+
+    @staticmethod
+    def _write(exposure, path):
+        """Write an exposure so that concurrent readers never see a
+        partial file.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Exposure to write.
+        path : `str`
+            Final location of the file.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".fits")
+        os.close(fd)
+        try:
+            exposure.writeFits(tmpPath)
+            os.replace(tmpPath, path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+
+class CachedExposures(collections.abc.Mapping):
+    """Read-only mapping of detectors to cached exposures.
+
+    Exposures are read from the cache each time they are looked up and
+    are not kept, so iterating over the items holds one exposure in
+    memory at a time, however many detectors there are.
+
+    Parameters
+    ----------
+    paths : `dict` [`int`, `str`]
+        Cached exposure of each detector.
+    """
+
+    def __init__(self, paths):
+        self.paths = dict(paths)
+
+    def __getitem__(self, detector):
+        return afwImage.ExposureF(self.paths[detector])
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+
+def _processDetector(detector, repoDir, calibDir, config, dataId, cacheDir):
+    """Process one detector of an exposure through the cache.
+
+    Parameters
+    ----------
+    detector : `int`
+        Detector to process.
+    repoDir, calibDir, config, dataId, cacheDir
+        See `runIsrForDetectors`.
+
+    Returns
+    -------
+    path : `str`
+        Path to the cached exposure.
+    """
+    butler = getSharedButler(repoDir, calibDir)
+    dataRef = butler.dataRef('raw', dataId=dict(dataId, detector=detector))
+    return IsrCache(cacheDir).ensurePath(ipIsr.IsrTask(config=config), dataRef)
+
+
+def runIsrForDetectors(repoDir, calibDir, config, dataId, detectors, processes=None, cacheDir=None):
+    """Run ISR on an exposure for several detectors in a process pool.
+
+    Parameters
+    ----------
+    repoDir : `str`
+        Root of the data repository.
+    calibDir : `str`
+        Root of the calibration repository.
+    config : `lsst.ip.isr.IsrTaskConfig`
+        Configuration to run ISR with.
+    dataId : `dict`
+        Data id of the exposure, without the detector.
+    detectors : `list` [`int`]
+        Detectors to process.
+    processes : `int`, optional
+        Number of worker processes; see
+        `lsst.ci.cpp.detectors.mapDetectors`.
+    cacheDir : `str`, optional
+        Cache directory; see `IsrCache`.
+
+    Returns
+    -------
+    exposures : `CachedExposures`
+        ISR-processed exposure of each detector, read from the cache
+        when it is looked up.
+    """
+    # Construct the butler before forking, so the workers inherit it.
+    getSharedButler(repoDir, calibDir)
+    paths = mapDetectors(functools.partial(_processDetector, repoDir=repoDir, calibDir=calibDir,
+                                           config=config, dataId=dataId, cacheDir=cacheDir),
+                         detectors, processes)
+    return CachedExposures(paths)
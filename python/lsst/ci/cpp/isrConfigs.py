@@ -0,0 +1,119 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""ISR configurations exercised by the tests and by DATA/SConscript.
+"""
+
+__all__ = ["loadRunIsrConfig", "makeIsrConfig", "makePipelineIsrConfigs"]
+
+import os
+
+import lsst.ip.isr as ipIsr
+from lsst.ip.isr.runIsr import RunIsrConfig
+from lsst.utils import getPackageDir
+
+
+# Steps enabled for every test configuration.
+ENABLED_STEPS = ["doSaturation", "doSuspect", "doSetBadRegions", "doOverscan", "doBias",
+                 "doVariance"]
+
+# Steps disabled for every test configuration.
+DISABLED_STEPS = ["doLinearize", "doCrosstalk", "doWidenSaturationTrails", "doBrighterFatter",
+                  "doSaturationInterpolation", "doStrayLight", "doApplyGains", "doFringe",
+                  "doMeasureBackground", "doVignette", "doAttachTransmissionCurve",
+                  "doUseOpticsTransmission", "doUseFilterTransmission",
+                  "doUseSensorTransmission", "doUseAtmosphereTransmission"]
+
+
+def makeIsrConfig(doDark=False, doFlat=False, doDefect=False):
+    """Construct the ISR configuration used by the tests.
+
+    Parameters
+    ----------
+    doDark : `bool`, optional
+        Apply dark correction.
+    doFlat : `bool`, optional
+        Apply flat correction.
+    doDefect : `bool`, optional
+        Mask and interpolate defects.
+
+    Returns
+    -------
+    config : `lsst.ip.isr.IsrTaskConfig`
+        Configuration with overscan and bias correction, plus the
+        requested steps.
+    """
+    config = ipIsr.IsrTaskConfig()
+    for step in ENABLED_STEPS:
+        setattr(config, step, True)
+    for step in DISABLED_STEPS:
+        setattr(config, step, False)
+    config.doDark = doDark
+    config.doFlat = doFlat
+    config.doDefect = doDefect
+    return config
+
+
+def loadRunIsrConfig(configFile, overrides=None):
+    """Construct the ISR configuration of a ``runIsr.py`` invocation.
+
+    The obs_lsst overrides for LATISS are applied as the command-line
+    task would, followed by ``configFile`` and ``overrides``.
+
+    Parameters
+    ----------
+    configFile : `str`
+        Configuration file given with ``-C``.
+    overrides : `dict` [`str`, `object`], optional
+        ISR options given with ``-c isr.<name>=<value>``.
+
+    Returns
+    -------
+    config : `lsst.ip.isr.IsrTaskConfig`
+        The ISR configuration.
+    """
+    config = RunIsrConfig()
+    obsConfigDir = os.path.join(getPackageDir("obs_lsst"), "config")
+    for path in (os.path.join(obsConfigDir, "runIsr.py"),
+                 os.path.join(obsConfigDir, "latiss", "runIsr.py"),
+                 configFile):
+        if os.path.exists(path):
+            config.load(path)
+    for name, value in (overrides or {}).items():
+        setattr(config.isr, name, value)
+    return config.isr
+
+
+def makePipelineIsrConfigs():
+    """Construct the ISR configurations run by DATA/SConscript.
+
+    Returns
+    -------
+    configs : `dict` [`str`, `lsst.ip.isr.IsrTaskConfig`]
+        The crosstalk, defect and PTC ISR configurations.
+    """
+    cpPipeConfigDir = os.path.join(getPackageDir("cp_pipe"), "config")
+    obsConfigDir = os.path.join(getPackageDir("obs_lsst"), "config")
+    return {
+        "crosstalkIsr": loadRunIsrConfig(os.path.join(cpPipeConfigDir, "crosstalkIsr.py"),
+                                         {"doLinearize": False}),
+        "defectIsr": loadRunIsrConfig(os.path.join(cpPipeConfigDir, "defectIsr.py")),
+        "ptcIsr": loadRunIsrConfig(os.path.join(obsConfigDir, "latiss", "ptcIsr.py")),
+    }
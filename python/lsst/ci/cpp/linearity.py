@@ -0,0 +1,209 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Per-amplifier linearity measurement from a flat sequence.
+
+Only the exposure time and the median of each amplifier are kept for
+each flat, so memory does not grow with the image size and grows only
+by one row per flat.  The polynomial of every amplifier is fitted in
+one batched least-squares solve.
+"""
+
+__all__ = ["LinearityAccumulator", "measureAmpMedians"]
+
+import numpy as np
+
+from .ampStatistics import makeAmpStack
+
+
+def measureAmpMedians(exposure, detector=None, badMaskPlanes=("SAT", "BAD", "NO_DATA")):
+    """Measure the median of every amplifier.
+
+    Parameters
+    ----------
+    exposure : `lsst.afw.image.Exposure`
+        ISR-processed flat.
+    detector : `lsst.afw.cameraGeom.Detector`, optional
+        Detector describing the amplifier layout.  Defaults to the
+        detector attached to ``exposure``.
+    badMaskPlanes : `list` [`str`], optional
+        Mask planes of pixels to exclude.
+
+    Returns
+    -------
+    ampNames : `list` [`str`]
+        The amplifiers.
+    medians : `numpy.ndarray`, (nAmp,)
+        Median of each amplifier, in ADU.
+    """
+    if detector is None:
+        detector = exposure.getDetector()
+    amps = list(detector)
+    bboxes = [amp.getBBox() for amp in amps]
+    xy0 = (exposure.getX0(), exposure.getY0())
+
+    values, padding = makeAmpStack(exposure.getImage().getArray(), bboxes, xy0)
+    maskBits, _ = makeAmpStack(exposure.getMask().getArray(), bboxes, xy0)
+    values = values.astype(np.float64)
+    values[padding | ((maskBits & exposure.getMask().getPlaneBitMask(list(badMaskPlanes))) != 0)] = np.nan
+    with np.errstate(invalid="ignore"):
+        medians = np.nanmedian(values, axis=1)
+    return [amp.getName() for amp in amps], medians
+
+
+class LinearityAccumulator:
+    """Collect per-amplifier medians of flats and fit their linearity.
+
+    Parameters
+    ----------
+    ampNames : `list` [`str`]
+        Amplifiers, in the order of the medians that will be added.
+    """
+
+    def __init__(self, ampNames):
+        self.ampNames = list(ampNames)
+        self._exposureTimes = []
+        self._medians = []
+
+    @property
+    def nExposures(self):
+        return len(self._exposureTimes)
+
+    def add(self, exposureTime, medians):
+        """Add the medians of one flat.
+
+        Parameters
+        ----------
+        exposureTime : `float`
+            Exposure time of the flat, in seconds.
+        medians : `numpy.ndarray`, (nAmp,)
+            Median of each amplifier.
+        """
+        if len(medians) != len(self.ampNames):
+            raise ValueError(f"Expected {len(self.ampNames)} medians, not {len(medians)}.")
+        self._exposureTimes.append(float(exposureTime))
+        self._medians.append(np.asarray(medians, dtype=np.float64))
+
+    def addExposure(self, exposure, detector=None):
+        """Add the medians of a flat.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            ISR-processed flat, with its visit info.
+        detector : `lsst.afw.cameraGeom.Detector`, optional
+            See `measureAmpMedians`.
+        """
+        ampNames, medians = measureAmpMedians(exposure, detector)
+        if ampNames != self.ampNames:
+            raise ValueError(f"Expected amplifiers {self.ampNames}, not {ampNames}.")
+        self.add(exposure.getInfo().getVisitInfo().getExposureTime(), medians)
+
+    def fit(self, order=3, tolerance=0.01):
+        """Fit the signal of every amplifier as a polynomial in time.
+
+        Parameters
+        ----------
+        order : `int`, optional
+            Polynomial order.  The terms above first order describe the
+            non-linearity.
+        tolerance : `float`, optional
+            Largest fractional deviation from the fit of a flat that can
+            still be linearized.
+
+        Returns
+        -------
+        results : `dict` [`str`, `dict` [`str`, `object`]]
+            For each amplifier, the polynomial ``coefficients`` in
+            increasing order, the fractional ``nonLinearity`` of each
+            flat (signal over the linear term, minus one), the fractional
+            ``residuals`` from the full polynomial, whether each flat is
+            ``linearizable``, that is, it and every shorter exposure are
+            within ``tolerance`` of the fit, and the ``turnoff``: the
+            largest median of a linearizable flat.  Only the flats up to
+            the turnoff are fitted, and all results are NaN for
+            amplifiers with fewer than ``order + 2`` such flats.
+        """
+        sortOrder = np.argsort(self._exposureTimes, kind="stable")
+        times = np.array(self._exposureTimes)[sortOrder]
+        medians = np.array(self._medians)[sortOrder]
+
+        # Only fit the flats before the signal stops increasing.  Flats
+        # with the same exposure time, such as PTC pairs, differ only by
+        # noise, so the mean of each exposure time is compared with the
+        # mean of the one before.
+        uniqueTimes, group = np.unique(times, return_inverse=True)
+        finite = np.isfinite(medians)
+        counts = np.zeros((len(uniqueTimes), medians.shape[1]))
+        sums = np.zeros_like(counts)
+        np.add.at(counts, group, finite)
+        np.add.at(sums, group, np.where(finite, medians, 0.0))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            groupMeans = sums/counts
+        increasing = np.ones_like(groupMeans, dtype=bool)
+        increasing[1:] = groupMeans[1:] > groupMeans[:-1]
+        usable = np.logical_and.accumulate(increasing[group] & finite, axis=0)
+        vandermonde = np.vander(times, order + 1, increasing=True)
+        nMin = order + 2
+
+        # Noise lets some flats past saturation through, so drop the
+        # brightest usable flat of every amplifier that still has flats
+        # outside the tolerance, and refit.
+        while True:
+            coefficients = self._solve(vandermonde, medians, usable, nMin)
+            model = vandermonde @ coefficients.T
+            with np.errstate(invalid="ignore", divide="ignore"):
+                residuals = medians/model - 1.0
+            nUsable = usable.sum(axis=0)
+            failing = (usable & ~(np.abs(residuals) < tolerance)).any(axis=0) & (nUsable > nMin)
+            if not failing.any():
+                break
+            usable[nUsable[failing] - 1, np.flatnonzero(failing)] = False
+
+        linear = coefficients[:, 0] + times[:, np.newaxis]*coefficients[:, 1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            nonLinearity = medians/linear - 1.0
+        linearizable = np.logical_and.accumulate(usable & (np.abs(residuals) < tolerance), axis=0)
+        turnoff = np.where(linearizable.any(axis=0),
+                           np.max(np.where(linearizable, medians, -np.inf), axis=0), np.nan)
+
+        return {ampName: {"coefficients": coefficients[index],
+                          "exposureTimes": times,
+                          "medians": medians[:, index],
+                          "nonLinearity": nonLinearity[:, index],
+                          "residuals": residuals[:, index],
+                          "linearizable": linearizable[:, index],
+                          "turnoff": turnoff[index]}
+                for index, ampName in enumerate(self.ampNames)}
+
+    @staticmethod
+    def _solve(vandermonde, medians, usable, nMin):
+        """Weighted least squares of all amplifiers at once, with the
+        unusable flats given zero weight.
+        """
+        weights = usable.astype(np.float64)
+        normal = np.einsum("ea,ei,ej->aij", weights, vandermonde, vandermonde)
+        projection = np.einsum("ea,ei,ea->ai", weights, vandermonde, np.where(usable, medians, 0.0))
+        # Keep the batch solvable when an amplifier has too few flats.
+        tooFew = usable.sum(axis=0) < nMin
+        normal[tooFew] = np.eye(vandermonde.shape[1])
+        coefficients = np.linalg.solve(normal, projection[:, :, np.newaxis])[:, :, 0]
+        coefficients[tooFew] = np.nan
+        return coefficients
@@ -0,0 +1,453 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Append-only store of the metrics measured by the tests.
+
+Each test process writes its metrics, one row per run, test, detector,
+amplifier and metric, as a single ``.npz`` shard of column arrays when
+it exits.  Shards are never modified, so concurrent runs do not
+interfere; `compactMetrics` merges them once there are many, one
+compaction at a time.  Queries
+load the columns of the requested runs and compare them with array
+operations.
+
+Metrics are stored in ``CI_CPP_METRICS_DIR``, or ``DATA/metrics``.  The
+run is named by ``CI_CPP_RUN_ID``, which the tests SConscript sets to
+the build id, so that all test processes of a build, including
+pytest-xdist workers, record one run.
+"""
+
+__all__ = ["COLUMNS", "MetricsRecorder", "compactMetrics", "diffRuns", "getMetricsDir", "getRecorder",
+           "listRuns", "loadMetrics", "main", "recordMetric", "trendMetrics"]
+
+import argparse
+import atexit
+import fcntl
+import glob
+import os
+import platform
+import re
+import sys
+import time
+
+import numpy as np
+
+
+# Columns of every shard, and their types.
+COLUMNS = {"run": str, "timestamp": np.float64, "test": str, "detector": np.int64, "amp": str,
+           "metric": str, "value": np.float64}
+
+# Recorder shared by the tests of this process.
+_recorder = None
+
+
+def getMetricsDir():
+    """Return the directory of the metrics store.
+
+    Returns
+    -------
+    path : `str`
+        ``CI_CPP_METRICS_DIR`` if it is set, else ``DATA/metrics`` in
+        this package.
+    """
+    path = os.environ.get("CI_CPP_METRICS_DIR")
+    if path:
+        return path
+    from lsst.utils import getPackageDir
+    return os.path.join(getPackageDir("ci_cpp_gen2"), "DATA", "metrics")
+
+
+def _shardPrefix(run):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", run)
+
+
+class MetricsRecorder:
+    """Collect metrics and write them as one shard.
+
+    Parameters
+    ----------
+    storeDir : `str`
+        Directory of the store.
+    run : `str`
+        Name of the run.
+    """
+
+    def __init__(self, storeDir, run):
+        self.storeDir = storeDir
+        self.run = run
+        self.timestamp = time.time()
+        self._rows = []
+
+    def record(self, test, metric, value, detector=-1, amp=""):
+        """Record a metric.
+
+        Parameters
+        ----------
+        test : `str`
+            Test that measured it.
+        metric : `str`
+            Name of the metric.
+        value : `float`
+            Measured value.
+        detector : `int`, optional
+            Detector measured, or -1.
+        amp : `str`, optional
+            Amplifier measured, or empty for the whole detector.
+        """
+        self._rows.append((test, int(detector), amp or "", metric, float(value)))
+
+    def flush(self):
+        """Write the recorded metrics as a new shard.
+
+        Returns
+        -------
+        path : `str` or `None`
+            The shard written, or `None` if nothing was recorded.
+        """
+        if not self._rows:
+            return None
+        tests, detectors, amps, metrics, values = zip(*self._rows)
+        columns = {"run": np.full(len(values), self.run),
+                   "timestamp": np.full(len(values), self.timestamp),
+                   "test": np.array(tests), "detector": np.array(detectors, dtype=np.int64),
+                   "amp": np.array(amps), "metric": np.array(metrics),
+                   "value": np.array(values, dtype=np.float64)}
+        os.makedirs(self.storeDir, exist_ok=True)
+        path = os.path.join(self.storeDir,
+                            f"{_shardPrefix(self.run)}.{os.getpid()}.{time.time_ns()}.npz")
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            np.savez_compressed(f, **columns)
+        os.replace(temporary, path)
+        self._rows = []
+        return path
+
+
+def getRecorder():
+    """Return the recorder of this process, creating it on first use.
+
+    Returns
+    -------
+    recorder : `MetricsRecorder`
+        Recorder whose metrics are written when the process exits.  Its
+        run is ``CI_CPP_RUN_ID``; without it, the pytest-xdist session,
+        or else this process.
+    """
+    global _recorder
+    if _recorder is None:
+        run = os.environ.get("CI_CPP_RUN_ID")
+        if not run and os.environ.get("PYTEST_XDIST_TESTRUNUID"):
+            # Shared by the workers of one pytest-xdist session.
+            run = f"pytest-{platform.node()}-{os.environ['PYTEST_XDIST_TESTRUNUID']}"
+        if not run:
+            run = f"{time.strftime('%Y%m%dT%H%M%S')}-{platform.node()}-{os.getpid()}"
+        _recorder = MetricsRecorder(getMetricsDir(), run)
+        atexit.register(_recorder.flush)
+    return _recorder
+
+
+def recordMetric(test, metric, value, detector=-1, amp=""):
+    """Record a metric of this process's run.
+
+    See `MetricsRecorder.record` for the parameters.
+    """
+    getRecorder().record(test, metric, value, detector, amp)
+
+
+def _emptyColumns():
+    return {name: np.array([], dtype=kind if kind is not str else "U1") for name, kind in COLUMNS.items()}
+
+
+def _readShards(paths):
+    parts = {name: [] for name in COLUMNS}
+    for path in sorted(paths):
+        with np.load(path, allow_pickle=False) as shard:
+            for name in COLUMNS:
+                parts[name].append(shard[name])
+    if not parts["run"]:
+        return _emptyColumns()
+    return {name: np.concatenate(arrays) for name, arrays in parts.items()}
+
+
+def loadMetrics(storeDir=None, runs=None):
+    """Load the metrics of some runs.
+
+    Parameters
+    ----------
+    storeDir : `str`, optional
+        Directory of the store.  Defaults to `getMetricsDir`.
+    runs : `list` [`str`], optional
+        Runs to load.  Defaults to all runs.
+
+    Returns
+    -------
+    metrics : `dict` [`str`, `numpy.ndarray`]
+        One array per column of `COLUMNS`.
+    """
+    storeDir = storeDir or getMetricsDir()
+    if runs is None:
+        paths = glob.glob(os.path.join(storeDir, "*.npz"))
+    else:
+        # Shards are named by run, but compacted shards hold many runs.
+        paths = {path for run in runs
+                 for path in glob.glob(os.path.join(storeDir, f"{glob.escape(_shardPrefix(run))}.*.npz"))}
+        paths |= set(glob.glob(os.path.join(storeDir, "compacted.*.npz")))
+
+    metrics = _readShards(paths)
+    if runs is not None:
+        keep = np.isin(metrics["run"], list(runs))
+        metrics = {name: array[keep] for name, array in metrics.items()}
+    return metrics
+
+
+def listRuns(metrics):
+    """List the runs of some metrics in time order.
+
+    Parameters
+    ----------
+    metrics : `dict` [`str`, `numpy.ndarray`]
+        Metrics from `loadMetrics`.
+
+    Returns
+    -------
+    runs : `list` [`str`]
+        The runs, oldest first.
+    """
+    runs, first = np.unique(metrics["run"], return_index=True)
+    return [str(run) for run in runs[np.argsort(metrics["timestamp"][first], kind="stable")]]
+
+
+def _keys(metrics):
+    """Return a key identifying the test, detector, amplifier and metric
+    of each row.
+    """
+    key = np.char.add(metrics["test"].astype(str), "|")
+    key = np.char.add(key, metrics["detector"].astype(str))
+    key = np.char.add(np.char.add(key, "|"), metrics["amp"].astype(str))
+    return np.char.add(np.char.add(key, "|"), metrics["metric"].astype(str))
+
+
+def _latestPerKey(keys, timestamps):
+    """Return the keys and row indices of the last row of each key.
+    """
+    order = np.lexsort((timestamps, keys))
+    sortedKeys = keys[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = sortedKeys[1:] != sortedKeys[:-1]
+    return sortedKeys[last], order[last]
+
+
+def diffRuns(metrics, runA, runB):
+    """Compare the metrics of two runs.
+
+    Parameters
+    ----------
+    metrics : `dict` [`str`, `numpy.ndarray`]
+        Metrics from `loadMetrics`, including both runs.
+    runA, runB : `str`
+        Runs to compare.
+
+    Returns
+    -------
+    diff : `dict` [`str`, `numpy.ndarray`]
+        ``test``, ``detector``, ``amp`` and ``metric`` of each metric
+        measured in both runs, their values ``valueA`` and ``valueB``,
+        ``delta`` (``valueB - valueA``) and ``relative`` (``delta`` over
+        ``|valueA|``), sorted by decreasing ``|relative|``.  ``onlyA``
+        and ``onlyB`` hold the keys measured in one run only.
+    """
+    keys = _keys(metrics)
+    isA = metrics["run"] == runA
+    isB = metrics["run"] == runB
+    keysA, rowsA = _latestPerKey(keys[isA], metrics["timestamp"][isA])
+    keysB, rowsB = _latestPerKey(keys[isB], metrics["timestamp"][isB])
+    rowsA = np.flatnonzero(isA)[rowsA]
+    rowsB = np.flatnonzero(isB)[rowsB]
+
+    common, indexA, indexB = np.intersect1d(keysA, keysB, assume_unique=True, return_indices=True)
+    rowsA, rowsB = rowsA[indexA], rowsB[indexB]
+    valueA = metrics["value"][rowsA]
+    valueB = metrics["value"][rowsB]
+    delta = valueB - valueA
+    with np.errstate(invalid="ignore", divide="ignore"):
+        relative = delta/np.abs(valueA)
+    order = np.argsort(-np.nan_to_num(np.abs(relative), nan=np.inf), kind="stable")
+
+    diff = {name: metrics[name][rowsA][order] for name in ("test", "detector", "amp", "metric")}
+    diff.update({"valueA": valueA[order], "valueB": valueB[order], "delta": delta[order],
+                 "relative": relative[order],
+                 "onlyA": np.setdiff1d(keysA, common), "onlyB": np.setdiff1d(keysB, common)})
+    return diff
+
+
+def trendMetrics(metrics, metric=None, test=None):
+    """Arrange metrics as a run by key table and fit their drift.
+
+    Parameters
+    ----------
+    metrics : `dict` [`str`, `numpy.ndarray`]
+        Metrics from `loadMetrics`.
+    metric : `str`, optional
+        Only include this metric.
+    test : `str`, optional
+        Only include metrics of tests whose name contains this.
+
+    Returns
+    -------
+    trend : `dict` [`str`, `numpy.ndarray`]
+        ``runs`` in time order and the ``keys``
+        (``test|detector|amp|metric``) measured; ``values``, with shape
+        (nRun, nKey) and NaN where a run did not measure a key; and, per
+        key, the ``slope`` of a straight-line fit of the values against
+        the run index, their ``mean`` and ``std``.
+    """
+    select = np.ones(len(metrics["run"]), dtype=bool)
+    if metric is not None:
+        select &= metrics["metric"] == metric
+    if test is not None:
+        select &= np.char.find(metrics["test"].astype(str), test) >= 0
+    metrics = {name: array[select] for name, array in metrics.items()}
+
+    runs = listRuns(metrics)
+    runIndex = {run: index for index, run in enumerate(runs)}
+    keys, keyIndex = np.unique(_keys(metrics), return_inverse=True)
+    rowRun = np.array([runIndex[run] for run in metrics["run"]], dtype=np.int64)
+
+    values = np.full((len(runs), len(keys)), np.nan)
+    # Later rows of a run overwrite earlier ones.
+    order = np.argsort(metrics["timestamp"], kind="stable")
+    values[rowRun[order], keyIndex[order]] = metrics["value"][order]
+
+    measured = np.isfinite(values)
+    x = np.broadcast_to(np.arange(len(runs), dtype=np.float64)[:, np.newaxis], values.shape)
+    n = measured.sum(axis=0)
+    xm = np.where(measured, x, 0.0)
+    ym = np.where(measured, values, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = ym.sum(axis=0)/n
+        xMean = xm.sum(axis=0)/n
+        dx = np.where(measured, x - xMean, 0.0)
+        dy = np.where(measured, values - mean, 0.0)
+        slope = (dx*dy).sum(axis=0)/(dx*dx).sum(axis=0)
+        std = np.sqrt((dy*dy).sum(axis=0)/n)
+    return {"runs": np.array(runs), "keys": keys, "values": values, "slope": slope, "mean": mean,
+            "std": std}
+
+
+def compactMetrics(storeDir=None):
+    """Merge all shards into one.
+
+    Parameters
+    ----------
+    storeDir : `str`, optional
+        Directory of the store.  Defaults to `getMetricsDir`.
+
+    Returns
+    -------
+    path : `str` or `None`
+        The merged shard, or `None` if the store is empty.
+
+    Notes
+    -----
+    Concurrent compactions of a store wait for each other, so that no
+    shard is merged twice.
+    """
+    storeDir = storeDir or getMetricsDir()
+    os.makedirs(storeDir, exist_ok=True)
+    with open(os.path.join(storeDir, ".compact.lock"), "w") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        paths = glob.glob(os.path.join(storeDir, "*.npz"))
+        if len(paths) < 2:
+            return paths[0] if paths else None
+        # Shards written meanwhile are left for the next compaction.
+        metrics = _readShards(paths)
+        path = os.path.join(storeDir, f"compacted.{os.getpid()}.{time.time_ns()}.npz")
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            np.savez_compressed(f, **metrics)
+        os.replace(temporary, path)
+        for old in paths:
+            os.remove(old)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the metrics recorded by the tests.")
+    parser.add_argument("--store", default=None, help="Metrics directory (default: DATA/metrics).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("runs", help="List the recorded runs.")
+    diffParser = subparsers.add_parser("diff", help="Compare two runs.")
+    diffParser.add_argument("runA", help="Reference run, or 'previous' for the second to last run.")
+    diffParser.add_argument("runB", nargs="?", default="latest", help="Run to compare (default: latest).")
+    diffParser.add_argument("--limit", type=int, default=20, help="Number of largest changes to show.")
+    diffParser.add_argument("--rtol", type=float, default=None,
+                            help="Fail if a metric changes by more than atol + rtol*|value|.")
+    diffParser.add_argument("--atol", type=float, default=0.0, help="Absolute tolerance of --rtol.")
+    diffParser.add_argument("--test", help="Substring of the tests to compare.")
+    trendParser = subparsers.add_parser("trend", help="Fit the drift of metrics across runs.")
+    trendParser.add_argument("--metric", help="Metric to include.")
+    trendParser.add_argument("--test", help="Substring of the tests to include.")
+    trendParser.add_argument("--limit", type=int, default=20, help="Number of largest drifts to show.")
+    subparsers.add_parser("compact", help="Merge all shards into one.")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        print(compactMetrics(args.store))
+        return
+    metrics = loadMetrics(args.store)
+    runs = listRuns(metrics)
+    if args.command == "runs":
+        for run in runs:
+            print(run)
+    elif args.command == "diff":
+        aliases = {"latest": runs[-1] if runs else None, "previous": runs[-2] if len(runs) > 1 else None}
+        runA, runB = aliases.get(args.runA, args.runA), aliases.get(args.runB, args.runB)
+        if runA not in runs or runB not in runs:
+            parser.error(f"Unknown runs {runA}, {runB}; see the 'runs' command.")
+        if args.test is not None:
+            select = np.char.find(metrics["test"].astype(str), args.test) >= 0
+            metrics = {name: array[select] for name, array in metrics.items()}
+        diff = diffRuns(metrics, runA, runB)
+        print(f"{runA} -> {runB}: {len(diff['delta'])} metrics in both runs, "
+              f"{len(diff['onlyA'])} only in the first, {len(diff['onlyB'])} only in the second.")
+        for index in range(min(args.limit, len(diff["delta"]))):
+            print(f"{diff['test'][index]} det={diff['detector'][index]} amp={diff['amp'][index]} "
+                  f"{diff['metric'][index]}: {diff['valueA'][index]:.6g} -> {diff['valueB'][index]:.6g} "
+                  f"({diff['relative'][index]:+.2%})")
+        if args.rtol is not None:
+            within = np.abs(diff["delta"]) <= args.atol + args.rtol*np.abs(diff["valueA"])
+            exceeded = ~(within | (np.isnan(diff["valueA"]) & np.isnan(diff["valueB"])))
+            if exceeded.any():
+                print(f"{exceeded.sum()} metrics changed by more than {args.atol:g} + {args.rtol:g}*|value|.")
+                sys.exit(1)
+            print(f"All metrics within {args.atol:g} + {args.rtol:g}*|value|.")
+    else:
+        trend = trendMetrics(metrics, args.metric, args.test)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            drift = np.abs(trend["slope"])/np.abs(trend["mean"])
+        order = np.argsort(-np.nan_to_num(drift, nan=-1.0))
+        print(f"{len(trend['runs'])} runs, {len(trend['keys'])} metrics.")
+        for index in order[:args.limit]:
+            print(f"{trend['keys'][index]}: mean {trend['mean'][index]:.6g}, std {trend['std'][index]:.3g}, "
+                  f"slope {trend['slope'][index]:+.3g}/run")
+
+
+if __name__ == "__main__":
+    main()
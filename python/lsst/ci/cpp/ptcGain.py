@@ -0,0 +1,234 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Pair-difference gain estimates, computed for all amplifiers at once.
+
+Each flat pair contributes its mean signal and the variance of its
+difference image for every amplifier.  Only these per-amplifier values
+are kept, so any number of pairs can be processed one at a time.
+"""
+
+__all__ = ["PairGainAccumulator", "binAmpCube", "measurePairStatistics", "parseExposurePairs"]
+
+import numpy as np
+
+from .ampStatistics import IQ_TO_STDEV, makeAmpCube
+
+
+def parseExposurePairs(pairs):
+    """Parse the ``ptcExposurePairs`` entry of the test data manifest.
+
+    Parameters
+    ----------
+    pairs : `list`
+        Pairs given as ``"exp1,exp2"`` strings or as sequences.
+
+    Returns
+    -------
+    pairs : `list` [`tuple` [`int`, `int`]]
+        The exposure ids of each pair.
+    """
+    parsed = []
+    for pair in pairs:
+        if isinstance(pair, str):
+            pair = pair.split(",")
+        first, second = pair
+        parsed.append((int(first), int(second)))
+    return parsed
+
+
+def binAmpCube(cube, binSize):
+    """Sum the pixels of each amplifier in square bins.
+
+    Parameters
+    ----------
+    cube : `numpy.ndarray`, (nAmp, ny, nx)
+        Amplifier pixels, with NaN for pixels to exclude.
+    binSize : `int`
+        Bin side, in pixels.  Rows and columns that do not fill a bin
+        are dropped.
+
+    Returns
+    -------
+    binned : `numpy.ndarray`, (nAmp, ny//binSize, nx//binSize)
+        Sum of each bin; NaN if any of its pixels is NaN.
+    """
+    if binSize == 1:
+        return cube
+    nAmp, ny, nx = cube.shape
+    ny, nx = ny//binSize, nx//binSize
+    return cube[:, :ny*binSize, :nx*binSize].reshape(nAmp, ny, binSize, nx, binSize).sum(axis=(2, 4))
+
+
+def measurePairStatistics(exposure1, exposure2, detector=None, binSize=1,
+                          badMaskPlanes=("SAT", "BAD", "NO_DATA", "SUSPECT")):
+    """Measure the mean and difference variance of a flat pair.
+
+    Parameters
+    ----------
+    exposure1, exposure2 : `lsst.afw.image.Exposure`
+        ISR-processed flats of the pair.
+    detector : `lsst.afw.cameraGeom.Detector`, optional
+        Detector describing the amplifier layout.  Defaults to the
+        detector attached to ``exposure1``.
+    binSize : `int`, optional
+        Side of the square bins summed before measuring.  Binning
+        recovers the variance that the brighter-fatter effect moves into
+        correlations between neighbouring pixels.
+    badMaskPlanes : `list` [`str`], optional
+        Mask planes of pixels to exclude.  A bin is excluded if any of
+        its pixels is.
+
+    Returns
+    -------
+    statistics : `dict` [`str`, `object`]
+        ``ampNames`` and, per amplifier and normalized to one pixel, the
+        mean of each exposure (``mean1``, ``mean2``) and the robust
+        variance of their difference (``varDiff``).  The second
+        exposure is scaled to the mean of the first before differencing.
+    """
+    if detector is None:
+        detector = exposure1.getDetector()
+    amps = list(detector)
+    bboxes = [amp.getBBox() for amp in amps]
+
+    cubes = []
+    bad = None
+    for exposure in (exposure1, exposure2):
+        xy0 = (exposure.getX0(), exposure.getY0())
+        cube = makeAmpCube(exposure.getImage().getArray(), bboxes, xy0).astype(np.float64)
+        maskBits = makeAmpCube(exposure.getMask().getArray(), bboxes, xy0)
+        expBad = ((maskBits & exposure.getMask().getPlaneBitMask(list(badMaskPlanes))) != 0)
+        expBad |= ~np.isfinite(cube)
+        bad = expBad if bad is None else bad | expBad
+        cubes.append(cube)
+
+    binned = []
+    for cube in cubes:
+        cube[bad] = np.nan
+        binned.append(binAmpCube(cube, binSize).reshape(len(amps), -1))
+    binned1, binned2 = binned
+
+    pixelsPerBin = binSize**2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean1 = np.nanmean(binned1, axis=1)
+        mean2 = np.nanmean(binned2, axis=1)
+        difference = binned1 - binned2*(mean1/mean2)[:, np.newaxis]
+        lowerQuartile, upperQuartile = np.nanpercentile(difference, [25, 75], axis=1)
+    varDiff = (IQ_TO_STDEV*(upperQuartile - lowerQuartile))**2
+
+    return {"ampNames": [amp.getName() for amp in amps],
+            "mean1": mean1/pixelsPerBin,
+            "mean2": mean2/pixelsPerBin,
+            "varDiff": varDiff/pixelsPerBin}
+
+
+class PairGainAccumulator:
+    """Collect pair statistics and solve for the gain of each amplifier.
+
+    For Poisson-distributed signal, the variance of a pair difference is
+    ``(mean1 + mean2)/gain`` plus twice the read noise variance.  The
+    gain is the inverse slope of a straight-line fit of the difference
+    variance against the summed mean, over the pairs below the turnoff.
+
+    Parameters
+    ----------
+    ampNames : `list` [`str`]
+        Amplifiers, in the order of the statistics that will be added.
+    """
+
+    def __init__(self, ampNames):
+        self.ampNames = list(ampNames)
+        self._sumMeans = []
+        self._varDiffs = []
+
+    @property
+    def nPairs(self):
+        return len(self._sumMeans)
+
+    def add(self, statistics):
+        """Add the statistics of one pair.
+
+        Parameters
+        ----------
+        statistics : `dict` [`str`, `object`]
+            Statistics from `measurePairStatistics`.
+
+        Raises
+        ------
+        ValueError
+            Raised if the statistics are for other amplifiers.
+        """
+        if list(statistics["ampNames"]) != self.ampNames:
+            raise ValueError(f"Expected amplifiers {self.ampNames}, not {statistics['ampNames']}.")
+        self._sumMeans.append(statistics["mean1"] + statistics["mean2"])
+        self._varDiffs.append(statistics["varDiff"])
+
+    def getPairGains(self):
+        """Return the gain measured by each pair, ignoring read noise.
+
+        Returns
+        -------
+        gains : `numpy.ndarray`, (nPairs, nAmp)
+            Summed mean over difference variance, in e-/ADU.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.array(self._sumMeans)/np.array(self._varDiffs)
+
+    def solve(self, maxMean=None):
+        """Fit the gain and read noise of every amplifier.
+
+        Parameters
+        ----------
+        maxMean : `float`, optional
+            Largest mean signal, in ADU, of the pairs to fit.  By
+            default the pairs up to the one with the largest difference
+            variance are used, which excludes pairs past the turnoff.
+
+        Returns
+        -------
+        results : `dict` [`str`, `dict` [`str`, `float`]]
+            ``gain`` (e-/ADU), ``noise`` (ADU) and ``nPairs`` of each
+            amplifier.  The gain is NaN if fewer than two pairs are
+            usable.
+        """
+        x = np.array(self._sumMeans)
+        y = np.array(self._varDiffs)
+        valid = np.isfinite(x) & np.isfinite(y)
+        if maxMean is not None:
+            valid &= x <= 2*maxMean
+        else:
+            turnoff = np.take_along_axis(x, np.argmax(np.where(valid, y, -np.inf), axis=0)[np.newaxis],
+                                         axis=0)
+            valid &= x <= turnoff
+
+        n = valid.sum(axis=0)
+        x = np.where(valid, x, 0.0)
+        y = np.where(valid, y, 0.0)
+        sx, sy = x.sum(axis=0), y.sum(axis=0)
+        sxx, sxy = (x*x).sum(axis=0), (x*y).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope = (n*sxy - sx*sy)/(n*sxx - sx*sx)
+            intercept = (sy - slope*sx)/n
+            gain = np.where(n >= 2, 1.0/slope, np.nan)
+        noise = np.sqrt(np.clip(intercept/2, 0.0, None))
+
+        return {ampName: {"gain": gain[index], "noise": noise[index], "nPairs": int(n[index])}
+                for index, ampName in enumerate(self.ampNames)}
@@ -0,0 +1,331 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Compressed storage of the ISR exposures of the intermediate reruns.
+
+The ISR stages write uncompressed FITS, which are read once by the
+measurement that follows.  `compressRerun` rewrites them in place, with
+either lossless tile compression or, for the image and variance planes,
+quantization to a fraction of the noise followed by compression.  The
+mask is always compressed losslessly.  The butler reads both forms
+transparently.
+
+The noise is measured per amplifier, from the variance plane, or from
+the differences of neighbouring pixels where there is no variance, so
+that the quantization step is set by the quietest amplifier rather than
+by the spread of the whole image, which vignetting and gain differences
+inflate.  Every rewritten exposure is read back and checked: losslessly
+compressed pixels must be identical, and quantized image pixels must
+deviate from the originals by at most ``maxNoiseFraction`` of the noise
+(rms) of every amplifier.  Exposures failing the check are left
+uncompressed.
+
+``tests/test_rerunCompression.py`` checks that the pair statistics of
+quantized synthetic flats, from which the PTC gains are fitted, stay
+within tolerance; for the calibration products of a build, compare the
+test runs with `lsst.ci.cpp.metricsStore`.
+"""
+
+__all__ = ["COMPRESSION_MODES", "compressExposureFile", "compressRerun", "makeWriteOptions",
+           "measureAmpNoise"]
+
+import argparse
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+
+
+COMPRESSION_MODES = ("none", "lossless", "lossy")
+
+
+def _planeOptions(step):
+    """Return the write options of one plane as a `dict`.
+
+    The keys follow the write recipes of ``obs_base``; ``step`` is the
+    quantization step, or `None` for lossless compression.
+    """
+    if step is None:
+        return {"compression.algorithm": "GZIP_SHUFFLE", "scaling.algorithm": "NONE"}
+    # Quantize with a fixed step; the dithering (fuzz) keeps the
+    # quantized values unbiased.
+    return {"compression.algorithm": "RICE",
+            "scaling.algorithm": "MANUAL",
+            "scaling.bitpix": 32,
+            "scaling.bscale": float(step),
+            "scaling.bzero": 0.0,
+            "scaling.fuzz": True,
+            "scaling.seed": 1,
+            "scaling.maskPlanes": ["NO_DATA"]}
+
+
+def makeWriteOptions(mode, imageStep=None, varianceStep=None):
+    """Construct the options to write an exposure with.
+
+    Parameters
+    ----------
+    mode : `str`
+        ``"lossless"`` or ``"lossy"``.
+    imageStep, varianceStep : `float`, optional
+        For ``"lossy"``, quantization step of the image and variance
+        planes, in their units.
+
+    Returns
+    -------
+    options : `dict` [`str`, `lsst.afw.fits.ImageWriteOptions`]
+        Options of the ``image``, ``mask`` and ``variance`` planes.
+
+    Raises
+    ------
+    ValueError
+        Raised if the mode is not a compression mode, or if a step is
+        missing or not positive for ``"lossy"``.
+    """
+    import lsst.afw.fits as afwFits
+    import lsst.daf.base as dafBase
+
+    if mode not in COMPRESSION_MODES[1:]:
+        raise ValueError(f"Unknown compression mode {mode!r}; choose from {COMPRESSION_MODES[1:]}.")
+    steps = {"image": None, "mask": None, "variance": None}
+    if mode == "lossy":
+        if not (imageStep and imageStep > 0 and varianceStep and varianceStep > 0):
+            raise ValueError(f"Lossy compression needs positive steps, not {imageStep}, {varianceStep}.")
+        steps.update(image=imageStep, variance=varianceStep)
+    options = {}
+    for plane, step in steps.items():
+        propertySet = dafBase.PropertySet()
+        for key, value in _planeOptions(step).items():
+            propertySet.set(key, value)
+        options[plane] = afwFits.ImageWriteOptions(propertySet)
+    return options
+
+
+def _differenceNoise(array):
+    """Robust standard deviation of the finite values of an array, from
+    the second differences of horizontally neighbouring pixels.
+
+    The differences remove any gradient across the amplifier, such as
+    vignetting; the second difference of white noise has six times its
+    variance.
+    """
+    differences = np.diff(array, n=2, axis=1).ravel()
+    differences = differences[np.isfinite(differences)]
+    if not len(differences):
+        return 0.0
+    mad = np.median(np.abs(differences - np.median(differences)))
+    return float(1.4826*mad/np.sqrt(6.0))
+
+
+def measureAmpNoise(image, variance, bboxes=None, xy0=(0, 0)):
+    """Measure the noise of every amplifier.
+
+    Parameters
+    ----------
+    image, variance : `numpy.ndarray`
+        Image and variance planes; pixels to ignore are NaN.
+    bboxes : `list` [`lsst.geom.Box2I`], optional
+        Amplifier bounding boxes, in the pixel coordinates of the
+        image.  Defaults to the whole image as one amplifier.
+    xy0 : `tuple` [`int`, `int`], optional
+        Pixel coordinates of the first pixel of the image.
+
+    Returns
+    -------
+    slices : `list` [`tuple` [`slice`, `slice`]]
+        Array slices of the amplifiers.
+    noise : `numpy.ndarray`, (nAmp,)
+        Standard deviation of each amplifier: the square root of the
+        median variance, or the pixel-difference noise where the
+        variance plane is not positive.
+    """
+    if bboxes is None:
+        slices = [(slice(None), slice(None))]
+    else:
+        slices = [(slice(bbox.getMinY() - xy0[1], bbox.getMaxY() + 1 - xy0[1]),
+                   slice(bbox.getMinX() - xy0[0], bbox.getMaxX() + 1 - xy0[0])) for bbox in bboxes]
+    noise = np.zeros(len(slices))
+    for index, ampSlice in enumerate(slices):
+        values = variance[ampSlice][np.isfinite(image[ampSlice])]
+        values = values[np.isfinite(values)]
+        median = float(np.median(values)) if len(values) else 0.0
+        noise[index] = np.sqrt(median) if median > 0 else _differenceNoise(image[ampSlice])
+    return slices, noise
+
+
+def compressExposureFile(path, mode, quantizeLevel=16.0, maxNoiseFraction=0.1):
+    """Rewrite an exposure file compressed, if it stays within tolerance.
+
+    Parameters
+    ----------
+    path : `str`
+        Exposure FITS file, rewritten in place.
+    mode : `str`
+        ``"lossless"`` or ``"lossy"``; see `makeWriteOptions`.
+    quantizeLevel : `float`, optional
+        Quantization steps per standard deviation of the quietest
+        amplifier, for ``"lossy"``.  The variance plane is quantized to
+        ``1/quantizeLevel**2`` of its smallest amplifier median.
+    maxNoiseFraction : `float`, optional
+        Largest rms deviation of the quantized image pixels of an
+        amplifier, as a fraction of its noise, for ``"lossy"``.
+
+    Returns
+    -------
+    record : `dict`
+        ``path``; file ``bytesBefore`` and ``bytesAfter``;
+        ``ampNoiseFractions``, the rms deviation of the image pixels of
+        each amplifier over its noise, and ``noiseFraction``, the
+        largest of them; and whether the compressed file was ``kept``.
+    """
+    import lsst.afw.image as afwImage
+
+    exposure = afwImage.ExposureF(path)
+    record = {"path": path, "bytesBefore": os.path.getsize(path)}
+
+    original = exposure.getImage().getArray()
+    # Pixels that are not finite, or masked NO_DATA, may be replaced.
+    noData = (exposure.getMask().getArray() & exposure.getMask().getPlaneBitMask("NO_DATA")) != 0
+    compared = np.isfinite(original) & ~noData
+    detector = exposure.getDetector()
+    bboxes = [amp.getBBox() for amp in detector] if detector is not None else None
+    slices, noise = measureAmpNoise(np.where(compared, original, np.nan), exposure.getVariance().getArray(),
+                                    bboxes, (exposure.getX0(), exposure.getY0()))
+    if mode == "lossy":
+        if not np.all(noise > 0):
+            record.update(ampNoiseFractions=[np.inf]*len(noise), noiseFraction=np.inf, kept=False,
+                          bytesAfter=record["bytesBefore"])
+            return record
+        options = makeWriteOptions(mode, imageStep=noise.min()/quantizeLevel,
+                                   varianceStep=(noise.min()/quantizeLevel)**2)
+    else:
+        options = makeWriteOptions(mode)
+
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".fits")
+    os.close(fd)
+    try:
+        exposure.writeFits(tmpPath, options["image"], options["mask"], options["variance"])
+        compressed = afwImage.ExposureF(tmpPath)
+        written = compressed.getImage().getArray()
+        fractions = []
+        for ampSlice, ampNoise in zip(slices, noise):
+            good = compared[ampSlice]
+            deviation = written[ampSlice][good].astype(np.float64) - original[ampSlice][good]
+            rms = float(np.sqrt(np.mean(deviation**2))) if deviation.size else 0.0
+            fractions.append(rms/ampNoise if ampNoise > 0 else (0.0 if rms == 0 else np.inf))
+        record["ampNoiseFractions"] = fractions
+        record["noiseFraction"] = max(fractions, default=0.0)
+        if mode == "lossless":
+            kept = (np.array_equal(written, original, equal_nan=True)
+                    and np.array_equal(compressed.getMask().getArray(), exposure.getMask().getArray())
+                    and np.array_equal(compressed.getVariance().getArray(),
+                                       exposure.getVariance().getArray(), equal_nan=True))
+        else:
+            kept = (record["noiseFraction"] <= maxNoiseFraction
+                    and np.array_equal(compressed.getMask().getArray(), exposure.getMask().getArray()))
+        kept = kept and os.path.getsize(tmpPath) < record["bytesBefore"]
+        if kept:
+            os.replace(tmpPath, path)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+    record["kept"] = bool(kept)
+    record["bytesAfter"] = os.path.getsize(path)
+    return record
+
+
+def compressRerun(rerunDir, mode, datasetDir="postISRCCD", quantizeLevel=16.0, maxNoiseFraction=0.1,
+                  processes=1):
+    """Compress the exposures of a rerun in place.
+
+    Parameters
+    ----------
+    rerunDir : `str`
+        Rerun written by an ISR stage.
+    mode : `str`
+        One of `COMPRESSION_MODES`; ``"none"`` leaves the rerun as is.
+    datasetDir : `str`, optional
+        Subdirectory of the rerun holding the exposures.
+    quantizeLevel, maxNoiseFraction : `float`, optional
+        See `compressExposureFile`.
+    processes : `int`, optional
+        Number of exposures compressed at once.
+
+    Returns
+    -------
+    records : `list` [`dict`]
+        Records of `compressExposureFile`, which are also written to
+        ``compression.json`` in the rerun.
+    """
+    if mode not in COMPRESSION_MODES:
+        raise ValueError(f"Unknown compression mode {mode!r}; choose from {COMPRESSION_MODES}.")
+    if mode == "none":
+        return []
+    paths = sorted(glob.glob(os.path.join(rerunDir, datasetDir, "**", "*.fits"), recursive=True))
+    compress = functools.partial(compressExposureFile, mode=mode, quantizeLevel=quantizeLevel,
+                                 maxNoiseFraction=maxNoiseFraction)
+    processes = max(1, min(processes, len(paths)))
+    if processes == 1:
+        records = [compress(path) for path in paths]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            records = pool.map(compress, paths, 1)
+
+    with open(os.path.join(rerunDir, "compression.json"), "w") as f:
+        json.dump({"mode": mode, "quantizeLevel": quantizeLevel, "maxNoiseFraction": maxNoiseFraction,
+                   "files": records}, f, indent=2)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress the ISR exposures of a rerun in place.")
+    parser.add_argument("rerun", help="Rerun directory.")
+    parser.add_argument("--mode", choices=COMPRESSION_MODES, default="lossless", help="Compression mode.")
+    parser.add_argument("--dataset-dir", default="postISRCCD",
+                        help="Subdirectory of the rerun holding the exposures.")
+    parser.add_argument("--quantize-level", type=float, default=16.0,
+                        help="Quantization steps per standard deviation of the quietest amplifier "
+                        "(lossy only).")
+    parser.add_argument("--max-noise-fraction", type=float, default=0.1,
+                        help="Largest rms deviation over the noise of an amplifier (lossy only).")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="Number of processes.")
+    args = parser.parse_args()
+
+    records = compressRerun(args.rerun, args.mode, args.dataset_dir, args.quantize_level,
+                            args.max_noise_fraction, args.processes)
+    kept = [record for record in records if record["kept"]]
+    before = sum(record["bytesBefore"] for record in records)
+    after = sum(record["bytesAfter"] for record in records)
+    print(f"Compressed {len(kept)} of {len(records)} exposures in {args.rerun} ({args.mode}): "
+          f"{before/2**20:.0f} MB -> {after/2**20:.0f} MB.")
+    if records:
+        print(f"Largest rms deviation: {max(record['noiseFraction'] for record in records):.3g} "
+              "of the noise of an amplifier.")
+    for record in records:
+        if not record["kept"]:
+            print(f"Left uncompressed: {record['path']} (rms deviation {record['noiseFraction']:.3g} "
+                  "of the noise).")
+
+
+if __name__ == "__main__":
+    main()
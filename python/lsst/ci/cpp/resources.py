@@ -0,0 +1,115 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Resource budgeting for the DATA/SConscript build stages.
+
+This module is imported while SCons reads the build scripts, so it must
+only depend on the standard library.
+"""
+
+__all__ = ["allocateCores", "computeCombineRows", "getProcessCores"]
+
+import os
+
+
+def allocateCores(weights, budget):
+    """Split a core budget between stages that run concurrently.
+
+    Parameters
+    ----------
+    weights : `dict` [`str`, `float`]
+        Relative core demand of each stage.
+    budget : `int`
+        Total number of cores available to all stages together.
+
+    Returns
+    -------
+    cores : `dict` [`str`, `int`]
+        Number of cores each stage may use.  Every stage receives at
+        least one core; if the budget allows, the allocations sum to
+        ``budget``, with the remainder of the proportional split going
+        to the stages with the largest fractional shares.
+    """
+    if not weights:
+        return {}
+    budget = max(int(budget), len(weights))
+    total = sum(weights.values())
+    if total <= 0:
+        weights = {name: 1.0 for name in weights}
+        total = len(weights)
+
+    # Reserve one core per stage, then share out the rest.
+    spare = budget - len(weights)
+    shares = {name: spare*weight/total for name, weight in weights.items()}
+    cores = {name: 1 + int(share) for name, share in shares.items()}
+    remainder = budget - sum(cores.values())
+    for name in sorted(shares, key=lambda name: (int(shares[name]) - shares[name], name))[:remainder]:
+        cores[name] += 1
+    return cores
+
+
+def computeCombineRows(nInputs, width, height, memoryBudget, bytesPerPixel=12):
+    """Choose the number of rows the calibration combination reads at once.
+
+    The combination reads the same block of rows from every input, so
+    its memory use grows with the number of inputs times the block size.
+
+    Parameters
+    ----------
+    nInputs : `int`
+        Number of exposures combined.
+    width : `int`
+        Width of the exposures, in pixels.
+    height : `int`
+        Height of the exposures, in pixels.
+    memoryBudget : `int`
+        Memory, in bytes, the combination of one detector may use.
+    bytesPerPixel : `int`, optional
+        Bytes per pixel of a masked image: a 32-bit image, mask and
+        variance plane.
+
+    Returns
+    -------
+    rows : `int`
+        Rows per block, between 1 and ``height``.  The block for the
+        combined output is included in the budget.
+    """
+    rowBytes = (nInputs + 1)*width*bytesPerPixel
+    return max(1, min(height, int(memoryBudget)//rowBytes))
+
+
+def getProcessCores():
+    """Return the number of cores this process may use on its own.
+
+    The tests run in as many pytest-xdist workers as the build has
+    cores, so each worker is given its share of the cores available to
+    it, as ``PYTEST_XDIST_WORKER_COUNT`` sets.
+
+    Returns
+    -------
+    cores : `int`
+        Cores of this process, at least one.
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    workers = int(os.environ.get("PYTEST_XDIST_WORKER_COUNT") or 1)
+    return max(1, cores//max(workers, 1))
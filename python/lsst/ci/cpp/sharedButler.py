@@ -0,0 +1,128 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""A read-only Gen2 butler shared by all tests in a process.
+"""
+
+__all__ = ["getDefaultRepoDirs", "getSharedButler"]
+
+import os
+import sqlite3
+
+import lsst.daf.persistence as dafPersist
+from lsst.utils import getPackageDir
+
+
+# Butlers already constructed, keyed by data and calibration repository.
+_butlers = {}
+# In-memory registries of those butlers, with the SQL to rebuild them.
+_registries = []
+# Connections inherited from the parent process, which must not be used
+# or closed in a forked child.
+_inheritedConnections = []
+
+
+def getDefaultRepoDirs():
+    """Return the repositories built by DATA/SConscript.
+
+    Returns
+    -------
+    repoDir : `str`
+        Root of the data repository.
+    calibDir : `str`
+        Root of the calibration repository.
+    """
+    repoDir = os.path.join(getPackageDir("ci_cpp_gen2"), "DATA")
+    return repoDir, os.path.join(repoDir, "calibs")
+
+
+def _loadIntoMemory(registry):
+    """Replace the connection of a SQLite registry with an in-memory copy.
+
+    Parameters
+    ----------
+    registry : `lsst.daf.persistence.Registry`
+        Registry to modify.  Registries that are not SQLite-based are
+        left unchanged.
+    """
+    conn = getattr(registry, "conn", None)
+    if not isinstance(conn, sqlite3.Connection):
+        return
+    memoryConn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.backup(memoryConn)
+    conn.close()
+    registry.conn = memoryConn
+    # SQLite connections must not be used across a fork, so keep the SQL
+    # to rebuild the copy in a child.
+    _registries.append((registry, "\n".join(memoryConn.iterdump())))
+
+
+def _reopenRegistries():
+    """Give every in-memory registry a connection of its own in a newly
+    forked process.
+    """
+    for registry, script in _registries:
+        _inheritedConnections.append(registry.conn)
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.executescript(script)
+        registry.conn = conn
+
+
+os.register_at_fork(after_in_child=_reopenRegistries)
+
+
+def getSharedButler(repoDir=None, calibDir=None):
+    """Return a read-only butler, constructing it on first use.
+
+    The mapper is only set up once per process, and the data and
+    calibration registries are copied into memory so that lookups do not
+    touch the filesystem.  Processes forked afterwards, such as the
+    workers of `lsst.ci.cpp.detectors.mapDetectors`, inherit the butler,
+    with new connections to copies of the registries.  Processes that
+    are not forked, such as pytest-xdist workers, construct their own.
+
+    Parameters
+    ----------
+    repoDir : `str`, optional
+        Root of the data repository.  Defaults to the one returned by
+        `getDefaultRepoDirs`.
+    calibDir : `str`, optional
+        Root of the calibration repository.  Defaults to the one
+        returned by `getDefaultRepoDirs`.
+
+    Returns
+    -------
+    butler : `lsst.daf.persistence.Butler`
+        The shared butler.  It must not be used to write datasets, and
+        does not see registry changes made after it was constructed.
+    """
+    if repoDir is None or calibDir is None:
+        defaultRepoDir, defaultCalibDir = getDefaultRepoDirs()
+        repoDir = repoDir or defaultRepoDir
+        calibDir = calibDir or defaultCalibDir
+    key = (os.path.realpath(repoDir), os.path.realpath(calibDir))
+    if key not in _butlers:
+        butler = dafPersist.Butler(inputs={'root': key[0], 'mapperArgs': {'calibRoot': key[1]}})
+        for repoData in butler._repos.inputs():
+            mapper = repoData.repo._mapper
+            _loadIntoMemory(getattr(mapper, "registry", None))
+            _loadIntoMemory(getattr(mapper, "calibRegistry", None))
+        _butlers[key] = butler
+    return _butlers[key]
@@ -0,0 +1,346 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Resource usage instrumentation of the DATA/SConscript stage commands.
+
+Each command is run through `runMonitored`, which records its wall and
+CPU time, memory, I/O and process count to a JSON file.  At the end of
+the build, `writeBuildReport` gathers these into a single report.
+
+This module runs as a wrapper process and inside SCons, so it must only
+depend on the standard library.
+"""
+
+__all__ = ["formatSummary", "getBuildId", "loadBuildReports", "runMonitored", "writeBuildReport"]
+
+import argparse
+import glob
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+
+def getBuildId():
+    """Return the id of the current build.
+
+    Returns
+    -------
+    buildId : `str`
+        ``CI_CPP_BUILD_ID``.  If it is not set, it is set to the current
+        time and process, so every SConscript read by the same ``scons``
+        process, and every command it runs, share one id.
+    """
+    return os.environ.setdefault("CI_CPP_BUILD_ID", time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}")
+
+
+def _readProcFile(pid, name):
+    """Read a file from the /proc entry of a process.
+
+    Returns `None` if the process has exited or /proc is unavailable.
+    """
+    try:
+        with open(f"/proc/{pid}/{name}") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _listDescendants(rootPids):
+    """Return the process ids of processes and all of their descendants.
+    """
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        stat = _readProcFile(entry, "stat")
+        if stat is None:
+            continue
+        # The command name may contain spaces, but is in parentheses.
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    pids = list(rootPids)
+    for pid in pids:
+        pids.extend(children.get(pid, []))
+    return pids
+
+
+class _ProcessTreeSampler(threading.Thread):
+    """Periodically sample the memory and I/O of a process tree.
+
+    Linux only; on other platforms ``available`` is `False` and only the
+    resource usage of reaped children is reported.
+
+    Parameters
+    ----------
+    rootPid : `int`
+        Process at the root of the tree.
+    interval : `float`
+        Seconds between samples.
+    pidFile : `str`, optional
+        File listing further processes, one per line, that belong to
+        the command without being descendants of ``rootPid``, such as
+        scripts run by `lsst.ci.cpp.warmWorker`.  Their CPU time is
+        sampled too, as ``getrusage`` does not cover them.
+    """
+
+    def __init__(self, rootPid, interval, pidFile=None):
+        super().__init__(daemon=True)
+        self.rootPid = rootPid
+        self.interval = interval
+        self.pidFile = pidFile
+        self.available = os.path.isdir("/proc")
+        self.peakRss = 0
+        self.pids = set()
+        self.io = {}
+        self.remoteCpu = {}
+        self._pageSize = os.sysconf("SC_PAGE_SIZE") if self.available else 0
+        self._clockTicks = os.sysconf("SC_CLK_TCK") if self.available else 1
+        self._done = threading.Event()
+
+    def run(self):
+        while self.available and not self._done.is_set():
+            self.sample()
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def _readRemotePids(self):
+        if self.pidFile is None or not os.path.exists(self.pidFile):
+            return []
+        with open(self.pidFile) as f:
+            return [int(line) for line in f if line.strip()]
+
+    def sample(self):
+        remotePids = self._readRemotePids()
+        for pid in remotePids:
+            stat = _readProcFile(pid, "stat")
+            if stat is not None:
+                # utime, stime, cutime and cstime, in clock ticks.
+                fields = [int(value) for value in stat[stat.rindex(")") + 2:].split()[11:15]]
+                self.remoteCpu[pid] = ((fields[0] + fields[2])/self._clockTicks,
+                                       (fields[1] + fields[3])/self._clockTicks)
+
+        totalRss = 0
+        for pid in _listDescendants([self.rootPid] + remotePids):
+            statm = _readProcFile(pid, "statm")
+            if statm is None:
+                continue
+            self.pids.add(pid)
+            totalRss += int(statm.split()[1])*self._pageSize
+            io = _readProcFile(pid, "io")
+            if io is not None:
+                counters = dict(line.split(": ") for line in io.splitlines())
+                # Counters are cumulative, so keep the last value seen.
+                self.io[pid] = (int(counters["rchar"]), int(counters["wchar"]))
+        self.peakRss = max(self.peakRss, totalRss)
+
+
+def _scriptName(command):
+    """Return the script or module a command runs, for the report.
+    """
+    if len(command) > 2 and command[1] == "-m":
+        return command[2]
+    return os.path.basename(command[1] if len(command) > 1 else command[0])
+
+
+def runMonitored(command, stage, reportDir, interval=0.5):
+    """Run a command and record its resource usage.
+
+    Parameters
+    ----------
+    command : `list` [`str`]
+        Command and arguments to run.
+    stage : `str`
+        Name of the build stage the command belongs to.
+    reportDir : `str`
+        Directory to write the JSON record to.
+    interval : `float`, optional
+        Seconds between samples of the process tree.
+
+    Returns
+    -------
+    exitCode : `int`
+        Exit status of the command.
+
+    Notes
+    -----
+    CPU time, the largest single-process RSS and block I/O come from
+    ``getrusage`` and cover every descendant that was waited for.  The
+    peak RSS of the whole process tree, the bytes read and written
+    (``rchar``/``wchar``, which include network filesystems) and the
+    process count are sampled from /proc, so very short-lived processes
+    may be missed.  Processes the command announces in the file named
+    by the ``CI_CPP_MONITOR_PIDFILE`` environment variable are sampled
+    as well, including their CPU time.
+    """
+    os.makedirs(reportDir, exist_ok=True)
+    pidFile = os.path.join(reportDir, f".{stage}-{os.getpid()}.pids")
+    usageBefore = resource.getrusage(resource.RUSAGE_CHILDREN)
+    startTime = time.time()
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=dict(os.environ, CI_CPP_MONITOR_PIDFILE=pidFile))
+    sampler = _ProcessTreeSampler(process.pid, interval, pidFile)
+    sampler.start()
+    try:
+        exitCode = process.wait()
+    except KeyboardInterrupt:
+        process.terminate()
+        exitCode = process.wait()
+    wallTime = time.perf_counter() - start
+    sampler.stop()
+    usageAfter = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if os.path.exists(pidFile):
+        os.remove(pidFile)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    rssScale = 1 if sys.platform == "darwin" else 1024
+    userTime = usageAfter.ru_utime - usageBefore.ru_utime + sum(cpu[0] for cpu in sampler.remoteCpu.values())
+    systemTime = (usageAfter.ru_stime - usageBefore.ru_stime
+                  + sum(cpu[1] for cpu in sampler.remoteCpu.values()))
+    record = {
+        "stage": stage,
+        "script": _scriptName(command),
+        "command": " ".join(command),
+        "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(startTime)),
+        "wallTime": wallTime,
+        "cpuTime": userTime + systemTime,
+        "userTime": userTime,
+        "systemTime": systemTime,
+        "peakRss": sampler.peakRss if sampler.available else None,
+        "maxProcessRss": usageAfter.ru_maxrss*rssScale,
+        "readBytes": sum(io[0] for io in sampler.io.values()) if sampler.available else None,
+        "writeBytes": sum(io[1] for io in sampler.io.values()) if sampler.available else None,
+        "blockReadBytes": (usageAfter.ru_inblock - usageBefore.ru_inblock)*512,
+        "blockWriteBytes": (usageAfter.ru_oublock - usageBefore.ru_oublock)*512,
+        "childProcesses": len(sampler.pids) if sampler.available else None,
+        "exitCode": exitCode,
+    }
+
+    filename = f"{stage}-{record['script']}-{int(startTime*1000)}-{os.getpid()}.json"
+    with open(os.path.join(reportDir, filename), "w") as f:
+        json.dump(record, f, indent=2)
+    return exitCode
+
+
+def formatSummary(records):
+    """Format stage records as a table.
+
+    Parameters
+    ----------
+    records : `list` [`dict`]
+        Records written by `runMonitored`.
+
+    Returns
+    -------
+    table : `str`
+        Human-readable summary, one line per command.
+    """
+    def megabytes(value):
+        return "-" if value is None else f"{value/2**20:.0f}"
+
+    lines = [f"{'stage':<14} {'script':<34} {'wall[s]':>8} {'cpu[s]':>8} {'rss[MB]':>8} "
+             f"{'read[MB]':>9} {'write[MB]':>9} {'procs':>6} {'exit':>5}"]
+    for record in sorted(records, key=lambda record: record["start"]):
+        procs = record["childProcesses"]
+        lines.append(f"{record['stage']:<14} {record['script'][:34]:<34} "
+                     f"{record['wallTime']:>8.1f} {record['cpuTime']:>8.1f} "
+                     f"{megabytes(record['peakRss'] or record['maxProcessRss']):>8} "
+                     f"{megabytes(record['readBytes']):>9} {megabytes(record['writeBytes']):>9} "
+                     f"{'-' if procs is None else procs:>6} {record['exitCode']:>5}")
+    return "\n".join(lines)
+
+
+def writeBuildReport(stageReportDir, reportFile):
+    """Gather the stage records of a build into one report.
+
+    Once the report is written, the stage records are removed.
+
+    Parameters
+    ----------
+    stageReportDir : `str`
+        Directory the stage records were written to.
+    reportFile : `str`
+        JSON file to write the build report to.
+
+    Returns
+    -------
+    records : `list` [`dict`]
+        The stage records; empty if no command ran.
+    """
+    records = []
+    for filename in sorted(glob.glob(os.path.join(stageReportDir, "*.json"))):
+        with open(filename) as f:
+            records.append(json.load(f))
+    if records:
+        os.makedirs(os.path.dirname(reportFile), exist_ok=True)
+        tmpFile = f"{reportFile}.tmp"
+        with open(tmpFile, "w") as f:
+            json.dump({"stages": records}, f, indent=2)
+        os.replace(tmpFile, reportFile)
+    shutil.rmtree(stageReportDir, ignore_errors=True)
+    return records
+
+
+def loadBuildReports(reportDir):
+    """Load every build report in a directory.
+
+    Parameters
+    ----------
+    reportDir : `str`
+        Directory holding the reports written by `writeBuildReport`.
+
+    Returns
+    -------
+    reports : `list` [`list` [`dict`]]
+        Stage records of each build, oldest first.
+    """
+    reports = []
+    for filename in sorted(glob.glob(os.path.join(reportDir, "*.json"))):
+        with open(filename) as f:
+            reports.append(json.load(f)["stages"])
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a command and record its resource usage.")
+    parser.add_argument("--stage", required=True, help="Name of the build stage.")
+    parser.add_argument("--report-dir", required=True, help="Directory to write the record to.")
+    parser.add_argument("--interval", type=float, default=0.5,
+                        help="Seconds between samples of the process tree.")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to run, after --.")
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("No command given.")
+    exitCode = runMonitored(command, args.stage, args.report_dir, args.interval)
+    sys.exit(exitCode if exitCode >= 0 else 128 - exitCode)
+
+
+if __name__ == "__main__":
+    main()
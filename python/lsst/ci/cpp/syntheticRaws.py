@@ -0,0 +1,361 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Synthetic LATISS raws for measuring how the build scales.
+
+Every exposure of the test data manifest is used as a template: its
+headers are copied, with the exposure id, observation id and dates
+changed, and its pixels are replaced by a model of bias level, read
+noise, dark current and flat illumination with shot noise.  A scale of
+``n`` writes ``n`` copies of every exposure, and a manifest listing
+them in the same roles.  The first copy is the template itself, with
+its exposure id and pixels, as the tests read particular exposures.
+The manifest records the scale as ``syntheticScale``; the synthetic
+sensor has no defects, so the defects measured from a scaled data set
+are not compared with the curated ones.
+
+The output is used by setting ``CI_CPP_TESTDATA_ROOT`` to it, e.g.::
+
+    python -m lsst.ci.cpp.syntheticRaws /scratch/latiss10x --scale 10 -j 8
+    CI_CPP_TESTDATA_ROOT=/scratch/latiss10x scons -j 16
+"""
+
+__all__ = ["SensorModel", "findTemplates", "main", "makeAmpPixels", "scaleManifest",
+           "writeSyntheticRaw"]
+
+import argparse
+import datetime
+import glob
+import multiprocessing
+import os
+import re
+import shutil
+
+import numpy as np
+import yaml
+
+from .detectors import getTestdataRoot, loadManifest
+
+
+# Header keywords describing the FITS structure, which are written by
+# afw and must not be copied from the templates.
+_STRUCTURAL_KEYS = ("SIMPLE", "BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "EXTEND", "XTENSION", "PCOUNT",
+                    "GCOUNT", "BZERO", "BSCALE", "CHECKSUM", "DATASUM", "ZIMAGE", "ZBITPIX", "ZNAXIS",
+                    "ZNAXIS1", "ZNAXIS2", "ZTILE1", "ZTILE2", "ZCMPTYPE", "ZQUANTIZ", "ZDITHER0")
+
+# Seconds between the copies of an exposure.
+_COPY_INTERVAL = 60.0
+
+
+class SensorModel:
+    """Parameters of the simulated sensor.
+
+    Parameters
+    ----------
+    biasLevel : `float`, optional
+        Mean bias level, in ADU.  Each amplifier is offset from it.
+    readNoise : `float`, optional
+        Mean read noise, in ADU.
+    darkCurrent : `float`, optional
+        Dark current, in electrons per second per pixel.
+    flatRate : `float`, optional
+        Flat illumination at the detector centre, in electrons per
+        second per pixel.
+    skyRate : `float`, optional
+        Illumination of exposures that are not biases, darks or flats.
+    vignetting : `float`, optional
+        Fractional drop of the illumination at the detector corners.
+    gain : `float`, optional
+        Mean gain, in electrons per ADU.
+    seed : `int`, optional
+        Seed of the per-amplifier parameters.  The noise of each
+        exposure is seeded by its exposure id.
+    """
+
+    def __init__(self, biasLevel=15000.0, readNoise=7.0, darkCurrent=0.02, flatRate=1000.0,
+                 skyRate=50.0, vignetting=0.1, gain=1.0, seed=0):
+        self.biasLevel = biasLevel
+        self.readNoise = readNoise
+        self.darkCurrent = darkCurrent
+        self.flatRate = flatRate
+        self.skyRate = skyRate
+        self.vignetting = vignetting
+        self.gain = gain
+        self.seed = seed
+
+    def getAmpParameters(self, ampIndex):
+        """Return the bias level, read noise, gain and relative response
+        of an amplifier.
+        """
+        rng = np.random.default_rng([self.seed, ampIndex])
+        return (self.biasLevel + rng.uniform(-500.0, 500.0),
+                self.readNoise*rng.uniform(0.8, 1.2),
+                self.gain*rng.uniform(0.9, 1.1),
+                rng.uniform(0.97, 1.03))
+
+
+def _parseSection(value):
+    """Parse a ``[x1:x2,y1:y2]`` FITS section into zero-based slices
+    and the flips of each axis.
+    """
+    x1, x2, y1, y2 = (int(v) for v in re.match(r"\[(\d+):(\d+),(\d+):(\d+)\]", value.strip()).groups())
+    return (slice(min(y1, y2) - 1, max(y1, y2)), slice(min(x1, x2) - 1, max(x1, x2)),
+            y2 < y1, x2 < x1)
+
+
+def makeAmpPixels(shape, dataSec, detSec, detSize, imageType, exposureTime, model, ampIndex, rng):
+    """Simulate the raw pixels of one amplifier.
+
+    Parameters
+    ----------
+    shape : `tuple` [`int`, `int`]
+        Raw amplifier shape, (ny, nx).
+    dataSec : `str`
+        ``DATASEC`` of the amplifier; the other pixels are overscan.
+    detSec : `str`
+        ``DETSEC`` of the amplifier, giving its place on the detector.
+    detSize : `tuple` [`int`, `int`]
+        Detector size, (ny, nx).
+    imageType : `str`
+        ``IMGTYPE`` of the exposure.
+    exposureTime : `float`
+        Exposure time, in seconds.
+    model : `SensorModel`
+        Sensor parameters.
+    ampIndex : `int`
+        Index of the amplifier.
+    rng : `numpy.random.Generator`
+        Source of the noise.
+
+    Returns
+    -------
+    pixels : `numpy.ndarray` [`numpy.int32`]
+        Raw pixel values.
+    """
+    biasLevel, readNoise, gain, response = model.getAmpParameters(ampIndex)
+    pixels = biasLevel + readNoise*rng.standard_normal(shape)
+
+    ySlice, xSlice, _, _ = _parseSection(dataSec)
+    dataShape = (ySlice.stop - ySlice.start, xSlice.stop - xSlice.start)
+    imageType = imageType.upper()
+    if imageType != "BIAS" and exposureTime > 0:
+        electrons = np.full(dataShape, model.darkCurrent*exposureTime)
+        if imageType != "DARK":
+            rate = model.flatRate if imageType == "FLAT" else model.skyRate
+            # Illumination falls off quadratically from the detector
+            # centre, evaluated where each raw pixel lands on the
+            # detector.
+            detY, detX, detYFlip, detXFlip = _parseSection(detSec)
+            y, x = np.mgrid[detY, detX]
+            if detYFlip:
+                y = y[::-1]
+            if detXFlip:
+                x = x[:, ::-1]
+            radius2 = (((y - detSize[0]/2)/(detSize[0]/2))**2 + ((x - detSize[1]/2)/(detSize[1]/2))**2)/2
+            electrons = electrons + rate*exposureTime*response*(1.0 - model.vignetting*radius2)
+        pixels[ySlice, xSlice] += rng.poisson(electrons)/gain
+    return np.round(pixels).astype(np.int32)
+
+
+def findTemplates(rawDir):
+    """Find the raw file of every exposure in the test data.
+
+    Parameters
+    ----------
+    rawDir : `str`
+        ``raw`` directory of the test data.
+
+    Returns
+    -------
+    templates : `dict` [`int`, `str`]
+        Raw file of each exposure id.
+    """
+    import lsst.afw.fits as afwFits
+
+    templates = {}
+    for path in sorted(glob.glob(os.path.join(rawDir, "*", "*.fits"))):
+        header = afwFits.readMetadata(path, 0)
+        dayObs = int(str(header.get("DAYOBS")).replace("-", ""))
+        templates[dayObs*100000 + int(header.get("SEQNUM"))] = path
+    return templates
+
+
+def _shiftDate(value, seconds):
+    date = datetime.datetime.fromisoformat(value) + datetime.timedelta(seconds=seconds)
+    return date.isoformat(timespec="milliseconds" if "." in value else "seconds")
+
+
+def _cleanHeader(header):
+    for key in _STRUCTURAL_KEYS:
+        if header.exists(key):
+            header.remove(key)
+    return header
+
+
+def writeSyntheticRaw(templatePath, outputPath, expId, copy, model):
+    """Write a synthetic copy of a raw exposure.
+
+    Parameters
+    ----------
+    templatePath : `str`
+        Raw file whose headers are copied.
+    outputPath : `str`
+        File to write.
+    expId : `int`
+        Exposure id of the copy.
+    copy : `int`
+        Index of the copy, which offsets its dates.  Copy 0 is the
+        template, copied unchanged.
+    model : `SensorModel`
+        Sensor parameters.
+    """
+    import lsst.afw.fits as afwFits
+    import lsst.afw.image as afwImage
+
+    os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+    if copy == 0:
+        shutil.copyfile(templatePath, outputPath)
+        return
+
+    primary = _cleanHeader(afwFits.readMetadata(templatePath, 0))
+    seqNum = expId % 100000
+    primary.set("SEQNUM", seqNum)
+    if primary.exists("OBSID"):
+        primary.set("OBSID", f"{primary.get('OBSID').rsplit('_', 1)[0]}_{seqNum:06d}")
+    for key in ("DATE-OBS", "DATE-BEG", "DATE-END", "DATE"):
+        if primary.exists(key):
+            primary.set(key, _shiftDate(primary.get(key), copy*_COPY_INTERVAL))
+    for key in ("MJD-OBS", "MJD-BEG", "MJD-END", "MJD"):
+        if primary.exists(key):
+            primary.set(key, primary.get(key) + copy*_COPY_INTERVAL/86400.0)
+    imageType = str(primary.get("IMGTYPE"))
+    exposureTime = float(primary.get("EXPTIME"))
+    detSize = _parseSection(primary.get("DETSIZE"))
+    detSize = (detSize[0].stop, detSize[1].stop)
+
+    rng = np.random.default_rng([model.seed, expId])
+    fits = afwFits.Fits(outputPath, "w")
+    fits.createEmpty()
+    fits.writeMetadata(primary)
+    fits.closeFile()
+
+    hdu = 1
+    while True:
+        try:
+            header = afwFits.readMetadata(templatePath, hdu)
+        except afwFits.FitsError:
+            break
+        if not header.exists("DATASEC"):
+            break
+        shape = (header.getScalar("NAXIS2"), header.getScalar("NAXIS1"))
+        pixels = makeAmpPixels(shape, header.get("DATASEC"), header.get("DETSEC"), detSize, imageType,
+                               exposureTime, model, hdu - 1, rng)
+        afwImage.ImageI(pixels).writeFits(outputPath, _cleanHeader(header), "a")
+        hdu += 1
+
+
+def scaleManifest(manifest, scale, offset):
+    """List the exposures of a scaled data set in the manifest roles.
+
+    Parameters
+    ----------
+    manifest : `dict`
+        Test data manifest.
+    scale : `int`
+        Number of copies of each exposure.
+    offset : `int`
+        Sequence number offset between copies.
+
+    Returns
+    -------
+    manifest : `dict`
+        Manifest with every exposure list repeated ``scale`` times, with
+        the exposure ids of each copy offset by ``copy*offset``.  The
+        ``ptcExposurePairs`` are kept as pairs.
+    """
+    scaled = {}
+    for key, value in manifest.items():
+        if not isinstance(value, list) or not key.endswith(("Exposures", "Visits", "Pairs")):
+            scaled[key] = value
+            continue
+        entries = []
+        for copy in range(scale):
+            for entry in value:
+                if isinstance(entry, str):
+                    entries.append(",".join(str(int(expId) + copy*offset) for expId in entry.split(",")))
+                else:
+                    entries.append(int(entry) + copy*offset)
+        scaled[key] = entries
+    return scaled
+
+
+def _writeOne(args):
+    return writeSyntheticRaw(*args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic LATISS raws for scaling measurements.")
+    parser.add_argument("output", help="Root of the synthetic test data.")
+    parser.add_argument("--scale", type=int, default=10, help="Copies of each template exposure.")
+    parser.add_argument("--template-root", default=None,
+                        help="Test data whose exposures are the templates (default: testdata_latiss_cpp).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the simulated sensor.")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="Number of processes.")
+    args = parser.parse_args()
+
+    templateRoot = args.template_root or getTestdataRoot()
+    manifest = loadManifest(templateRoot, tier="full")
+    # Derived by the tier when the synthetic manifest is loaded.
+    manifest.pop("bfkExposurePairs", None)
+    templates = findTemplates(os.path.join(templateRoot, "raw"))
+    if not templates:
+        parser.error(f"No raws found below {templateRoot}.")
+
+    # Keep the copies within the five digits of the sequence number.
+    offset = 10**len(str(max(expId % 100000 for expId in templates)))
+    if args.scale*offset > 100000:
+        parser.error(f"At most {100000//offset} copies fit in the exposure id sequence.")
+
+    model = SensorModel(seed=args.seed)
+    jobs = []
+    for expId, templatePath in sorted(templates.items()):
+        dateDir = os.path.basename(os.path.dirname(templatePath))
+        name = os.path.basename(templatePath)
+        for copy in range(args.scale):
+            newId = expId + copy*offset
+            outputName = name.replace(str(expId), str(newId)) if copy else name
+            if copy and outputName == name:
+                outputName = f"{newId}-{name}"
+            jobs.append((templatePath, os.path.join(args.output, "raw", dateDir, outputName),
+                         newId, copy, model))
+
+    with multiprocessing.Pool(args.processes) as pool:
+        for _ in pool.imap_unordered(_writeOne, jobs):
+            pass
+
+    scaled = scaleManifest(manifest, args.scale, offset)
+    scaled["syntheticScale"] = args.scale
+    with open(os.path.join(args.output, "raw", "manifest.yaml"), "w") as f:
+        yaml.safe_dump(scaled, f, default_flow_style=None)
+    print(f"Wrote {len(jobs)} raws to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
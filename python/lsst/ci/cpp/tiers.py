@@ -0,0 +1,193 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tiers of the test data: how many exposures of each role are used.
+
+The tier is chosen with the ``CI_CPP_TIER`` environment variable.  The
+build records the tier it used in ``DATA/tier.yaml``, which the tests
+read when the variable is not set, so that they check the products of
+the exposures that were actually processed.
+
+This module is imported while SCons reads the build scripts, so it must
+not import the science pipelines at module level.
+"""
+
+__all__ = ["DEFAULT_TIER", "TIERS", "applyTier", "getTier", "getTierFile", "scaleThreshold",
+           "subsample", "writeTierFile"]
+
+import math
+import os
+
+import yaml
+
+
+# Exposures kept for each manifest role, as a maximum count (int) or a
+# fraction (float) of the full list, and the factor applied to the test
+# thresholds.  Fewer inputs make noisier calibrations, so the smaller
+# tiers allow larger deviations.  ``bfkExposurePairs`` is taken from the
+# tier's ``ptcExposurePairs``.
+TIERS = {
+    "smoke": {"biasExposures": 3, "darkExposures": 3, "flatExposures": 3, "scienceVisits": 1,
+              "ptcExposurePairs": 6, "bfkExposurePairs": 3, "thresholdScale": 2.0},
+    "standard": {"bfkExposurePairs": 0.5, "thresholdScale": 1.0},
+    "full": {"thresholdScale": 1.0},
+}
+DEFAULT_TIER = "standard"
+
+
+def getTierFile():
+    """Return the file the build records its tier in.
+
+    Returns
+    -------
+    path : `str`
+        ``DATA/tier.yaml`` in this package.
+    """
+    from lsst.utils import getPackageDir
+    return os.path.join(getPackageDir("ci_cpp_gen2"), "DATA", "tier.yaml")
+
+
+def getTier(tierFile=None):
+    """Return the tier to use.
+
+    Parameters
+    ----------
+    tierFile : `str`, optional
+        Tier record of the build.  Defaults to `getTierFile`.
+
+    Returns
+    -------
+    tier : `str`
+        ``CI_CPP_TIER`` if it is set, else the tier recorded by the last
+        build, else `DEFAULT_TIER`.
+
+    Raises
+    ------
+    ValueError
+        Raised if the tier is unknown.
+    """
+    tier = os.environ.get("CI_CPP_TIER")
+    if not tier:
+        try:
+            with open(tierFile or getTierFile()) as f:
+                tier = yaml.safe_load(f)["tier"]
+        except (OSError, LookupError, TypeError):
+            tier = DEFAULT_TIER
+    if tier not in TIERS:
+        raise ValueError(f"Unknown tier {tier!r}; choose from {sorted(TIERS)}.")
+    return tier
+
+
+def subsample(items, limit):
+    """Select evenly spaced items, starting with the first.
+
+    Keeping half of the items selects the same items as ``items[::2]``.
+
+    Parameters
+    ----------
+    items : `list`
+        Items to select from, in order.
+    limit : `int`, `float` or `None`
+        Number of items to keep, or fraction of them (rounded up).  All
+        items are kept if `None` or if the list is not longer.
+
+    Returns
+    -------
+    selected : `list`
+        The selected items, in their original order.
+    """
+    items = list(items)
+    if limit is None:
+        return items
+    count = math.ceil(limit*len(items)) if isinstance(limit, float) else limit
+    if count >= len(items):
+        return items
+    return [items[-(-index*len(items)//count)] for index in range(max(count, 0))]
+
+
+def applyTier(manifest, tier=None):
+    """Select the exposures of a tier.
+
+    Parameters
+    ----------
+    manifest : `dict`
+        Test data manifest.
+    tier : `str`, optional
+        Tier to apply.  Defaults to `getTier`.
+
+    Returns
+    -------
+    manifest : `dict`
+        Copy of the manifest with every exposure list subsampled, and
+        with ``bfkExposurePairs`` added.
+
+    Raises
+    ------
+    ValueError
+        Raised if the tier is unknown.
+    """
+    tier = tier or getTier()
+    if tier not in TIERS:
+        raise ValueError(f"Unknown tier {tier!r}; choose from {sorted(TIERS)}.")
+    spec = TIERS[tier]
+    selected = dict(manifest)
+    for key, value in manifest.items():
+        if isinstance(value, list) and key in spec:
+            selected[key] = subsample(value, spec[key])
+    selected["bfkExposurePairs"] = subsample(selected.get("ptcExposurePairs", []),
+                                             spec.get("bfkExposurePairs"))
+    return selected
+
+
+def scaleThreshold(threshold, tier=None):
+    """Scale a test threshold for a tier.
+
+    Parameters
+    ----------
+    threshold : `float`
+        Threshold for the standard and full tiers.
+    tier : `str`, optional
+        Tier the products were built with.  Defaults to `getTier`.
+
+    Returns
+    -------
+    threshold : `float`
+        Threshold for the tier.
+    """
+    return threshold*TIERS[tier or getTier()]["thresholdScale"]
+
+
+def writeTierFile(path, tier, manifest):
+    """Record the tier of a build.
+
+    Parameters
+    ----------
+    path : `str`
+        File to write.
+    tier : `str`
+        Tier of the build.
+    manifest : `dict`
+        Manifest returned by `applyTier`, whose exposure lists are
+        recorded for reference.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    exposures = {key: value for key, value in manifest.items() if isinstance(value, list)}
+    with open(path, "w") as f:
+        yaml.safe_dump({"tier": tier, "exposures": exposures}, f, default_flow_style=None)
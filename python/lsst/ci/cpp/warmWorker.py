@@ -0,0 +1,342 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""A local fork server that runs command-line scripts with the science
+pipelines already imported.
+
+``python -m lsst.ci.cpp.warmWorker serve`` imports the stack once and
+listens on a Unix socket.  ``python -m lsst.ci.cpp.warmWorker run --
+script.py args`` sends a script invocation, with the client's standard
+streams, working directory and environment, to the server, which runs it
+in a forked child and returns its exit status.  The server also builds
+the LATISS camera, which the forked scripts reuse.  If no server is running,
+the client starts one in the background and runs the script directly.
+
+Servers are keyed by the stack setup of the environment, so a client
+never runs a script under a differently set up stack.  A server exits
+after being idle for ``--idle-timeout`` seconds.
+
+The client side only depends on the standard library.
+"""
+
+__all__ = ["getSocketPath", "runCommand", "serve"]
+
+import argparse
+import array
+import fcntl
+import hashlib
+import importlib
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+
+# Modules imported by the server before it accepts commands.
+PRELOAD_MODULES = ["numpy", "lsst.afw.cameraGeom", "lsst.afw.image", "lsst.afw.math",
+                   "lsst.daf.persistence", "lsst.meas.algorithms", "lsst.pipe.base",
+                   "lsst.pipe.tasks.ingest", "lsst.ip.isr", "lsst.pipe.drivers", "lsst.cp.pipe",
+                   "lsst.obs.lsst"]
+
+# Cameras, by the name of their description in obs_lsst/policy, built by
+# the server so that the mappers of every script reuse them.
+PRELOAD_CAMERAS = ["latiss"]
+
+# Environment variables that determine which stack the server imports.
+_STACK_VARIABLES = ("PYTHONPATH", "LD_LIBRARY_PATH", "DYLD_LIBRARY_PATH", "LSST_LIBRARY_PATH")
+
+# Size of the request length prefix.
+_HEADER = struct.Struct("!Q")
+
+
+def getSocketPath():
+    """Return the socket of the server for the current stack setup.
+
+    Returns
+    -------
+    path : `str`
+        Socket path, which depends on the user and on the EUPS setup and
+        library paths of the environment.
+    """
+    stack = sorted((key, value) for key, value in os.environ.items()
+                   if key.startswith("SETUP_") or key in _STACK_VARIABLES)
+    stack.append(("python", sys.executable))
+    key = hashlib.sha256(json.dumps(stack).encode()).hexdigest()[:16]
+    runDir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(runDir, f"ci_cpp_gen2-worker-{os.getuid()}-{key}.sock")
+
+
+def _preloadCameras():
+    """Build the preloaded cameras, and reuse them in the forked scripts.
+
+    The Gen2 mappers, such as the ``AuxTelMapper`` of ``DATA/_mapper``,
+    build their camera from its YAML description every time they are
+    constructed.  The server caches the cameras built from each
+    description, and the forked children inherit the cache; afw cameras
+    are immutable, so they can be shared.
+    """
+    import functools
+
+    import lsst.obs.base.yamlCamera as yamlCamera
+    from lsst.utils import getPackageDir
+
+    if not hasattr(yamlCamera.makeCamera, "cache_info"):
+        yamlCamera.makeCamera = functools.lru_cache(maxsize=None)(yamlCamera.makeCamera)
+    for name in PRELOAD_CAMERAS:
+        yamlCamera.makeCamera(os.path.join(getPackageDir("obs_lsst"), "policy", f"{name}.yaml"))
+
+
+def _readExactly(conn, size):
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed during request.")
+        data += chunk
+    return data
+
+
+def _sendFds(sock, data, fds):
+    """Send bytes with file descriptors attached (``SCM_RIGHTS``).
+    """
+    ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds).tobytes())]
+    sent = sock.sendmsg([data], ancillary)
+    # The descriptors go with the first byte; send the rest plainly.
+    sock.sendall(data[sent:])
+
+
+def _recvFds(conn, size, maxFds):
+    """Receive ``size`` bytes and the file descriptors attached to them.
+    """
+    fds = array.array("i")
+    data, ancillary, flags, _ = conn.recvmsg(size, socket.CMSG_SPACE(maxFds*fds.itemsize))
+    for level, kind, cmsgData in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsgData[:len(cmsgData) - (len(cmsgData) % fds.itemsize)])
+    if flags & socket.MSG_CTRUNC:
+        for fd in fds:
+            os.close(fd)
+        raise ConnectionError("File descriptors of the request were truncated.")
+    if not data:
+        raise ConnectionError("Connection closed during request.")
+    return data + _readExactly(conn, size - len(data)), list(fds)
+
+
+def _runRequest(conn):
+    """Run one script invocation in this forked child, and exit.
+    """
+    header, fds = _recvFds(conn, _HEADER.size, 3)
+    request = json.loads(_readExactly(conn, _HEADER.unpack(header)[0]))
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    conn.sendall(json.dumps({"pid": os.getpid()}).encode() + b"\n")
+
+    script = request["argv"][0]
+    sys.argv = list(request["argv"])
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    exitCode = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            exitCode = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            exitCode = 1
+    except BaseException:
+        traceback.print_exc()
+        exitCode = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    conn.sendall(json.dumps({"exitCode": exitCode}).encode() + b"\n")
+    os._exit(exitCode)
+
+
+def serve(socketPath=None, idleTimeout=600):
+    """Import the stack and run script invocations until idle.
+
+    Parameters
+    ----------
+    socketPath : `str`, optional
+        Socket to listen on.  Defaults to `getSocketPath`.
+    idleTimeout : `float`, optional
+        Seconds without requests or running scripts after which the
+        server exits.
+    """
+    socketPath = socketPath or getSocketPath()
+    lockFile = open(socketPath + ".lock", "w")
+    try:
+        fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        # Another server for this stack is already running or starting.
+        return
+
+    for module in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print(f"warmWorker: not preloading {module}: {e}", file=sys.stderr)
+    try:
+        _preloadCameras()
+    except Exception as e:
+        print(f"warmWorker: not preloading the cameras: {e}", file=sys.stderr)
+
+    if os.path.exists(socketPath):
+        os.remove(socketPath)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socketPath)
+    os.chmod(socketPath, 0o600)
+    listener.listen(64)
+    # Remove the socket when terminated.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    children = set()
+    lastActive = time.monotonic()
+    try:
+        while children or time.monotonic() - lastActive < idleTimeout:
+            ready, _, _ = select.select([listener], [], [], 1.0)
+            for pid in list(children):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    children.discard(pid)
+            if children:
+                lastActive = time.monotonic()
+            if not ready:
+                continue
+
+            conn, _ = listener.accept()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                listener.close()
+                try:
+                    _runRequest(conn)
+                finally:
+                    os._exit(1)
+            conn.close()
+            children.add(pid)
+            lastActive = time.monotonic()
+    finally:
+        listener.close()
+        os.remove(socketPath)
+
+
+def _startServer(socketPath):
+    """Start a server in the background.
+    """
+    with open(socketPath + ".log", "a") as log:
+        subprocess.Popen([sys.executable, "-m", "lsst.ci.cpp.warmWorker", "serve",
+                          "--socket", socketPath],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+
+
+def _announcePid(pid):
+    """Tell an enclosing `lsst.ci.cpp.stageMonitor` about the process
+    running the script, as it is not one of its descendants.
+    """
+    pidFile = os.environ.get("CI_CPP_MONITOR_PIDFILE")
+    if pidFile:
+        with open(pidFile, "a") as f:
+            f.write(f"{pid}\n")
+
+
+def runCommand(argv, socketPath=None):
+    """Run a script in the server, falling back to running it directly.
+
+    Parameters
+    ----------
+    argv : `list` [`str`]
+        Script and its arguments.
+    socketPath : `str`, optional
+        Socket of the server.  Defaults to `getSocketPath`.
+
+    Returns
+    -------
+    exitCode : `int`
+        Exit status of the script.  If the server is not available the
+        script replaces this process instead, and this does not return.
+    """
+    socketPath = socketPath or getSocketPath()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketPath)
+    except OSError:
+        sock.close()
+        _startServer(socketPath)
+        os.execv(sys.executable, [sys.executable] + list(argv))
+
+    payload = json.dumps({"argv": list(argv), "cwd": os.getcwd(), "env": dict(os.environ)}).encode()
+    _sendFds(sock, _HEADER.pack(len(payload)), [0, 1, 2])
+    sock.sendall(payload)
+
+    remotePid = None
+    stream = sock.makefile("rb")
+    try:
+        for line in stream:
+            message = json.loads(line)
+            if "pid" in message:
+                remotePid = message["pid"]
+                _announcePid(remotePid)
+            if "exitCode" in message:
+                return message["exitCode"]
+    except KeyboardInterrupt:
+        if remotePid is not None:
+            os.kill(remotePid, signal.SIGTERM)
+        raise
+    # The script process died without reporting.
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run scripts in a server with the stack preloaded.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    serveParser = subparsers.add_parser("serve", help="Run the server.")
+    serveParser.add_argument("--socket", help="Socket to listen on.")
+    serveParser.add_argument("--idle-timeout", type=float, default=600,
+                             help="Seconds without requests after which to exit.")
+    runParser = subparsers.add_parser("run", help="Run a script in the server.")
+    runParser.add_argument("--socket", help="Socket of the server.")
+    runParser.add_argument("command", nargs=argparse.REMAINDER, help="Script and arguments, after --.")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        serve(args.socket, args.idle_timeout)
+        return
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("No script given.")
+    sys.exit(runCommand(command, args.socket))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import unittest
+import unittest.mock
+
+import numpy as np
+
+import lsst.afw.cameraGeom as cameraGeom
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+import lsst.geom as geom
+import lsst.utils.tests
+
+from lsst.ci.cpp.ampStatistics import calculateAmpStatistics
+from lsst.ci.cpp.resources import getProcessCores
+
+
+BAD_MASK_PLANES = ["SAT", "BAD", "NO_DATA"]
+# afwMath and calculateAmpStatistics interpolate percentiles slightly
+# differently, which moves the median, and with it the first clipping
+# window, by a fraction of the spacing of neighbouring pixel values.
+MEDIAN_TOLERANCE = 0.01
+CLIP_RTOL = 1e-3
+
+
+class AmpStatisticsTestCase(lsst.utils.tests.TestCase):
+    """Test the per-amplifier statistics against lsst.afw.math on a
+    synthetic exposure.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(20200128)
+        nx, ny = 64, 50
+        # The exposure does not start at the origin, as amplifier boxes
+        # are in parent coordinates.
+        self.exposure = afwImage.ExposureF(geom.Box2I(geom.Point2I(10, 20), geom.Extent2I(4*nx, 2*ny)))
+        self.amps = []
+        self.sigmas = []
+        for index in range(8):
+            builder = cameraGeom.Amplifier.Builder()
+            builder.setName(f"C{index:02d}")
+            builder.setBBox(geom.Box2I(geom.Point2I(10 + (index % 4)*nx, 20 + (index//4)*ny),
+                                       geom.Extent2I(nx, ny)))
+            self.amps.append(builder.finish())
+
+            sigma = 5.0 + index
+            self.sigmas.append(sigma)
+            pixels = rng.normal(100.0*index, sigma, (ny, nx))
+            # Cosmic-ray-like outliers for the clipping to remove.
+            outliers = rng.random((ny, nx)) < 0.02
+            pixels[outliers] += rng.uniform(10.0*sigma, 1000.0*sigma, outliers.sum())
+            self.exposure.image[self.amps[-1].getBBox()].array[:, :] = pixels
+        # Some masked and some non-finite pixels, which are excluded.
+        bad = rng.random(self.exposure.image.array.shape) < 0.01
+        self.exposure.mask.array[bad] = self.exposure.mask.getPlaneBitMask("BAD")
+        self.exposure.image.array[rng.random(bad.shape) < 0.001] = np.nan
+
+    def getAfwStatistics(self, amp, nSigmaClip, nIter):
+        statControl = afwMath.StatisticsControl(nSigmaClip, nIter)
+        statControl.setAndMask(self.exposure.mask.getPlaneBitMask(BAD_MASK_PLANES))
+        ampExposure = self.exposure.Factory(self.exposure, amp.getBBox())
+        stats = afwMath.makeStatistics(ampExposure.getMaskedImage(),
+                                       afwMath.MEAN | afwMath.MEDIAN | afwMath.STDEV | afwMath.STDEVCLIP,
+                                       statControl)
+        return {"MEAN": stats.getValue(afwMath.MEAN),
+                "MEDIAN": stats.getValue(afwMath.MEDIAN),
+                "STDEV": stats.getValue(afwMath.STDEV),
+                "STDEVCLIP": stats.getValue(afwMath.STDEVCLIP)}
+
+    def checkStatistics(self, statistics, nSigmaClip, nIter):
+        for amp, sigma in zip(self.amps, self.sigmas):
+            expected = self.getAfwStatistics(amp, nSigmaClip, nIter)
+            measured = statistics[amp.getName()]
+            with self.subTest(amp=amp.getName()):
+                self.assertFloatsAlmostEqual(measured["MEAN"], expected["MEAN"], rtol=1e-6)
+                self.assertFloatsAlmostEqual(measured["STDEV"], expected["STDEV"], rtol=1e-6)
+                self.assertFloatsAlmostEqual(measured["MEDIAN"], expected["MEDIAN"],
+                                             atol=MEDIAN_TOLERANCE*sigma)
+                self.assertFloatsAlmostEqual(measured["STDEVCLIP"], expected["STDEVCLIP"], rtol=CLIP_RTOL)
+
+    def testAfwStatistics(self):
+        """Match afwMath, clipping the outliers over several
+        iterations.
+        """
+        for nSigmaClip, nIter in ((5.0, 5), (3.0, 1), (3.0, 10)):
+            with self.subTest(nSigmaClip=nSigmaClip, nIter=nIter):
+                statistics = calculateAmpStatistics(self.exposure, self.amps, BAD_MASK_PLANES,
+                                                    nSigmaClip=nSigmaClip, nIter=nIter)
+                self.checkStatistics(statistics, nSigmaClip, nIter)
+                for amp, sigma in zip(self.amps, self.sigmas):
+                    # The outliers inflate the plain standard deviation
+                    # only.
+                    self.assertGreater(statistics[amp.getName()]["STDEV"], 2.0*sigma)
+                    self.assertLess(statistics[amp.getName()]["STDEVCLIP"], 1.2*sigma)
+
+    def testThreads(self):
+        """The statistics do not depend on how the amplifiers are split
+        between threads, including uneven splits and more threads than
+        amplifiers.
+        """
+        single = calculateAmpStatistics(self.exposure, self.amps, BAD_MASK_PLANES, nThreads=1)
+        for nThreads in (2, 3, 8, 12):
+            with self.subTest(nThreads=nThreads):
+                self.assertEqual(calculateAmpStatistics(self.exposure, self.amps, BAD_MASK_PLANES,
+                                                        nThreads=nThreads), single)
+        self.checkStatistics(calculateAmpStatistics(self.exposure, self.amps, BAD_MASK_PLANES, nThreads=3),
+                             5.0, 5)
+
+    def testProcessCores(self):
+        """The cores are shared between the pytest-xdist workers.
+        """
+        with unittest.mock.patch.dict(os.environ, PYTEST_XDIST_WORKER_COUNT="1"):
+            cores = getProcessCores()
+        self.assertGreaterEqual(cores, 1)
+        with unittest.mock.patch.dict(os.environ, PYTEST_XDIST_WORKER_COUNT=str(cores)):
+            self.assertEqual(getProcessCores(), 1)
+        with unittest.mock.patch.dict(os.environ, PYTEST_XDIST_WORKER_COUNT=str(2*cores)):
+            self.assertEqual(getProcessCores(), 1)
+
+    def testBadPixels(self):
+        """Extra bad pixels are excluded like masked ones.
+        """
+        badPixels = np.zeros(self.exposure.image.array.shape, dtype=bool)
+        badPixels[:, :32] = True
+        statistics = calculateAmpStatistics(self.exposure, self.amps, BAD_MASK_PLANES, badPixels=badPixels)
+        self.exposure.mask.array[badPixels] |= self.exposure.mask.getPlaneBitMask("BAD")
+        self.checkStatistics(statistics, 5.0, 5)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -23,13 +23,16 @@ import numpy as np
 import unittest
 
 import lsst.afw.math as afwMath
-import lsst.daf.persistence as dafPersist
-import lsst.ip.isr as ipIsr
-import lsst.meas.algorithms as measAlg
 import lsst.utils.tests
 from lsst.utils import getPackageDir
 
-from lsst.pipe.tasks.repair import RepairTask
+from lsst.ci.cpp.ampStatistics import calculateAmpStatistics
+from lsst.ci.cpp.cosmicRays import findCosmicRayMask
+from lsst.ci.cpp.detectors import getDetectorList, loadManifest
+from lsst.ci.cpp.isrCache import runIsrForDetectors
+from lsst.ci.cpp.isrConfigs import makeIsrConfig
+from lsst.ci.cpp.metricsStore import recordMetric
+from lsst.ci.cpp.tiers import scaleThreshold
 
 
 # TODO: DM-26396
@@ -37,7 +40,7 @@ from lsst.pipe.tasks.repair import RepairTask
 class BiasTestCases(lsst.utils.tests.TestCase):
     @classmethod
     def setUpClass(cls):
-        """Setup butler, and generate an ISR processed exposure.
+        """Generate an ISR processed exposure for each detector.
 
         Notes
         -----
@@ -49,42 +52,14 @@ class BiasTestCases(lsst.utils.tests.TestCase):
         """
         repoDir = os.path.join(getPackageDir('ci_cpp_gen2'), "DATA")
         calibDir = os.path.join(repoDir, "calibs")
-        butler = dafPersist.Butler(repoDir, calibRoot=calibDir)
-
-        config = ipIsr.IsrTaskConfig()
-        config.doSaturation = True
-        config.doSuspect = True
-        config.doSetBadRegions = True
-        config.doOverscan = True
-        config.doBias = True
-        config.doVariance = True
-
-        config.doLinearize = False
-        config.doCrosstalk = False
-        config.doWidenSaturationTrails = False
-        config.doBrighterFatter = False
-        config.doDefect = False
-        config.doSaturationInterpolation = False
-        config.doDark = False
-        config.doStrayLight = False
-        config.doFlat = False
-        config.doApplyGains = False
-        config.doFringe = False
-        config.doMeasureBackground = False
-        config.doVignette = False
-        config.doAttachTransmissionCurve = False
-        config.doUseOpticsTransmission = False
-        config.doUseFilterTransmission = False
-        config.doUseSensorTransmission = False
-        config.doUseAtmosphereTransmission = False
-
-        isrTask = ipIsr.IsrTask(config=config)
+
+        config = makeIsrConfig()
+
         # TODO: DM-26396
         # This is not an independent frame.
-        dataRef = butler.dataRef('raw', dataId={'detector': 0, 'expId': 2020012800007})
-        results = isrTask.runDataRef(dataRef)
-        cls.exposure = results.outputExposure
-        del butler
+        cls.detectors = getDetectorList(loadManifest())
+        cls.exposures = runIsrForDetectors(repoDir, calibDir, config, {'expId': 2020012800007},
+                                           cls.detectors)
 
     def test_independentFrameLevel(self):
         """Test image mean.
@@ -96,8 +71,11 @@ class BiasTestCases(lsst.utils.tests.TestCase):
         Confirm that the mean of the result is 0 to within statistical
         error
         """
-        mean = afwMath.makeStatistics(self.exposure.getImage(), afwMath.MEAN).getValue()
-        self.assertLess(np.abs(mean), 1, msg=f"Test 4.2: {mean}")
+        for detector, exposure in self.exposures.items():
+            with self.subTest(detector=detector):
+                mean = afwMath.makeStatistics(exposure.getImage(), afwMath.MEAN).getValue()
+                recordMetric(self.id(), "mean", mean, detector)
+                self.assertLess(np.abs(mean), scaleThreshold(1.0), msg=f"Test 4.2: {detector} {mean}")
 
     def test_independentFrameSigma(self):
         """Amp sigma against readnoise
@@ -111,16 +89,18 @@ class BiasTestCases(lsst.utils.tests.TestCase):
         by a robust measure of the noise in the serial overscan
 
         """
-        ccd = self.exposure.getDetector()
-        for amp in ccd:
-            ampExposure = self.exposure.Factory(self.exposure, amp.getBBox())
-            statControl = afwMath.StatisticsControl(5.0, 5)
-            statControl.setAndMask(self.exposure.mask.getPlaneBitMask(["SAT", "BAD", "NO_DATA"]))
-            sigma = afwMath.makeStatistics(ampExposure.getImage(),
-                                           afwMath.STDEVCLIP, statControl).getValue()
-            # needs to be < 0.05
-            fractionalError = np.abs(sigma - amp.getReadNoise())/amp.getReadNoise()
-            self.assertLess(fractionalError, 0.71, msg=f"Test 4.3: {amp.getName()} {fractionalError}")
+        for detector, exposure in self.exposures.items():
+            ccd = exposure.getDetector()
+            ampStats = calculateAmpStatistics(exposure, ccd, nSigmaClip=5.0, nIter=5)
+            for amp in ccd:
+                with self.subTest(detector=detector, amp=amp.getName()):
+                    sigma = ampStats[amp.getName()]["STDEVCLIP"]
+                    # needs to be < 0.05
+                    fractionalError = np.abs(sigma - amp.getReadNoise())/amp.getReadNoise()
+                    recordMetric(self.id(), "stdevClip", sigma, detector, amp.getName())
+                    recordMetric(self.id(), "fractionalError", fractionalError, detector, amp.getName())
+                    self.assertLess(fractionalError, scaleThreshold(0.71),
+                                    msg=f"Test 4.3: {detector} {amp.getName()} {fractionalError}")
 
     def test_amplifierSigma(self):
         """Clipped sigma against CR-rejected sigma
@@ -134,28 +114,24 @@ class BiasTestCases(lsst.utils.tests.TestCase):
         clipped value.
 
         """
-        crTask = RepairTask()
-        crRejected = self.exposure.clone()
-        psf = measAlg.SingleGaussianPsf(21, 21, 3.0)
-        crRejected.setPsf(psf)
-        crTask.run(crRejected, keepCRs=False)
-
-        ccd = self.exposure.getDetector()
-        for amp in ccd:
-            ampExposure = self.exposure.Factory(self.exposure, amp.getBBox())
-            clipControl = afwMath.StatisticsControl(5.0, 5)
-            clipControl.setAndMask(self.exposure.mask.getPlaneBitMask(["SAT", "BAD", "NO_DATA"]))
-            sigmaClip = afwMath.makeStatistics(ampExposure.getImage(),
-                                               afwMath.STDEVCLIP, clipControl).getValue()
-
-            crAmp = crRejected.Factory(crRejected, amp.getBBox())
-            statControl = afwMath.StatisticsControl()
-            statControl.setAndMask(self.exposure.mask.getPlaneBitMask(["SAT", "BAD", "NO_DATA", "CR"]))
-            sigma = afwMath.makeStatistics(crAmp.getImage(), afwMath.STDEV, statControl).getValue()
-
-            # needs to be < 0.05
-            fractionalError = np.abs(sigma - sigmaClip)/sigmaClip
-            self.assertLess(fractionalError, 3.0, msg="Test 4.4: {amp.getName()} {fractionalError}")
+        for detector, exposure in self.exposures.items():
+            crMask = findCosmicRayMask(exposure)
+
+            ccd = exposure.getDetector()
+            clipStats = calculateAmpStatistics(exposure, ccd, nSigmaClip=5.0, nIter=5)
+            crStats = calculateAmpStatistics(exposure, ccd, badPixels=crMask)
+            for amp in ccd:
+                with self.subTest(detector=detector, amp=amp.getName()):
+                    sigmaClip = clipStats[amp.getName()]["STDEVCLIP"]
+                    sigma = crStats[amp.getName()]["STDEV"]
+
+                    # needs to be < 0.05
+                    fractionalError = np.abs(sigma - sigmaClip)/sigmaClip
+                    recordMetric(self.id(), "stdevClip", sigmaClip, detector, amp.getName())
+                    recordMetric(self.id(), "stdevCrRejected", sigma, detector, amp.getName())
+                    recordMetric(self.id(), "fractionalError", fractionalError, detector, amp.getName())
+                    self.assertLess(fractionalError, scaleThreshold(3.0),
+                                    msg=f"Test 4.4: {detector} {amp.getName()} {fractionalError}")
 
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
@@ -18,13 +18,27 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
 import unittest
+
 import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+from lsst.ci.cpp.bfkFingerprint import (compareFingerprints, getGoldenPath, loadBuiltKernels,
+                                        readFingerprint)
+from lsst.ci.cpp.detectors import getDetectorList, loadManifest
 
 
 # TODO: DM-26396
 #       Update these tests to validate calibration construction.
 class BrighterFatterTestCases(lsst.utils.tests.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        repoDir = os.path.join(getPackageDir('ci_cpp_gen2'), "DATA")
+        cls.bfkGenDir = os.path.join(repoDir, "bfkGen")
+        cls.calibDir = os.path.join(repoDir, "calibs")
+        if not os.path.exists(cls.bfkGenDir):
+            raise unittest.SkipTest("bfkGen products are not available.")
 
     def test_canary(self):
         """Test to see if the brighter fatter kernel has changed.
@@ -33,8 +47,19 @@ class BrighterFatterTestCases(lsst.utils.tests.TestCase):
         -----
         DMTN-101 14.1
         "Characterize".
+
+        The kernels are compared with the fingerprint of the tier in
+        ``tests/data/bfkFingerprint-<tier>.npz``.  After an intended
+        change, update it with ``bfkFingerprint.py --write``.  The test
+        is skipped for tiers without a stored fingerprint.
         """
-        pass
+        goldenPath = getGoldenPath()
+        if not os.path.exists(goldenPath):
+            self.skipTest(f"No reference fingerprint at {goldenPath}; store one with "
+                          "bfkFingerprint.py --write.")
+        kernels = loadBuiltKernels(self.bfkGenDir, self.calibDir, getDetectorList(loadManifest()))
+        differences = compareFingerprints(readFingerprint(goldenPath), kernels)
+        self.assertEqual(differences, [], "\n".join(differences))
 
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
@@ -0,0 +1,126 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import unittest
+
+import lsst.utils.tests
+
+from lsst.ci.cpp.buildPlan import criticalPath, estimateStageCosts, formatPlan, predictStage, simulateBuild
+
+
+def makeRecord(stage, wallTime, cpuTime=None, peakRss=2**30, command="", exitCode=0):
+    """Make a command record of a build report.
+    """
+    return {"stage": stage, "command": command, "exitCode": exitCode, "wallTime": wallTime,
+            "cpuTime": wallTime if cpuTime is None else cpuTime, "peakRss": peakRss,
+            "maxProcessRss": peakRss}
+
+
+class BuildPlanTestCase(lsst.utils.tests.TestCase):
+    """Test the build plan on a toy stage graph.
+    """
+
+    def setUp(self):
+        # The calibration chain, then three branches after the flat.
+        self.graph = {"bias": [], "dark": ["bias"], "flat": ["dark"], "science": ["flat"],
+                      "crosstalk": ["flat"], "ptc": ["flat"], "bfk": ["ptc"]}
+        self.durations = {"bias": 10.0, "dark": 5.0, "flat": 8.0, "science": 4.0, "crosstalk": 6.0,
+                          "ptc": 12.0, "bfk": 3.0}
+        self.memory = {"bias": 1.0, "dark": 1.0, "flat": 1.0, "science": 2.0, "crosstalk": 3.0,
+                       "ptc": 5.0, "bfk": 4.0}
+
+    def testCriticalPath(self):
+        path, length = criticalPath(self.graph, self.durations)
+        self.assertEqual(path, ["bias", "dark", "flat", "ptc", "bfk"])
+        self.assertEqual(length, 38.0)
+        self.assertEqual(criticalPath({}, {}), ([], 0.0))
+
+    def testSimulateSerial(self):
+        """One job runs every stage in turn.
+        """
+        schedule, makespan, peakMemory = simulateBuild(self.graph, self.durations, self.memory, 1)
+        self.assertEqual(makespan, sum(self.durations.values()))
+        self.assertEqual(peakMemory, max(self.memory.values()))
+        for stage, upstream in self.graph.items():
+            for name in upstream:
+                self.assertGreaterEqual(schedule[stage][0], schedule[name][1])
+
+    def testSimulateParallel(self):
+        """Two jobs start the longest branch first, and finish on the
+        critical path.
+        """
+        schedule, makespan, peakMemory = simulateBuild(self.graph, self.durations, self.memory, 2)
+        self.assertEqual(makespan, 38.0)
+        self.assertEqual(schedule["ptc"], (23.0, 35.0))
+        self.assertEqual(schedule["crosstalk"], (23.0, 29.0))
+        self.assertEqual(schedule["science"], (29.0, 33.0))
+        self.assertEqual(schedule["bfk"], (35.0, 38.0))
+        self.assertEqual(peakMemory, 8.0)
+        # More jobs than branches cannot beat the critical path.
+        _, makespan, peakMemory = simulateBuild(self.graph, self.durations, self.memory, 8)
+        self.assertEqual(makespan, 38.0)
+        self.assertEqual(peakMemory, 10.0)
+
+    def testPredictStage(self):
+        cost = {"wallTime": 100.0, "cpuTime": 400.0, "peakRss": 4.0, "cores": 4}
+        self.assertEqual(predictStage(cost, 4), (100.0, 4.0))
+        self.assertEqual(predictStage(cost, 2), (200.0, 2.0))
+        # Extra cores do not make a stage faster than it ran.
+        self.assertEqual(predictStage(cost, 16), (100.0, 4.0))
+        self.assertEqual(predictStage(dict(cost, wallTime=0.0), 4), (0.0, 4.0))
+
+    def testEstimateStageCosts(self):
+        reports = [[makeRecord("bias", 10.0, peakRss=100), makeRecord("bias", 2.0, peakRss=300),
+                    makeRecord("ptc", 30.0, 90.0, command="measurePhotonTransferCurve.py -j 4")],
+                   [makeRecord("bias", 14.0, peakRss=200),
+                    makeRecord("ptc", 50.0, exitCode=1)],
+                   [makeRecord("bias", 20.0, peakRss=200),
+                    makeRecord("ptc", 40.0, 100.0, command="measurePhotonTransferCurve.py -j 2")]]
+        costs = estimateStageCosts(reports)
+        # The commands of a stage are summed, and the builds medianed.
+        self.assertEqual(costs["bias"], {"wallTime": 14.0, "cpuTime": 14.0, "peakRss": 200, "cores": 1,
+                                         "builds": 3})
+        # Failed runs are ignored.
+        self.assertEqual(costs["ptc"], {"wallTime": 35.0, "cpuTime": 95.0, "peakRss": 2**30, "cores": 4,
+                                        "builds": 2})
+
+    def testFormatPlan(self):
+        stages = {stage: {"upstream": upstream, "parts": [stage], "cores": 1}
+                  for stage, upstream in self.graph.items()}
+        costs = {stage: {"wallTime": duration, "cpuTime": duration, "peakRss": 2**20, "cores": 1,
+                         "builds": 2}
+                 for stage, duration in self.durations.items() if stage != "science"}
+        plan = formatPlan(stages, costs, 2)
+        self.assertIn("Critical path: bias -> dark -> flat -> ptc -> bfk (38.0 s)", plan)
+        self.assertIn("Predicted makespan with -j 2: 38.0 s", plan)
+        self.assertIn("No successful earlier run of: science", plan)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,111 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import sqlite3
+import tempfile
+import unittest
+import unittest.mock
+
+import lsst.utils.tests
+
+from lsst.ci.cpp import bulkIngest
+
+
+class BulkIngestTestCase(lsst.utils.tests.TestCase):
+    """Test the registry writes of the bulk ingest.
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempDir.cleanup)
+        self.calibDir = os.path.join(self.tempDir.name, "calibs")
+        os.makedirs(self.calibDir)
+
+    def makeCalibRow(self, task, calibDate, detector=0):
+        """Make the registry information of one calibration HDU, with a
+        value of the right type for every column.
+        """
+        values = {"text": "value", "int": 0, "double": 0.0}
+        info = {column: values[colType] for column, colType in task.register.config.columns.items()}
+        info.update(calibDate=calibDate, detector=detector, detectorName="RXX_S00", filter="NONE")
+        return info
+
+    def testIngestCalibs(self):
+        """Ingest biases of two dates, and check their validity ranges.
+        """
+        task = bulkIngest.makeIngestTask("calib")
+        files = ["bias-2020-01-27.fits", "bias-2020-01-29.fits"]
+        headers = {filename: ({}, [self.makeCalibRow(task, filename[5:15])], "bias") for filename in files}
+        with unittest.mock.patch.object(bulkIngest, "findFiles", return_value=files), \
+                unittest.mock.patch.object(bulkIngest, "readHeaders", return_value=headers):
+            nRows = bulkIngest.ingestCalibs(self.tempDir.name, self.calibDir, files, validity=10,
+                                            mode="skip")
+        self.assertEqual(nRows, {"bias": 2})
+
+        registries = [name for name in os.listdir(self.calibDir) if name.endswith(".sqlite3")]
+        self.assertEqual(len(registries), 1)
+        with sqlite3.connect(os.path.join(self.calibDir, registries[0])) as conn:
+            ranges = conn.execute("SELECT calibDate, validStart, validEnd FROM bias "
+                                  "ORDER BY calibDate").fetchall()
+        self.assertEqual([calibDate for calibDate, _, _ in ranges], ["2020-01-27", "2020-01-29"])
+        for calibDate, validStart, validEnd in ranges:
+            with self.subTest(calibDate=calibDate):
+                self.assertIsInstance(validStart, str)
+                self.assertIsInstance(validEnd, str)
+                self.assertLessEqual(validStart[:10], calibDate)
+                self.assertGreaterEqual(validEnd[:10], calibDate)
+        # The earlier bias is valid until the later one takes over.
+        self.assertLess(ranges[0][1], ranges[1][1])
+        self.assertLessEqual(ranges[0][2], ranges[1][1])
+        self.assertEqual(ranges[1][2][:10], "2020-02-08")
+
+    def testReplace(self):
+        """Ingesting again replaces the earlier rows of the type.
+        """
+        task = bulkIngest.makeIngestTask("calib")
+        headers = {"bias.fits": ({}, [self.makeCalibRow(task, "2020-01-28")], "bias")}
+        for _ in range(2):
+            with unittest.mock.patch.object(bulkIngest, "findFiles", return_value=list(headers)), \
+                    unittest.mock.patch.object(bulkIngest, "readHeaders", return_value=headers):
+                bulkIngest.ingestCalibs(self.tempDir.name, self.calibDir, list(headers), validity=10,
+                                        mode="skip")
+        registry = os.path.join(self.calibDir, "calibRegistry.sqlite3")
+        with sqlite3.connect(registry) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM bias").fetchone(), (1,))
+
+    def testNormalizeDetectorName(self):
+        self.assertEqual(bulkIngest.normalizeDetectorName({"detectorName": "S00"}),
+                         {"detectorName": "RXX_S00"})
+        self.assertEqual(bulkIngest.normalizeDetectorName({"detectorName": "R22_S11"}),
+                         {"detectorName": "R22_S11"})
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
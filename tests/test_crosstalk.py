@@ -18,16 +18,79 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
 import unittest
+
+import numpy as np
+
 import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+from lsst.ci.cpp.crosstalkSolver import CrosstalkAccumulator
+from lsst.ci.cpp.detectors import getDetectorList, loadManifest
+from lsst.ci.cpp.footprint import getRerunState
+from lsst.ci.cpp.metricsStore import recordMetric
+from lsst.ci.cpp.sharedButler import getSharedButler
+
+
+# Settings of cp_pipe's MeasureCrosstalkTask, which measures crosstalk
+# only from the unmasked pixels of sources above the threshold.
+SOURCE_THRESHOLD = 30000.0
+BAD_MASK_PLANES = ("SAT", "BAD", "INTRP", "NO_DATA")
+# measureCrosstalk takes the clipped mean of the victim over source
+# ratio of those pixels, which weights them differently from the
+# least-squares fit of the same pixels.  The two must agree within
+# N_SIGMA of their combined standard error, where cp_pipe's coeffErr is
+# the scatter of the ratios, and its standard error that over the
+# square root of coeffNum, plus ABSOLUTE_TOLERANCE for the remaining
+# difference of the two estimators.
+N_SIGMA = 5.0
+ABSOLUTE_TOLERANCE = 1e-5
 
 
 # TODO: DM-26396
 #       Update these tests to validate calibration construction.
 class CrosstalkTestCases(lsst.utils.tests.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Fit the crosstalk of each detector from the bright-source
+        pixels of the crosstalkIsr exposures, one exposure at a time.
+        """
+        repoDir = os.path.join(getPackageDir('ci_cpp_gen2'), "DATA")
+        calibDir = os.path.join(repoDir, "calibs")
+        crosstalkIsrDir = os.path.join(repoDir, "crosstalkIsr")
+        crosstalkGenDir = os.path.join(repoDir, "crosstalkGen")
+        state = getRerunState(crosstalkIsrDir)
+        if state == "missing" or not os.path.exists(crosstalkGenDir):
+            raise unittest.SkipTest("crosstalkIsr exposures or crosstalkGen products are not available.")
+        if state != "available":
+            raise unittest.SkipTest(f"The crosstalkIsr exposures were {state} by the build; restore "
+                                    "them with scons restore-crosstalkIsr tests.")
 
-    def setup_independentFrame(self):
-        """Missing data.
+        manifest = loadManifest()
+        visits = manifest['scienceVisits']
+        isrButler = getSharedButler(crosstalkIsrDir, calibDir)
+        crosstalkButler = getSharedButler(crosstalkGenDir, calibDir)
+
+        cls.detectors = getDetectorList(manifest)
+        cls.solutions = {}
+        cls.crosstalkCalibs = {}
+        for detector in cls.detectors:
+            accumulator = None
+            for visit in visits:
+                exposure = isrButler.get('postISRCCD', dataId={'visit': visit, 'detector': detector})
+                if accumulator is None:
+                    accumulator = CrosstalkAccumulator(len(exposure.getDetector()),
+                                                       threshold=SOURCE_THRESHOLD)
+                accumulator.addExposure(exposure, badMaskPlanes=BAD_MASK_PLANES)
+            cls.solutions[detector] = accumulator.solve()
+            cls.crosstalkCalibs[detector] = crosstalkButler.get('crosstalk',
+                                                                dataId={'visit': visits[0],
+                                                                        'detector': detector})
+
+    def test_independentFrame(self):
+        """Compare the least-squares coefficients of the bright-source
+        pixels with crosstalkGen.
 
         Notes
         -----
@@ -37,7 +100,25 @@ class CrosstalkTestCases(lsst.utils.tests.TestCase):
         If appropriate, a 16x16 matrix may be sufficient.  Compare
         with the numbers provided by the camera team
         """
-        pass
+        for detector in self.detectors:
+            coeffs, coeffErr = self.solutions[detector]
+            calib = self.crosstalkCalibs[detector]
+            expected = np.array(calib.coeffs)
+            valid = np.ones_like(expected, dtype=bool)
+            if calib.coeffValid is not None:
+                valid = np.array(calib.coeffValid, dtype=bool)
+            expectedErr = np.zeros_like(expected)
+            if calib.coeffErr is not None:
+                expectedErr = np.array(calib.coeffErr)
+                if calib.coeffNum is not None:
+                    expectedErr = expectedErr/np.sqrt(np.maximum(np.array(calib.coeffNum), 1))
+            tolerance = N_SIGMA*np.hypot(coeffErr, expectedErr) + ABSOLUTE_TOLERANCE
+            for (victim, source), coeff in np.ndenumerate(expected):
+                recordMetric(self.id(), "coeff", coeff, detector, f"{victim}<{source}")
+            with self.subTest(detector=detector):
+                self.assertEqual(coeffs.shape, expected.shape)
+                self.assertTrue(np.all(np.abs(coeffs - expected)[valid] <= tolerance[valid]),
+                                msg=f"Largest deviation: {np.max(np.abs(coeffs - expected)[valid])}")
 
     def test_independentFrameLevel(self):
         """Missing data.
@@ -54,6 +135,63 @@ class CrosstalkTestCases(lsst.utils.tests.TestCase):
         pass
 
 
+class CrosstalkSolverTestCase(lsst.utils.tests.TestCase):
+    """Test the crosstalk fit on synthetic readout-aligned pixels.
+    """
+
+    def setUp(self):
+        self.rng = np.random.default_rng(20200916)
+        self.nAmp = 4
+        self.coeffs = self.rng.uniform(-5e-4, 5e-4, (self.nAmp, self.nAmp))
+        np.fill_diagonal(self.coeffs, 0.0)
+
+    def makeMatrix(self, nSample=100000):
+        """Sky noise, faint sources, and bright sources in every
+        amplifier, with crosstalk.
+        """
+        signal = np.zeros((nSample, self.nAmp))
+        for amp in range(self.nAmp):
+            faint = self.rng.choice(nSample, nSample//10, replace=False)
+            signal[faint, amp] += self.rng.uniform(0.0, 25000.0, len(faint))
+            bright = self.rng.choice(nSample, nSample//50, replace=False)
+            signal[bright, amp] += self.rng.uniform(SOURCE_THRESHOLD, 2*SOURCE_THRESHOLD, len(bright))
+        matrix = signal + signal @ self.coeffs.T + self.rng.normal(0.0, 10.0, signal.shape)
+        return matrix - np.median(matrix, axis=0)
+
+    def testBrightSources(self):
+        """Victims are fitted from the bright pixels of the other
+        amplifiers, whatever their own faint sources.
+        """
+        accumulator = CrosstalkAccumulator(self.nAmp, threshold=SOURCE_THRESHOLD)
+        for _ in range(2):
+            accumulator.addMatrix(self.makeMatrix())
+        coeffs, coeffErr = accumulator.solve()
+        self.assertTrue(np.all(coeffErr[~np.eye(self.nAmp, dtype=bool)] > 0))
+        self.assertTrue(np.all(np.abs(coeffs - self.coeffs) <= N_SIGMA*coeffErr + 1e-12))
+        # The faint sources below the crosstalk ceiling add noise, but
+        # the fit still resolves coefficients of a few 1e-4.
+        self.assertLess(np.max(coeffErr), 5e-5)
+
+    def testTooFewSamples(self):
+        """Pairs without bright source pixels give NaN.
+        """
+        accumulator = CrosstalkAccumulator(self.nAmp, threshold=10*SOURCE_THRESHOLD)
+        accumulator.addMatrix(self.makeMatrix(1000))
+        coeffs, coeffErr = accumulator.solve()
+        offDiagonal = ~np.eye(self.nAmp, dtype=bool)
+        self.assertTrue(np.all(np.isnan(coeffs[offDiagonal])))
+        self.assertTrue(np.all(np.isnan(coeffErr[offDiagonal])))
+
+    def testJoint(self):
+        """Without a threshold, every victim is fitted against all
+        sources from all samples.
+        """
+        accumulator = CrosstalkAccumulator(self.nAmp)
+        accumulator.addMatrix(self.makeMatrix())
+        coeffs, coeffErr = accumulator.solve()
+        self.assertTrue(np.all(np.abs(coeffs - self.coeffs) <= N_SIGMA*coeffErr + 1e-12))
+
+
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
 
@@ -0,0 +1,131 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import unittest
+
+import numpy as np
+
+import lsst.geom as geom
+import lsst.utils.tests
+
+from lsst.ci.cpp.defectComparison import DefectIndex, compareDefects
+
+
+def bruteForceOverlaps(boxes, box):
+    """Indices of the boxes overlapping a box, testing every box.
+    """
+    minX, minY, maxX, maxY = box
+    return np.flatnonzero((boxes[:, 0] <= maxX) & (boxes[:, 2] >= minX)
+                          & (boxes[:, 1] <= maxY) & (boxes[:, 3] >= minY))
+
+
+def makeBoxes(rng, nBox, size, maxWidth=8):
+    """Random boxes on a square of pixels.
+    """
+    minX = rng.integers(0, size, nBox)
+    minY = rng.integers(0, size, nBox)
+    width = rng.integers(1, maxWidth + 1, nBox)
+    height = rng.integers(1, maxWidth + 1, nBox)
+    return np.stack([minX, minY, minX + width - 1, minY + height - 1], axis=1)
+
+
+class Amplifier:
+    """The parts of an amplifier `compareDefects` uses.
+    """
+
+    def __init__(self, name, bbox):
+        self._name = name
+        self._bbox = bbox
+
+    def getName(self):
+        return self._name
+
+    def getBBox(self):
+        return self._bbox
+
+
+class DefectIndexTestCase(lsst.utils.tests.TestCase):
+    """Test the defect box index against brute force.
+    """
+
+    def setUp(self):
+        self.rng = np.random.default_rng(20200128)
+
+    def checkQueries(self, index, boxes, queries):
+        for query in queries:
+            with self.subTest(query=tuple(query)):
+                np.testing.assert_array_equal(np.sort(index.query(query)),
+                                              bruteForceOverlaps(boxes, query))
+
+    def testNarrowBoxes(self):
+        boxes = makeBoxes(self.rng, 500, 1000)
+        self.checkQueries(DefectIndex(boxes), boxes, makeBoxes(self.rng, 200, 1000, maxWidth=40))
+
+    def testWideBoxes(self):
+        """Wide boxes, such as masked columns and edges, are found from
+        any query they reach, including narrow ones far from their
+        minimum x.
+        """
+        boxes = np.concatenate([makeBoxes(self.rng, 500, 1000),
+                                [[0, 0, 999, 3], [0, 996, 999, 999], [100, 0, 900, 0]],
+                                makeBoxes(self.rng, 20, 1000, maxWidth=400)])
+        index = DefectIndex(boxes)
+        queries = np.concatenate([makeBoxes(self.rng, 200, 1000, maxWidth=40),
+                                  [[998, 0, 998, 0], [500, 998, 500, 998], [0, 0, 999, 999]]])
+        self.checkQueries(index, boxes, queries)
+        # Every box is indexed as wide with a small width limit.
+        self.checkQueries(DefectIndex(boxes, wideWidth=1), boxes, queries)
+
+    def testEmpty(self):
+        self.assertEqual(len(DefectIndex(np.zeros((0, 4)))), 0)
+        self.assertEqual(len(DefectIndex(np.zeros((0, 4))).query((0, 0, 10, 10))), 0)
+
+    def testCompareDefects(self):
+        reference = np.array([[10, 10, 10, 20], [50, 50, 52, 52], [80, 10, 80, 10]])
+        measured = np.array([[10, 15, 10, 25], [51, 51, 51, 51], [150, 10, 150, 10]])
+        amps = [Amplifier("C00", geom.Box2I(geom.Point2I(0, 0), geom.Point2I(99, 99))),
+                Amplifier("C01", geom.Box2I(geom.Point2I(100, 0), geom.Point2I(199, 99)))]
+        comparison = compareDefects(reference, measured, amps)
+        np.testing.assert_array_equal(comparison["matched"], [0, 1])
+        np.testing.assert_array_equal(comparison["missing"], [2])
+        np.testing.assert_array_equal(comparison["new"], [2])
+
+        left = comparison["amps"]["C00"]
+        self.assertEqual((left["matched"], left["missing"], left["new"]), (2, 1, 0))
+        self.assertEqual(left["referencePixels"], 11 + 9 + 1)
+        self.assertEqual(left["measuredPixels"], 11 + 1)
+        self.assertEqual(left["overlapPixels"], 6 + 1)
+        self.assertAlmostEqual(left["overlapFraction"], 7/(21 + 12 - 7))
+        right = comparison["amps"]["C01"]
+        self.assertEqual((right["matched"], right["missing"], right["new"]), (0, 0, 1))
+        self.assertEqual(right["overlapFraction"], 0.0)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -23,19 +23,31 @@ import numpy as np
 import unittest
 
 import lsst.afw.math as afwMath
-import lsst.daf.persistence as dafPersist
-import lsst.ip.isr as ipIsr
 import lsst.utils.tests
 
 from lsst.utils import getPackageDir
 
+from lsst.ci.cpp.defectComparison import compareDefects, loadDefectFiles
+from lsst.ci.cpp.detectors import getDetectorList, loadManifest
+from lsst.ci.cpp.isrCache import runIsrForDetectors
+from lsst.ci.cpp.isrConfigs import makeIsrConfig
+from lsst.ci.cpp.metricsStore import recordMetric
+from lsst.ci.cpp.sharedButler import getSharedButler
+
+
+# Smallest fraction of the curated defects that defectGen must find.
+MIN_MATCH_FRACTION = 0.5
+# Smallest fraction of the pixels flagged by either list on an
+# amplifier with curated defects that are flagged by both.
+MIN_OVERLAP_FRACTION = 0.25
+
 
 # TODO: DM-26396
 #       Update these tests to validate calibration construction.
 class DefectTestCases(lsst.utils.tests.TestCase):
     @classmethod
     def setUpClass(cls):
-        """Setup butler and generate an ISR processed exposure.
+        """Generate an ISR processed exposure for each detector.
 
         Notes
         -----
@@ -45,42 +57,15 @@ class DefectTestCases(lsst.utils.tests.TestCase):
         """
         repoDir = os.path.join(getPackageDir("ci_cpp_gen2"), "DATA")
         calibDir = os.path.join(repoDir, "calibs")
-        butler = dafPersist.Butler(repoDir, calibRoot=calibDir)
-
-        config = ipIsr.IsrTaskConfig()
-        config.doSaturation = True
-        config.doSuspect = True
-        config.doSetBadRegions = True
-        config.doOverscan = True
-        config.doBias = True
-        config.doVariance = True
-        config.doDark = True
-        config.doFlat = True
-        config.doDefect = True
-
-        config.doLinearize = False
-        config.doCrosstalk = False
-        config.doWidenSaturationTrails = False
-        config.doBrighterFatter = False
-        config.doSaturationInterpolation = False
-        config.doStrayLight = False
-        config.doApplyGains = False
-        config.doFringe = False
-        config.doMeasureBackground = False
-        config.doVignette = False
-        config.doAttachTransmissionCurve = False
-        config.doUseOpticsTransmission = False
-        config.doUseFilterTransmission = False
-        config.doUseSensorTransmission = False
-        config.doUseAtmosphereTransmission = False
-
-        isrTask = ipIsr.IsrTask(config=config)
+        cls.repoDir, cls.calibDir = repoDir, calibDir
+
+        config = makeIsrConfig(doDark=True, doFlat=True, doDefect=True)
+
         # TODO: DM-26396
         # This is not an independent frame.
-        dataRef = butler.dataRef('raw', dataId={'detector': 0, 'expId': 2020012800028})
-        results = isrTask.runDataRef(dataRef)
-        cls.exposure = results.outputExposure
-        del butler
+        cls.detectors = getDetectorList(loadManifest())
+        cls.exposures = runIsrForDetectors(repoDir, calibDir, config, {'expId': 2020012800028},
+                                           cls.detectors)
 
     def test_masterFrameLevel(self):
         """Test image Mean
@@ -93,11 +78,49 @@ class DefectTestCases(lsst.utils.tests.TestCase):
         within statistical noise (after masking known defects)
 
         """
-        mean = afwMath.makeStatistics(self.exposure.getImage(), afwMath.MEAN).getValue()
-        median = afwMath.makeStatistics(self.exposure.getImage(), afwMath.MEDIAN).getValue()
-        sigma = afwMath.makeStatistics(self.exposure.getImage(), afwMath.STDEV).getValue()
+        for detector, exposure in self.exposures.items():
+            with self.subTest(detector=detector):
+                mean = afwMath.makeStatistics(exposure.getImage(), afwMath.MEAN).getValue()
+                median = afwMath.makeStatistics(exposure.getImage(), afwMath.MEDIAN).getValue()
+                sigma = afwMath.makeStatistics(exposure.getImage(), afwMath.STDEV).getValue()
+
+                self.assertLess(np.abs(mean/median - 1.0), sigma,
+                                msg=f"Test 3.2: {detector} {mean} {sigma}")
 
-        self.assertLess(np.abs(mean/median - 1.0), sigma, msg=f"Test 3.2: {mean} {sigma}")
+    def test_curatedDefects(self):
+        """Compare the defectGen defects with the curated defects.
+
+        Most curated defects must be matched by an overlapping measured
+        defect, and on every amplifier with curated defects, the pixels
+        flagged by the two lists must largely agree.
+        """
+        defectGenDir = os.path.join(self.repoDir, "defectGen", "defects")
+        if not os.path.exists(defectGenDir):
+            self.skipTest("defectGen products are not available.")
+        if loadManifest().get("syntheticScale", 1) > 1:
+            # The synthetic copies have no defects, so findDefects drops
+            # those of the templates.
+            self.skipTest("defectGen products are measured from synthetic raws.")
+        measured = loadDefectFiles(defectGenDir)
+        butler = getSharedButler(self.repoDir, self.calibDir)
+
+        for detector, exposure in self.exposures.items():
+            with self.subTest(detector=detector):
+                self.assertIn(detector, measured)
+                curated = butler.get('defects', dataId={'expId': 2020012800028, 'detector': detector})
+                comparison = compareDefects(curated, measured[detector], exposure.getDetector())
+                for name in ('matched', 'missing', 'new'):
+                    recordMetric(self.id(), name, len(comparison[name]), detector)
+
+                for ampName, amp in comparison['amps'].items():
+                    recordMetric(self.id(), "overlapFraction", amp['overlapFraction'], detector, ampName)
+
+                self.assertGreaterEqual(len(comparison['matched']), MIN_MATCH_FRACTION*len(curated))
+                for ampName, amp in comparison['amps'].items():
+                    if amp['referencePixels'] == 0:
+                        continue
+                    with self.subTest(amp=ampName):
+                        self.assertGreaterEqual(amp['overlapFraction'], MIN_OVERLAP_FRACTION)
 
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
@@ -23,18 +23,22 @@ import numpy as np
 import unittest
 
 import lsst.afw.math as afwMath
-import lsst.daf.persistence as dafPersist
-import lsst.ip.isr as ipIsr
 import lsst.utils.tests
 from lsst.utils import getPackageDir
 
+from lsst.ci.cpp.detectors import getDetectorList, loadManifest
+from lsst.ci.cpp.isrCache import runIsrForDetectors
+from lsst.ci.cpp.isrConfigs import makeIsrConfig
+from lsst.ci.cpp.metricsStore import recordMetric
+from lsst.ci.cpp.tiers import scaleThreshold
+
 
 # TODO: DM-26396
 #       Update these tests to validate calibration construction.
 class FlatTestCases(lsst.utils.tests.TestCase):
     @classmethod
     def setUpClass(cls):
-        """Setup butler and generate an ISR processed exposure.
+        """Generate an ISR processed exposure for each detector.
 
         As no flat tests are described in DMTN-101, use similar tests
         to those defined for darks.
@@ -50,42 +54,14 @@ class FlatTestCases(lsst.utils.tests.TestCase):
         """
         repoDir = os.path.join(getPackageDir('ci_cpp_gen2'), "DATA")
         calibDir = os.path.join(repoDir, "calibs")
-        butler = dafPersist.Butler(repoDir, calibRoot=calibDir)
-
-        config = ipIsr.IsrTaskConfig()
-        config.doSaturation = True
-        config.doSuspect = True
-        config.doSetBadRegions = True
-        config.doOverscan = True
-        config.doBias = True
-        config.doVariance = True
-        config.doDark = True
-        config.doFlat = True
-        config.doDefect = True
-
-        config.doLinearize = False
-        config.doCrosstalk = False
-        config.doWidenSaturationTrails = False
-        config.doBrighterFatter = False
-        config.doSaturationInterpolation = False
-        config.doStrayLight = False
-        config.doApplyGains = False
-        config.doFringe = False
-        config.doMeasureBackground = False
-        config.doVignette = False
-        config.doAttachTransmissionCurve = False
-        config.doUseOpticsTransmission = False
-        config.doUseFilterTransmission = False
-        config.doUseSensorTransmission = False
-        config.doUseAtmosphereTransmission = False
-
-        isrTask = ipIsr.IsrTask(config=config)
+
+        config = makeIsrConfig(doDark=True, doFlat=True, doDefect=True)
+
         # TODO: DM-26396
         # This is not an independent frame.
-        dataRef = butler.dataRef('raw', dataId={'detector': 0, 'expId': 2020012800028})
-        results = isrTask.runDataRef(dataRef)
-        cls.exposure = results.outputExposure
-        del butler
+        cls.detectors = getDetectorList(loadManifest())
+        cls.exposures = runIsrForDetectors(repoDir, calibDir, config, {'expId': 2020012800028},
+                                           cls.detectors)
 
     def test_independentFrameLevel(self):
         """Test image mean and sigma are plausible.
@@ -94,14 +70,18 @@ class FlatTestCases(lsst.utils.tests.TestCase):
         -----
         DMTN-101 10.X:
         """
-        mean = afwMath.makeStatistics(self.exposure.getImage(), afwMath.MEAN).getValue()
-        sigma = afwMath.makeStatistics(self.exposure.getImage(), afwMath.STDEV).getValue()
         expectMean = 8750
-        expectSigmaMax = 3000
-        self.assertLess(np.abs(mean - expectMean), sigma,
-                        msg=f"Test 10.X: {mean} {expectMean} {sigma}")
-        self.assertLess(sigma, expectSigmaMax,
-                        msg=f"Test 10.X2: {sigma} {expectSigmaMax}")
+        expectSigmaMax = scaleThreshold(3000)
+        for detector, exposure in self.exposures.items():
+            with self.subTest(detector=detector):
+                mean = afwMath.makeStatistics(exposure.getImage(), afwMath.MEAN).getValue()
+                sigma = afwMath.makeStatistics(exposure.getImage(), afwMath.STDEV).getValue()
+                recordMetric(self.id(), "mean", mean, detector)
+                recordMetric(self.id(), "stdev", sigma, detector)
+                self.assertLess(np.abs(mean - expectMean), sigma,
+                                msg=f"Test 10.X: {detector} {mean} {expectMean} {sigma}")
+                self.assertLess(sigma, expectSigmaMax,
+                                msg=f"Test 10.X2: {detector} {sigma} {expectSigmaMax}")
 
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
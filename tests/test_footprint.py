@@ -0,0 +1,94 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import tempfile
+import unittest
+
+import lsst.utils.tests
+
+from lsst.ci.cpp.footprint import (evictStage, getRerunState, measureFootprint, readProvenance,
+                                   selectEvictions, writeProvenance)
+
+
+class FootprintTestCase(lsst.utils.tests.TestCase):
+    """Test the footprint tracking and eviction of stage outputs.
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempDir.cleanup)
+
+    def makeStage(self, stage, nBytes):
+        """Write a stage output with one exposure file.
+        """
+        outputDir = os.path.join(self.tempDir.name, stage)
+        os.makedirs(os.path.join(outputDir, "postISRCCD", "2020-01-28"))
+        with open(os.path.join(outputDir, "postISRCCD", "2020-01-28", "exposure.fits"), "wb") as f:
+            f.write(b"\0"*nBytes)
+        with open(os.path.join(outputDir, ".fingerprint"), "w") as f:
+            f.write("fingerprint")
+        return outputDir
+
+    def testSelectEvictions(self):
+        footprints = {"ptcIsr": 300, "crosstalkIsr": 100, "defectIsr": 200, "ptcGen": 50}
+        candidates = ["crosstalkIsr", "defectIsr", "ptcIsr"]
+        # Largest first, and only as many as needed to fit the budget.
+        self.assertEqual(selectEvictions(footprints, candidates, 300), ["ptcIsr", "defectIsr"])
+        self.assertEqual(selectEvictions(footprints, candidates, 600), ["ptcIsr"])
+        self.assertEqual(selectEvictions(footprints, candidates, 650), [])
+        # Only candidates are evicted, even if the budget is not met.
+        self.assertEqual(selectEvictions(footprints, ["crosstalkIsr"], 0), ["crosstalkIsr"])
+
+    def testEvictStage(self):
+        outputDir = self.makeStage("ptcIsr", 100000)
+        provenance = writeProvenance(outputDir, "ptcIsr", "fingerprint", {"upstream": {"flat": "abc"}})
+        self.assertGreaterEqual(provenance["bytes"], 100000)
+        self.assertEqual(measureFootprint(outputDir)[1], 3)
+        self.assertEqual(getRerunState(outputDir), "available")
+
+        freed = evictStage(outputDir, reason="test")
+        self.assertGreaterEqual(freed, 100000)
+        self.assertEqual(sorted(os.listdir(outputDir)), [".fingerprint", ".provenance.json"])
+        evicted = readProvenance(outputDir)
+        self.assertTrue(evicted["evicted"])
+        self.assertEqual(evicted["inputs"], {"upstream": {"flat": "abc"}})
+        self.assertEqual(getRerunState(outputDir), "evicted")
+
+    def testRerunStates(self):
+        self.assertEqual(getRerunState(os.path.join(self.tempDir.name, "unbuilt")), "missing")
+        outputDir = os.path.join(self.tempDir.name, "fused")
+        os.makedirs(outputDir)
+        os.symlink(os.path.join(self.tempDir.name, "removedScratch"),
+                   os.path.join(outputDir, "postISRCCD"))
+        self.assertEqual(getRerunState(outputDir), "released")
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,127 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import lsst.utils.tests
+
+from lsst.ci.cpp.isrCache import IsrCache, getIsrCacheSize
+
+
+class FakeConfig:
+    """IsrTaskConfig stand-in with every calibration disabled.
+    """
+
+    def saveToStream(self, stream):
+        stream.write("config.doBias=False\n")
+
+
+class FakeDataRef:
+    """Data reference without files.
+    """
+
+    def __init__(self, dataId):
+        self.dataId = dataId
+
+    def get(self, datasetType):
+        raise KeyError(datasetType)
+
+
+class IsrCacheTestCase(lsst.utils.tests.TestCase):
+    """Test the cache keys and the size limit of the ISR cache.
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempDir.cleanup)
+
+    def writeEntry(self, cache, key, nBytes, age):
+        """Write a cache entry last used ``age`` seconds ago.
+        """
+        path = cache.getPath(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\0"*nBytes)
+        used = time.time() - age
+        os.utime(path, (used, used))
+        return path
+
+    def testMakeKey(self):
+        cache = IsrCache(self.tempDir.name)
+        dataRef = FakeDataRef({"expId": 2020012800028, "detector": 0})
+        key = cache.makeKey(FakeConfig(), dataRef)
+        self.assertEqual(cache.makeKey(FakeConfig(), FakeDataRef(dict(dataRef.dataId))), key)
+        self.assertNotEqual(cache.makeKey(FakeConfig(), FakeDataRef(dict(dataRef.dataId, detector=1))),
+                            key)
+        # Setting up another version of a stack package changes the key.
+        for variable in ("SETUP_AFW", "SETUP_OBS_LSST"):
+            with self.subTest(variable=variable):
+                with unittest.mock.patch.dict(os.environ, {variable: "afw other -f Linux64 -Z /other"}):
+                    self.assertNotEqual(cache.makeKey(FakeConfig(), dataRef), key)
+
+    def testGetIsrCacheSize(self):
+        with unittest.mock.patch.dict(os.environ, {"CI_CPP_ISR_CACHE_GB": "0.5"}):
+            self.assertEqual(getIsrCacheSize(), 2**29)
+        with unittest.mock.patch.dict(os.environ, {"CI_CPP_ISR_CACHE_GB": "0"}):
+            self.assertIsNone(getIsrCacheSize())
+            self.assertIsNone(IsrCache(self.tempDir.name).maxBytes)
+        with unittest.mock.patch.dict(os.environ, {"CI_CPP_ISR_CACHE_GB": ""}):
+            self.assertEqual(getIsrCacheSize(), 20*2**30)
+
+    def testPrune(self):
+        """The least recently used entries are removed until the cache
+        fits, except those used recently.
+        """
+        cache = IsrCache(self.tempDir.name, maxBytes=250)
+        paths = {key: self.writeEntry(cache, key, 100, age)
+                 for key, age in [("aa01", 4000), ("ab02", 5000), ("bb03", 7000), ("cc04", 10)]}
+        self.assertEqual(cache.prune(), 200)
+        self.assertFalse(os.path.exists(paths["bb03"]))
+        self.assertFalse(os.path.exists(paths["ab02"]))
+        self.assertTrue(os.path.exists(paths["aa01"]))
+        self.assertEqual(cache.prune(), 0)
+
+        # Recently used entries are kept even over the limit.
+        cache.maxBytes = 0
+        self.assertEqual(cache.prune(), 100)
+        self.assertTrue(os.path.exists(paths["cc04"]))
+        self.assertEqual(cache.prune(minAge=0.0), 100)
+        self.assertFalse(os.path.exists(paths["cc04"]))
+
+        cache.maxBytes = None
+        self.writeEntry(cache, "dd05", 100, 10000)
+        self.assertEqual(cache.prune(minAge=0.0), 0)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
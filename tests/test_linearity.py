@@ -18,16 +18,62 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
 import unittest
+
+import numpy as np
+
 import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+from lsst.ci.cpp.detectors import getDetectorList, loadManifest
+from lsst.ci.cpp.footprint import getRerunState
+from lsst.ci.cpp.linearity import LinearityAccumulator, measureAmpMedians
+from lsst.ci.cpp.ptcGain import parseExposurePairs
+from lsst.ci.cpp.sharedButler import getSharedButler
+
+
+# Largest fractional deviation from the fit of a linearizable flat.
+TOLERANCE = 0.01
 
 
 # TODO: DM-26396
 #       Update these tests to validate calibration construction.
 class LinearityTestCases(lsst.utils.tests.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Fit the linearity of the ptcIsr flat sequence.
+
+        The flats are read one at a time, and only the median of each
+        amplifier is kept.
+        """
+        repoDir = os.path.join(getPackageDir('ci_cpp_gen2'), "DATA")
+        ptcIsrDir = os.path.join(repoDir, "ptcIsr")
+        state = getRerunState(ptcIsrDir)
+        if state == "missing":
+            raise unittest.SkipTest("ptcIsr exposures are not available.")
+        if state != "available":
+            raise unittest.SkipTest(f"The ptcIsr exposures were {state} by the build; restore "
+                                    "them with scons restore-ptcIsr tests.")
+
+        manifest = loadManifest()
+        exposures = [expId for pair in parseExposurePairs(manifest['ptcExposurePairs']) for expId in pair]
+        butler = getSharedButler(ptcIsrDir, os.path.join(repoDir, "calibs"))
+
+        cls.detectors = getDetectorList(manifest)
+        cls.fits = {}
+        for detector in cls.detectors:
+            accumulator = None
+            for expId in exposures:
+                exposure = butler.get('postISRCCD', dataId={'expId': expId, 'detector': detector})
+                ampNames, medians = measureAmpMedians(exposure)
+                if accumulator is None:
+                    accumulator = LinearityAccumulator(ampNames)
+                accumulator.add(exposure.getInfo().getVisitInfo().getExposureTime(), medians)
+            cls.fits[detector] = accumulator.fit(tolerance=TOLERANCE)
 
     def test_setup_independentFrame(self):
-        """Ill defined/is the construction step.
+        """Fit the non-linearity of every amplifier.
 
         DMTN-101 7.1
 
@@ -36,10 +82,16 @@ class LinearityTestCases(lsst.utils.tests.TestCase):
         median intensity, and fit a suitable functional form to
         measure the non-linearity.
         """
-        pass
+        for detector in self.detectors:
+            for ampName, fit in self.fits[detector].items():
+                with self.subTest(detector=detector, amp=ampName):
+                    self.assertTrue(np.all(np.isfinite(fit['coefficients'])))
+                    self.assertGreater(fit['coefficients'][1], 0.0)
+                    linearizable = fit['linearizable']
+                    self.assertLess(np.max(np.abs(fit['residuals'][linearizable])), TOLERANCE)
 
     def test_independentFrameLevel(self):
-        """Ill defined.
+        """Check where the flats can no longer be linearized.
 
         Notes
         -----
@@ -49,7 +101,13 @@ class LinearityTestCases(lsst.utils.tests.TestCase):
         which the data cannot be reliably linearised.
 
         """
-        pass
+        for detector in self.detectors:
+            for ampName, fit in self.fits[detector].items():
+                with self.subTest(detector=detector, amp=ampName):
+                    # The sequence should be linearizable over most of
+                    # its range.
+                    self.assertTrue(np.isfinite(fit['turnoff']))
+                    self.assertGreaterEqual(fit['turnoff'], 0.5*np.nanmax(fit['medians']))
 
     def test_independentFrameSigma(self):
         """Missing data.
@@ -82,6 +140,63 @@ class LinearityTestCases(lsst.utils.tests.TestCase):
         pass
 
 
+class LinearityFitTestCase(lsst.utils.tests.TestCase):
+    """Test the linearity fit on synthetic flat pairs.
+    """
+
+    def setUp(self):
+        self.rng = np.random.default_rng(20200128)
+        self.ampNames = [f"C{index:02d}" for index in range(16)]
+        self.gains = self.rng.uniform(0.9, 1.1, len(self.ampNames))
+        self.saturation = 80000.0
+
+    def makeAccumulator(self, times, noise):
+        """Add a pair of flats at every exposure time, with a quadratic
+        non-linearity of 0.5% at 25 s and a hard saturation.
+        """
+        accumulator = LinearityAccumulator(self.ampNames)
+        for time in times:
+            for _ in range(2):
+                signal = 3000.0*time*self.gains*(1.0 - 2e-4*time)
+                accumulator.add(time, np.minimum(signal, self.saturation)
+                                + self.rng.normal(0.0, noise, len(self.ampNames)))
+        return accumulator
+
+    def testNoisyPairs(self):
+        """The second flat of a pair is often lower than the first, which
+        must not end the usable sequence.
+        """
+        times = np.linspace(1.0, 30.0, 10)
+        fits = self.makeAccumulator(times, noise=20.0).fit(tolerance=TOLERANCE)
+        for index, (ampName, fit) in enumerate(fits.items()):
+            with self.subTest(amp=ampName):
+                self.assertTrue(np.all(np.isfinite(fit['coefficients'])))
+                self.assertFloatsAlmostEqual(fit['coefficients'][1], 3000.0*self.gains[index], rtol=0.02)
+                self.assertLessEqual(fit['turnoff'], self.saturation + 100.0)
+                self.assertGreaterEqual(fit['turnoff'], 0.5*self.saturation)
+
+    def testSaturationTrimmed(self):
+        """Flats past saturation are excluded from the fit.
+        """
+        times = np.linspace(1.0, 40.0, 12)
+        fits = self.makeAccumulator(times, noise=20.0).fit(tolerance=TOLERANCE)
+        for ampName, fit in fits.items():
+            with self.subTest(amp=ampName):
+                linearizable = fit['linearizable']
+                self.assertLess(np.max(np.abs(fit['residuals'][linearizable])), TOLERANCE)
+                self.assertEqual(np.max(fit['medians'][linearizable]), fit['turnoff'])
+                # Every amplifier saturates before 30 s.
+                self.assertFalse(np.any(linearizable[fit['exposureTimes'] > 30.0]))
+
+    def testTooFewFlats(self):
+        """Amplifiers with too few flats give NaN.
+        """
+        fits = self.makeAccumulator([1.0, 2.0], noise=0.0).fit()
+        for fit in fits.values():
+            self.assertTrue(np.all(np.isnan(fit['coefficients'])))
+            self.assertTrue(np.isnan(fit['turnoff']))
+
+
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
 
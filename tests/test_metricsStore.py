@@ -0,0 +1,154 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import glob
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+
+from lsst.ci.cpp.metricsStore import (MetricsRecorder, compactMetrics, diffRuns, listRuns, loadMetrics,
+                                      trendMetrics)
+
+
+class MetricsStoreTestCase(lsst.utils.tests.TestCase):
+    """Test recording, querying and compacting the metrics store.
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempDir.cleanup)
+        self.storeDir = self.tempDir.name
+
+    def writeRun(self, run, timestamp, values, nShards=1):
+        """Write the metrics of a run, as values keyed by (test, detector,
+        amp, metric), split between shards.
+        """
+        items = list(values.items())
+        for shard in range(nShards):
+            recorder = MetricsRecorder(self.storeDir, run)
+            recorder.timestamp = timestamp
+            for (test, detector, amp, metric), value in items[shard::nShards]:
+                recorder.record(test, metric, value, detector, amp)
+            recorder.flush()
+
+    def writeRuns(self):
+        """Write three runs with a drifting gain and a constant noise.
+        """
+        for index, run in enumerate(["build-3", "build-1", "build-2"]):
+            values = {("test_ptc", 0, "C00", "gain"): 1.0 + 0.1*index,
+                      ("test_ptc", 0, "C01", "gain"): 2.0,
+                      ("test_ptc", 0, "C00", "noise"): 5.0}
+            if index == 2:
+                values[("test_bias", 0, "", "mean")] = 0.5
+                del values[("test_ptc", 0, "C01", "gain")]
+            self.writeRun(run, 1000.0 + index, values, nShards=2)
+
+    def testListRuns(self):
+        self.assertEqual(listRuns(loadMetrics(self.storeDir)), [])
+        self.writeRuns()
+        metrics = loadMetrics(self.storeDir)
+        self.assertEqual(len(metrics["value"]), 9)
+        # In time order, not by name.
+        self.assertEqual(listRuns(metrics), ["build-3", "build-1", "build-2"])
+        selected = loadMetrics(self.storeDir, runs=["build-1"])
+        self.assertEqual(listRuns(selected), ["build-1"])
+        self.assertEqual(len(selected["value"]), 3)
+
+    def testDiffRuns(self):
+        self.writeRuns()
+        # A later shard of a run overrides an earlier value.
+        self.writeRun("build-2", 1003.0, {("test_ptc", 0, "C00", "noise"): 3.0})
+        diff = diffRuns(loadMetrics(self.storeDir), "build-3", "build-2")
+        self.assertEqual(list(diff["metric"]), ["noise", "gain"])
+        self.assertEqual(list(diff["amp"]), ["C00", "C00"])
+        self.assertFloatsAlmostEqual(diff["valueA"], np.array([5.0, 1.0]))
+        self.assertFloatsAlmostEqual(diff["valueB"], np.array([3.0, 1.2]))
+        self.assertFloatsAlmostEqual(diff["delta"], np.array([-2.0, 0.2]), atol=1e-12)
+        self.assertFloatsAlmostEqual(diff["relative"], np.array([-0.4, 0.2]), atol=1e-12)
+        self.assertEqual(list(diff["onlyA"]), ["test_ptc|0|C01|gain"])
+        self.assertEqual(list(diff["onlyB"]), ["test_bias|0||mean"])
+
+    def testTrendMetrics(self):
+        self.writeRuns()
+        trend = trendMetrics(loadMetrics(self.storeDir), metric="gain")
+        self.assertEqual(list(trend["runs"]), ["build-3", "build-1", "build-2"])
+        self.assertEqual(list(trend["keys"]), ["test_ptc|0|C00|gain", "test_ptc|0|C01|gain"])
+        self.assertEqual(trend["values"].shape, (3, 2))
+        self.assertTrue(np.isnan(trend["values"][2, 1]))
+        self.assertFloatsAlmostEqual(trend["slope"], np.array([0.1, 0.0]), atol=1e-12)
+        self.assertFloatsAlmostEqual(trend["mean"], np.array([1.1, 2.0]), atol=1e-12)
+        self.assertFloatsAlmostEqual(trend["std"][1], 0.0, atol=1e-12)
+
+        trend = trendMetrics(loadMetrics(self.storeDir), test="bias")
+        self.assertEqual(list(trend["runs"]), ["build-2"])
+        self.assertTrue(np.isnan(trend["slope"][0]))
+
+    def testCompactMetrics(self):
+        self.assertIsNone(compactMetrics(self.storeDir))
+        self.writeRuns()
+        before = loadMetrics(self.storeDir)
+        path = compactMetrics(self.storeDir)
+        self.assertEqual(glob.glob(os.path.join(self.storeDir, "*.npz")), [path])
+        self.assertEqual(compactMetrics(self.storeDir), path)
+        after = loadMetrics(self.storeDir)
+        for name, array in before.items():
+            np.testing.assert_array_equal(np.sort(after[name]), np.sort(array))
+        # Compacted runs are still found by name.
+        self.assertEqual(len(loadMetrics(self.storeDir, runs=["build-1"])["value"]), 3)
+
+    def testConcurrentCompaction(self):
+        """Concurrent compactions neither fail nor duplicate metrics.
+        """
+        self.writeRuns()
+        nRows = len(loadMetrics(self.storeDir)["value"])
+        errors = []
+
+        def compact():
+            try:
+                compactMetrics(self.storeDir)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=compact) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(glob.glob(os.path.join(self.storeDir, "*.npz"))), 1)
+        self.assertEqual(len(loadMetrics(self.storeDir)["value"]), nRows)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -18,17 +18,70 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
 import unittest
 
 import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+from lsst.ci.cpp.detectors import getDetectorList, loadManifest
+from lsst.ci.cpp.footprint import getRerunState
+from lsst.ci.cpp.metricsStore import recordMetric
+from lsst.ci.cpp.ptcGain import PairGainAccumulator, measurePairStatistics, parseExposurePairs
+from lsst.ci.cpp.sharedButler import getSharedButler
+from lsst.ci.cpp.tiers import scaleThreshold
+
+
+# Side of the bins summed before measuring pair differences, to recover
+# the variance moved into pixel correlations by the brighter-fatter
+# effect.
+BIN_SIZE = 4
 
 
 # TODO: DM-26396
 #       Update these tests to validate calibration construction.
 class PtcTestCases(lsst.utils.tests.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Measure pair-difference gains from the ptcIsr exposures.
+
+        The pairs are processed one at a time, and only per-amplifier
+        statistics are kept.
+        """
+        repoDir = os.path.join(getPackageDir('ci_cpp_gen2'), "DATA")
+        calibDir = os.path.join(repoDir, "calibs")
+        ptcIsrDir = os.path.join(repoDir, "ptcIsr")
+        ptcGenDir = os.path.join(repoDir, "ptcGen")
+        state = getRerunState(ptcIsrDir)
+        if state == "missing" or not os.path.exists(ptcGenDir):
+            raise unittest.SkipTest("ptcIsr exposures or ptcGen products are not available.")
+        if state != "available":
+            raise unittest.SkipTest(f"The ptcIsr exposures were {state} by the build; restore "
+                                    "them with scons restore-ptcIsr tests.")
+
+        manifest = loadManifest()
+        pairs = parseExposurePairs(manifest['ptcExposurePairs'])
+        isrButler = getSharedButler(ptcIsrDir, calibDir)
+        ptcButler = getSharedButler(ptcGenDir, calibDir)
+
+        cls.detectors = getDetectorList(manifest)
+        cls.gains = {}
+        cls.ptcDatasets = {}
+        for detector in cls.detectors:
+            accumulator = None
+            for first, second in pairs:
+                exposure1 = isrButler.get('postISRCCD', dataId={'expId': first, 'detector': detector})
+                exposure2 = isrButler.get('postISRCCD', dataId={'expId': second, 'detector': detector})
+                statistics = measurePairStatistics(exposure1, exposure2, binSize=BIN_SIZE)
+                if accumulator is None:
+                    accumulator = PairGainAccumulator(statistics['ampNames'])
+                accumulator.add(statistics)
+            cls.gains[detector] = accumulator.solve()
+            cls.ptcDatasets[detector] = ptcButler.get('photonTransferCurveDataset',
+                                                      dataId={'detector': detector})
 
-    def setup_independentFrame(self):
-        """Ill-defined case.
+    def test_independentFrame(self):
+        """Compare pair-difference gains with the PTC gains.
 
         Notes
         -----
@@ -42,7 +95,15 @@ class PtcTestCases(lsst.utils.tests.TestCase):
         Measure the gain values for each amplifier that minimises
         discontinuities at amp boundaries.
         """
-        pass
+        for detector in self.detectors:
+            ptcGains = self.ptcDatasets[detector].gain
+            for ampName, result in self.gains[detector].items():
+                with self.subTest(detector=detector, amp=ampName):
+                    recordMetric(self.id(), "pairGain", result['gain'], detector, ampName)
+                    recordMetric(self.id(), "ptcGain", ptcGains[ampName], detector, ampName)
+                    self.assertGreaterEqual(result['nPairs'], 2)
+                    self.assertFloatsAlmostEqual(result['gain'], ptcGains[ampName],
+                                                  rtol=scaleThreshold(0.1))
 
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
@@ -0,0 +1,138 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import unittest
+
+import numpy as np
+
+import lsst.afw.cameraGeom as cameraGeom
+import lsst.afw.image as afwImage
+import lsst.geom as geom
+import lsst.utils.tests
+
+from lsst.ci.cpp.ptcGain import PairGainAccumulator, binAmpCube, measurePairStatistics, parseExposurePairs
+
+
+# The robust difference variance of a pair of 200x250 pixel amplifiers
+# scatters by about 1.5% (3% when binned 2x2), so fitted gains are
+# checked to about four times their scatter.
+GAIN_RTOL = 0.05
+
+
+class PtcGainTestCase(lsst.utils.tests.TestCase):
+    """Test the pair-difference gain on synthetic flat pairs.
+    """
+
+    def setUp(self):
+        self.rng = np.random.default_rng(20200128)
+        self.gains = np.array([0.9, 1.0, 1.1, 1.2])
+        self.readNoise = 5.0
+        self.nx, self.ny = 200, 250
+        self.bbox = geom.Box2I(geom.Point2I(0, 0), geom.Extent2I(len(self.gains)*self.nx, self.ny))
+        self.amps = []
+        for index in range(len(self.gains)):
+            builder = cameraGeom.Amplifier.Builder()
+            builder.setName(f"C{index:02d}")
+            builder.setBBox(geom.Box2I(geom.Point2I(index*self.nx, 0), geom.Extent2I(self.nx, self.ny)))
+            self.amps.append(builder.finish())
+        self.ampNames = [amp.getName() for amp in self.amps]
+
+    def makeFlat(self, level):
+        """Make a flat with Poisson noise and read noise, in ADU.
+        """
+        exposure = afwImage.ExposureF(self.bbox)
+        for amp, gain in zip(self.amps, self.gains):
+            electrons = self.rng.poisson(level*gain, (self.ny, self.nx))
+            noise = self.rng.normal(0.0, self.readNoise, (self.ny, self.nx))
+            exposure.image[amp.getBBox()].array[:, :] = electrons/gain + noise
+        return exposure
+
+    def testParseExposurePairs(self):
+        pairs = ["2020012800100,2020012800101", (2020012800102, "2020012800103")]
+        self.assertEqual(parseExposurePairs(pairs),
+                         [(2020012800100, 2020012800101), (2020012800102, 2020012800103)])
+
+    def testBinAmpCube(self):
+        cube = np.arange(2*5*7, dtype=float).reshape(2, 5, 7)
+        self.assertIs(binAmpCube(cube, 1), cube)
+        binned = binAmpCube(cube, 2)
+        self.assertEqual(binned.shape, (2, 2, 3))
+        self.assertEqual(binned[1, 1, 2], cube[1, 2:4, 4:6].sum())
+        cube[0, 0, 0] = np.nan
+        binned = binAmpCube(cube, 2)
+        self.assertTrue(np.isnan(binned[0, 0, 0]))
+        self.assertEqual(np.isnan(binned).sum(), 1)
+
+    def testSolve(self):
+        """The fit recovers the gain and read noise, and stops at the
+        turnoff.
+        """
+        accumulator = PairGainAccumulator(self.ampNames)
+        for level in [1000.0, 5000.0, 10000.0, 20000.0, 40000.0, 60000.0]:
+            # Past the turnoff at 50000 ADU, saturation suppresses the
+            # variance.
+            variance = np.where(level < 50000.0, 2*level/self.gains, 1000.0) + 2*self.readNoise**2
+            accumulator.add({"ampNames": self.ampNames, "mean1": np.full(4, level),
+                             "mean2": np.full(4, level), "varDiff": variance})
+        self.assertEqual(accumulator.nPairs, 6)
+        for maxMean in (None, 45000.0):
+            results = accumulator.solve(maxMean)
+            for ampName, gain in zip(self.ampNames, self.gains):
+                with self.subTest(maxMean=maxMean, amp=ampName):
+                    self.assertFloatsAlmostEqual(results[ampName]["gain"], gain, rtol=1e-9)
+                    self.assertFloatsAlmostEqual(results[ampName]["noise"], self.readNoise, rtol=1e-6)
+                    self.assertEqual(results[ampName]["nPairs"], 5)
+        # Too few pairs give NaN.
+        for result in accumulator.solve(maxMean=1000.0).values():
+            self.assertTrue(np.isnan(result["gain"]))
+        with self.assertRaises(ValueError):
+            accumulator.add({"ampNames": self.ampNames[::-1], "mean1": 0, "mean2": 0, "varDiff": 0})
+
+    def testSyntheticPairs(self):
+        """Measure the gain of Poisson flat pairs, with and without
+        binning.
+        """
+        for binSize in (1, 2):
+            accumulator = PairGainAccumulator(self.ampNames)
+            for level in np.linspace(2000.0, 40000.0, 10):
+                statistics = measurePairStatistics(self.makeFlat(level), self.makeFlat(level*1.01),
+                                                   self.amps, binSize=binSize)
+                self.assertFloatsAlmostEqual(statistics["mean1"], level, rtol=0.01)
+                accumulator.add(statistics)
+            # The pair gains ignore read noise, which is small here.
+            pairGains = np.median(accumulator.getPairGains(), axis=0)
+            self.assertFloatsAlmostEqual(pairGains, self.gains, rtol=GAIN_RTOL)
+            results = accumulator.solve()
+            for ampName, gain in zip(self.ampNames, self.gains):
+                with self.subTest(binSize=binSize, amp=ampName):
+                    self.assertFloatsAlmostEqual(results[ampName]["gain"], gain, rtol=GAIN_RTOL)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
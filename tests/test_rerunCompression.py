@@ -0,0 +1,155 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import lsst.afw.cameraGeom as cameraGeom
+import lsst.afw.image as afwImage
+import lsst.geom as geom
+import lsst.utils.tests
+
+from lsst.ci.cpp.ptcGain import measurePairStatistics
+from lsst.ci.cpp.rerunCompression import compressExposureFile, measureAmpNoise
+
+
+# Quantizing to 1/16 of the noise moves the pair means by a few 1e-6 and
+# the robust difference variances by up to about 0.4%, so they are
+# checked with the tolerance suggested for comparing runs with
+# metricsStore diff.
+MEAN_RTOL = 1e-4
+VARIANCE_RTOL = 0.01
+
+
+class RerunCompressionTestCase(lsst.utils.tests.TestCase):
+    """Test the compression of ISR exposures on synthetic flats.
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempDir.cleanup)
+        self.rng = np.random.default_rng(20200128)
+        self.gains = np.array([0.9, 1.0, 1.1, 1.2])
+        self.readNoise = 5.0
+        self.nx, self.ny = 200, 250
+        self.bbox = geom.Box2I(geom.Point2I(0, 0), geom.Extent2I(len(self.gains)*self.nx, self.ny))
+        self.amps = []
+        for index in range(len(self.gains)):
+            builder = cameraGeom.Amplifier.Builder()
+            builder.setName(f"C{index:02d}")
+            builder.setBBox(geom.Box2I(geom.Point2I(index*self.nx, 0), geom.Extent2I(self.nx, self.ny)))
+            self.amps.append(builder.finish())
+
+    def makeFlat(self, level, name):
+        """Write an ISR-processed flat with Poisson noise and read noise,
+        in ADU, and its variance.
+        """
+        exposure = afwImage.ExposureF(self.bbox)
+        for amp, gain in zip(self.amps, self.gains):
+            electrons = self.rng.poisson(level*gain, (self.ny, self.nx))
+            noise = self.rng.normal(0.0, self.readNoise, (self.ny, self.nx))
+            exposure.image[amp.getBBox()].array[:, :] = electrons/gain + noise
+            exposure.variance[amp.getBBox()].array[:, :] = level/gain + self.readNoise**2
+        path = os.path.join(self.tempDir.name, f"{name}.fits")
+        exposure.writeFits(path)
+        return path
+
+    def testMeasureAmpNoise(self):
+        """The noise is the square root of the median variance, or the
+        pixel-difference noise where there is no variance.
+        """
+        sigmas = [2.0, 8.0]
+        image = np.concatenate([self.rng.normal(100.0, sigma, (300, 400)) for sigma in sigmas], axis=1)
+        # A vignetting gradient does not inflate the difference noise.
+        image += np.linspace(0.0, 500.0, 800)
+        variance = np.concatenate([np.full((300, 400), sigma**2) for sigma in sigmas], axis=1)
+        xy0 = (10, 20)
+        bboxes = [geom.Box2I(geom.Point2I(10 + 400*index, 20), geom.Extent2I(400, 300))
+                  for index in range(len(sigmas))]
+
+        slices, noise = measureAmpNoise(image, variance, bboxes, xy0)
+        self.assertEqual(slices, [(slice(0, 300), slice(0, 400)), (slice(0, 300), slice(400, 800))])
+        self.assertFloatsAlmostEqual(noise, np.array(sigmas), rtol=1e-12)
+
+        # Pixels that are NaN in the image are ignored in the variance.
+        image[:, :200] = np.nan
+        variance[:, :200] = 1e6
+        slices, noise = measureAmpNoise(image, variance, bboxes, xy0)
+        self.assertFloatsAlmostEqual(noise, np.array(sigmas), rtol=1e-12)
+
+        slices, noise = measureAmpNoise(image, np.zeros_like(variance), bboxes, xy0)
+        self.assertFloatsAlmostEqual(noise, np.array(sigmas), rtol=0.05)
+
+        slices, noise = measureAmpNoise(image, np.full_like(variance, np.nan))
+        self.assertEqual(slices, [(slice(None), slice(None))])
+        self.assertEqual(noise.shape, (1, ))
+
+    def testLossless(self):
+        path = self.makeFlat(10000.0, "flat")
+        original = afwImage.ExposureF(path)
+        record = compressExposureFile(path, "lossless")
+        self.assertTrue(record["kept"])
+        self.assertLess(record["bytesAfter"], record["bytesBefore"])
+        self.assertEqual(record["noiseFraction"], 0.0)
+        compressed = afwImage.ExposureF(path)
+        self.assertImagesEqual(compressed.image, original.image)
+        self.assertImagesEqual(compressed.variance, original.variance)
+        self.assertMasksEqual(compressed.mask, original.mask)
+
+    def testLossy(self):
+        """Quantized flat pairs give the same pair statistics, from which
+        the PTC gains are fitted, within tolerance.
+        """
+        for level in (1000.0, 20000.0):
+            with self.subTest(level=level):
+                paths = [self.makeFlat(level, "flat1"), self.makeFlat(level*1.01, "flat2")]
+                before = measurePairStatistics(*[afwImage.ExposureF(path) for path in paths], self.amps)
+                for path in paths:
+                    record = compressExposureFile(path, "lossy", quantizeLevel=16.0, maxNoiseFraction=0.1)
+                    self.assertTrue(record["kept"])
+                    self.assertLessEqual(record["noiseFraction"], 0.1)
+                    self.assertLess(record["bytesAfter"], record["bytesBefore"])
+                after = measurePairStatistics(*[afwImage.ExposureF(path) for path in paths], self.amps)
+                for key in ("mean1", "mean2"):
+                    self.assertFloatsAlmostEqual(after[key], before[key], rtol=MEAN_RTOL)
+                self.assertFloatsAlmostEqual(after["varDiff"], before["varDiff"], rtol=VARIANCE_RTOL)
+
+        # A deviation limit below the quantization noise leaves the file.
+        path = self.makeFlat(1000.0, "flat3")
+        before = os.path.getsize(path)
+        record = compressExposureFile(path, "lossy", quantizeLevel=2.0, maxNoiseFraction=0.01)
+        self.assertFalse(record["kept"])
+        self.assertEqual(os.path.getsize(path), before)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,130 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+
+from lsst.ci.cpp.syntheticRaws import SensorModel, _parseSection, makeAmpPixels, scaleManifest
+
+
+class SyntheticRawsTestCase(lsst.utils.tests.TestCase):
+    """Test the simulated raws and the scaled manifest.
+    """
+
+    def setUp(self):
+        self.model = SensorModel(darkCurrent=0.5, flatRate=1000.0, skyRate=50.0, vignetting=0.2)
+        # A 2x2 amplifier detector: the data section of each raw
+        # amplifier is 100x90 pixels, followed by 20 columns and 10 rows
+        # of overscan.
+        self.shape = (100, 120)
+        self.dataSec = "[1:100,1:90]"
+        self.detSize = (180, 200)
+
+    def makeAmp(self, imageType, exposureTime, detSec="[1:100,1:90]", ampIndex=1, seed=1):
+        return makeAmpPixels(self.shape, self.dataSec, detSec, self.detSize, imageType, exposureTime,
+                             self.model, ampIndex, np.random.default_rng(seed))
+
+    def testParseSection(self):
+        self.assertEqual(_parseSection("[1:100,1:90]"), (slice(0, 90), slice(0, 100), False, False))
+        self.assertEqual(_parseSection(" [200:101,180:91] "),
+                         (slice(90, 180), slice(100, 200), True, True))
+        self.assertEqual(_parseSection("[5:5,3:1]"), (slice(0, 3), slice(4, 5), True, False))
+
+    def testScaleManifest(self):
+        manifest = {"flatExposures": [2020012800022, 2020012800023],
+                    "ptcExposurePairs": ["2020012800022,2020012800023"],
+                    "scienceVisits": [2020012800028],
+                    "detectors": [0],
+                    "camera": "LATISS"}
+        scaled = scaleManifest(manifest, 3, 100)
+        self.assertEqual(scaled["flatExposures"],
+                         [2020012800022, 2020012800023, 2020012800122, 2020012800123,
+                          2020012800222, 2020012800223])
+        self.assertEqual(scaled["ptcExposurePairs"],
+                         ["2020012800022,2020012800023", "2020012800122,2020012800123",
+                          "2020012800222,2020012800223"])
+        self.assertEqual(scaled["scienceVisits"], [2020012800028, 2020012800128, 2020012800228])
+        # Other entries are kept as they are.
+        self.assertEqual(scaled["detectors"], [0])
+        self.assertEqual(scaled["camera"], "LATISS")
+        self.assertEqual(scaleManifest(manifest, 1, 100), manifest)
+
+    def testBias(self):
+        biasLevel, readNoise, gain, response = self.model.getAmpParameters(1)
+        pixels = self.makeAmp("BIAS", 0.0)
+        self.assertEqual(pixels.dtype, np.int32)
+        self.assertEqual(pixels.shape, self.shape)
+        # Rounding adds 1/12 ADU**2 of variance.
+        self.assertFloatsAlmostEqual(pixels.mean(), biasLevel, atol=0.1)
+        self.assertFloatsAlmostEqual(pixels.std(), np.sqrt(readNoise**2 + 1/12), rtol=0.02)
+        # The noise is reproducible from the generator.
+        np.testing.assert_array_equal(self.makeAmp("BIAS", 0.0), pixels)
+        self.assertFalse(np.array_equal(self.makeAmp("BIAS", 0.0, seed=2), pixels))
+
+    def testDark(self):
+        biasLevel, readNoise, gain, response = self.model.getAmpParameters(1)
+        pixels = self.makeAmp("DARK", 100.0)
+        electrons = (pixels[:90, :100].mean() - biasLevel)*gain
+        self.assertFloatsAlmostEqual(electrons, 100.0*self.model.darkCurrent, rtol=0.05)
+        # The overscan only holds the bias.
+        self.assertFloatsAlmostEqual(pixels[90:, :].mean(), biasLevel, atol=0.5)
+        self.assertFloatsAlmostEqual(pixels[:, 100:].mean(), biasLevel, atol=0.5)
+
+    def testFlat(self):
+        """The illumination of a flat falls off from the detector centre,
+        following the detector section of the amplifier.
+        """
+        biasLevel, readNoise, gain, response = self.model.getAmpParameters(1)
+        exposureTime = 2.0
+        for detSec, centre, corner in (("[1:100,1:90]", np.s_[70:90, 80:100], np.s_[:20, :20]),
+                                       ("[100:1,90:1]", np.s_[:20, :20], np.s_[70:90, 80:100])):
+            with self.subTest(detSec=detSec):
+                pixels = self.makeAmp("FLAT", exposureTime, detSec)
+                signal = {}
+                for name, block in (("centre", centre), ("corner", corner)):
+                    signal[name] = (pixels[block].mean() - biasLevel)*gain
+                # The blocks are about 0.05 and 0.8 of the way from the
+                # centre to the corner, in squared radius.
+                rate = self.model.flatRate*exposureTime*response
+                self.assertFloatsAlmostEqual(signal["centre"], rate*(1 - 0.2*0.05), rtol=0.01)
+                self.assertFloatsAlmostEqual(signal["corner"], rate*(1 - 0.2*0.8), rtol=0.01)
+                self.assertFloatsAlmostEqual(pixels[90:, :].mean(), biasLevel, atol=0.5)
+
+        # Other exposures are illuminated by the sky.
+        pixels = self.makeAmp("OBJECT", exposureTime)
+        signal = (pixels[70:90, 80:100].mean() - biasLevel)*gain
+        self.assertFloatsAlmostEqual(signal, self.model.skyRate*exposureTime*response*(1 - 0.2*0.05),
+                                     rtol=0.05)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,130 @@
+# This file is part of ci_cpp_gen2.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import lsst.utils.tests
+
+from lsst.ci.cpp.tiers import (DEFAULT_TIER, TIERS, applyTier, getTier, scaleThreshold, subsample,
+                               writeTierFile)
+
+
+class TiersTestCase(lsst.utils.tests.TestCase):
+    """Test the selection of the exposures of each tier.
+    """
+
+    def setUp(self):
+        self.manifest = {
+            "detectors": [0],
+            "biasExposures": list(range(2020012800007, 2020012800017)),
+            "darkExposures": list(range(2020012800017, 2020012800022)),
+            "flatExposures": list(range(2020012800022, 2020012800029)),
+            "scienceVisits": [2020012800028, 2020012800029],
+            "ptcExposurePairs": [f"{2020012800100 + 2*index}^{2020012800101 + 2*index}"
+                                 for index in range(13)],
+            "camera": "LATISS",
+        }
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempDir.cleanup)
+
+    def testSubsampleHalf(self):
+        """Keeping half of the items is the same as taking every other
+        one.
+        """
+        for nItems in range(20):
+            with self.subTest(nItems=nItems):
+                self.assertEqual(subsample(range(nItems), 0.5), list(range(nItems))[::2])
+
+    def testSubsampleCount(self):
+        items = list(range(10))
+        self.assertEqual(subsample(items, None), items)
+        self.assertEqual(subsample(items, 20), items)
+        self.assertEqual(subsample(items, 0), [])
+        self.assertEqual(subsample(items, 1), [0])
+        self.assertEqual(subsample(items, 3), [0, 4, 7])
+        for count in range(1, 11):
+            with self.subTest(count=count):
+                selected = subsample(items, count)
+                self.assertEqual(len(selected), count)
+                self.assertEqual(selected[0], 0)
+                self.assertEqual(selected, sorted(set(selected)))
+
+    def testStandardTier(self):
+        """The standard tier keeps every exposure, and the brighter-fatter
+        kernel uses every other PTC pair.
+        """
+        selected = applyTier(self.manifest, "standard")
+        self.assertEqual(selected["bfkExposurePairs"], self.manifest["ptcExposurePairs"][::2])
+        for key, value in self.manifest.items():
+            self.assertEqual(selected[key], value)
+        # The manifest itself is not modified.
+        self.assertNotIn("bfkExposurePairs", self.manifest)
+
+    def testSmokeTier(self):
+        selected = applyTier(self.manifest, "smoke")
+        for key, value in TIERS["smoke"].items():
+            if key in self.manifest:
+                with self.subTest(key=key):
+                    self.assertEqual(len(selected[key]), min(value, len(self.manifest[key])))
+                    self.assertEqual(selected[key][0], self.manifest[key][0])
+        self.assertEqual(len(selected["bfkExposurePairs"]), TIERS["smoke"]["bfkExposurePairs"])
+        self.assertTrue(set(selected["bfkExposurePairs"]) <= set(selected["ptcExposurePairs"]))
+        self.assertEqual(selected["detectors"], self.manifest["detectors"])
+        self.assertEqual(selected["camera"], self.manifest["camera"])
+
+    def testFullTier(self):
+        selected = applyTier(self.manifest, "full")
+        self.assertEqual(selected["bfkExposurePairs"], self.manifest["ptcExposurePairs"])
+        self.assertEqual(scaleThreshold(0.05, "full"), 0.05)
+        self.assertEqual(scaleThreshold(0.05, "smoke"), 0.1)
+
+    def testUnknownTier(self):
+        with self.assertRaises(ValueError):
+            applyTier(self.manifest, "nightly")
+
+    def testGetTier(self):
+        """The environment overrides the tier recorded by the build.
+        """
+        tierFile = os.path.join(self.tempDir.name, "DATA", "tier.yaml")
+        with unittest.mock.patch.dict(os.environ, {"CI_CPP_TIER": ""}):
+            self.assertEqual(getTier(tierFile), DEFAULT_TIER)
+            writeTierFile(tierFile, "smoke", applyTier(self.manifest, "smoke"))
+            self.assertEqual(getTier(tierFile), "smoke")
+        with unittest.mock.patch.dict(os.environ, {"CI_CPP_TIER": "full"}):
+            self.assertEqual(getTier(tierFile), "full")
+        with unittest.mock.patch.dict(os.environ, {"CI_CPP_TIER": "nightly"}):
+            with self.assertRaises(ValueError):
+                getTier(tierFile)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()